@@ -1,16 +1,61 @@
 # Contains scripts to assist with interacting with the start.gg API.
 # Requires a file "smashgg.key" in the same directory with your start.gg API key inside.
 
-import requests 
+import hashlib
+import json
+import os
 import re 
+import threading
 import time
+import ultrank_metrics
 
-SMASH_GG_ENDPOINT = 'https://api.smash.gg/gql/alpha'
+# The endpoint can be pointed elsewhere (e.g. at ultrank_mock_server.py) through this environment variable
+SMASH_GG_ENDPOINT = os.environ.get('STARTGG_ENDPOINT', 'https://api.smash.gg/gql/alpha')
 
-ggkeyfile = open('smashgg.key')
-ggkey = ggkeyfile.read()
-ggkeyfile.close()
-ggheader = {"Authorization": "Bearer " + ggkey}
+# seconds to wait before retrying a failed request
+RETRY_SLEEP = 60
+
+# start.gg allows this many requests a minute for each key. Requests sent by this process are
+# spaced out to stay under it, however many threads send them (None sends them right away).
+RATE_LIMIT_PER_MINUTE = 80
+
+# Page sizes learned by paginate for each query shape are kept in this file between runs. It can
+# be moved through this environment variable, or set to '' to only keep them while running (None).
+PAGE_SIZES_FILE = os.environ.get('ULTRANK_PAGE_SIZES', os.path.join('tts_values', 'page_sizes.json')) or None
+
+# largest page size paginate will try
+MAX_PAGE_SIZE = 500
+
+# The key is read from smashgg.key when the first request is sent
+ggheader = None
+
+# Reuse connections across requests. requests is only imported once a request is sent.
+session = None
+session_lock = threading.Lock()
+
+# Requests currently being sent, keyed by (query, variables). Identical requests made
+# while one is in flight wait for its response instead of being sent again.
+in_flight = {}
+in_flight_lock = threading.Lock()
+
+# Earliest time the next request can be sent without going over RATE_LIMIT_PER_MINUTE
+next_request_time = 0
+rate_limit_lock = threading.Lock()
+
+# 'requests' counts requests sent to start.gg, 'response_bytes' the size of their responses,
+# 'retries' the ones that failed and were retried, 'sleep_seconds' the time spent waiting to
+# retry, 'throttle_seconds' the time spent waiting for the rate limit, and 'coalesced' the
+# requests answered by another identical request that was in flight
+request_stats = {'requests': 0, 'response_bytes': 0, 'retries': 0, 'sleep_seconds': 0, 'throttle_seconds': 0,
+                 'coalesced': 0}
+
+# Seconds each thread has spent waiting on the network, including retries and coalesced requests
+network_wait = threading.local()
+request_stats_lock = threading.Lock()
+
+# query shape -> what paginate learned about its page sizes
+page_sizes = None
+page_sizes_lock = threading.Lock()
 
 startgg_slug_regex = re.compile(
     r'tournament\/[a-z0-9\-_]+\/events?\/[a-z0-9\-_]+')
@@ -19,8 +64,107 @@ startgg_slug_regex = re.compile(
 class InvalidEventUrlException(Exception):
     pass
 
+
+class InFlightRequest:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = {}
+
+
 def send_request(query, variables, quiet=False):
-    # Sends a request to the startgg server.
+    # Sends a request to the startgg server, or waits for an identical request that's already being sent.
+    # The same response is returned to every caller, so it shouldn't be modified.
+    started = time.time()
+    key = (query, variables)
+
+    with in_flight_lock:
+        request = in_flight.get(key)
+        waiting = request is not None
+
+        if waiting:
+            count_request_stat('coalesced')
+            ultrank_metrics.startgg_coalesced.inc()
+        else:
+            request = InFlightRequest()
+            in_flight[key] = request
+
+    if waiting:
+        request.done.wait()
+        add_network_wait(time.time() - started)
+        return request.response
+
+    try:
+        request.response = post_request(query, variables, quiet)
+    finally:
+        with in_flight_lock:
+            del in_flight[key]
+
+        request.done.set()
+        add_network_wait(time.time() - started)
+
+    return request.response
+
+
+def add_network_wait(seconds):
+    network_wait.seconds = thread_network_wait() + seconds
+
+
+def thread_network_wait():
+    '''
+    Returns the seconds the current thread has spent waiting on the network.
+    '''
+    return getattr(network_wait, 'seconds', 0)
+
+
+def count_request_stat(name, amount=1):
+    with request_stats_lock:
+        request_stats[name] += amount
+
+
+def retry_sleep():
+    count_request_stat('retries')
+    count_request_stat('sleep_seconds', RETRY_SLEEP)
+    ultrank_metrics.startgg_retries.inc()
+    ultrank_metrics.startgg_retry_sleep.inc(amount=RETRY_SLEEP)
+    time.sleep(RETRY_SLEEP)
+
+
+def wait_for_rate_limit():
+    # Takes the next free slot under the rate limit, and waits for it outside the lock
+    # so the threads after it can take theirs
+    global next_request_time
+
+    if RATE_LIMIT_PER_MINUTE is None:
+        return
+
+    with rate_limit_lock:
+        now = time.time()
+        throttle = max(0, next_request_time - now)
+        next_request_time = now + throttle + 60 / RATE_LIMIT_PER_MINUTE
+
+    if throttle > 0:
+        count_request_stat('throttle_seconds', throttle)
+        ultrank_metrics.startgg_throttle.inc(amount=throttle)
+        time.sleep(throttle)
+
+
+def get_session():
+    global session
+
+    with session_lock:
+        if session is None:
+            import requests
+
+            session = requests.Session()
+
+    return session
+
+
+def post_request(query, variables, quiet=False):
+    # Sends a request to the startgg server, retrying until it succeeds.
+    if ggheader is None:
+        refresh_startgg_key()
+
     progress = False
 
     tries = 0
@@ -33,12 +177,31 @@ def send_request(query, variables, quiet=False):
             "variables": variables
         }
         try:
-            response = requests.post(
-                SMASH_GG_ENDPOINT, json=json_payload, headers=ggheader, timeout=60)
+            wait_for_rate_limit()
+
+            count_request_stat('requests')
+            sent = time.time()
+
+            try:
+                response = get_session().post(
+                    SMASH_GG_ENDPOINT, json=json_payload, headers=ggheader, timeout=60)
+            except Exception:
+                ultrank_metrics.startgg_requests.inc('error')
+                raise
+            finally:
+                ultrank_metrics.startgg_latency.observe(time.time() - sent)
+
+            count_request_stat('response_bytes', len(response.content))
+            ultrank_metrics.startgg_requests.inc(str(response.status_code))
+            ultrank_metrics.startgg_response_bytes.inc(amount=len(response.content))
 
             if response.status_code == 200:
                 response_json = response.json()
                 progress = True
+            elif is_complexity_error(response):
+                # Retrying wouldn't help, the caller has to ask for less
+                response_json = response.json()
+                progress = True
             else:
                 tries += 1
                 if response.status_code == 429:
@@ -53,7 +216,7 @@ def send_request(query, variables, quiet=False):
                         print(response.text)
                         print(response.status_code)
 
-                time.sleep(60)
+                retry_sleep()
                 if not quiet:
                     print('retrying')
 
@@ -62,7 +225,7 @@ def send_request(query, variables, quiet=False):
             if not quiet:
                 print(f'try {tries}: requests failure... sleeping then trying again... ', end='', flush=True)
                 print(e)
-            time.sleep(60)
+            retry_sleep()
             if not quiet:
                 print('retrying')
 
@@ -70,6 +233,156 @@ def send_request(query, variables, quiet=False):
     return response_json
 
 
+def is_complexity_error(response):
+    '''
+    Checks whether start.gg rejected a query for returning too many objects.
+    Accepts either a requests response or its decoded JSON.
+    '''
+
+    if not isinstance(response, dict):
+        try:
+            response = response.json()
+        except (AttributeError, ValueError):
+            return False
+
+    if not isinstance(response, dict):
+        return False
+
+    messages = [response.get('message') or ''] + [error.get('message') or '' for error in response.get('errors') or []]
+
+    return any('complexity' in message.lower() for message in messages)
+
+
+def query_shape(query):
+    '''
+    Names a query by its operation name and a hash of its text.
+    '''
+
+    match = re.search(r'query\s+(\w+)', query)
+
+    return '{}:{}'.format(match.group(1) if match else 'query', hashlib.sha1(query.encode('utf-8')).hexdigest()[:8])
+
+
+def load_page_sizes():
+    global page_sizes
+
+    if page_sizes is None:
+        page_sizes = {}
+
+        if PAGE_SIZES_FILE is not None:
+            try:
+                with open(PAGE_SIZES_FILE, encoding='utf-8') as sizes_file:
+                    page_sizes = json.load(sizes_file)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    return page_sizes
+
+
+def learn_page_size(shape, **learned):
+    '''
+    Updates what's known about the page sizes of a query shape, and saves it.
+    '''
+
+    with page_sizes_lock:
+        sizes = load_page_sizes()
+        sizes.setdefault(shape, {'size': None, 'good': None, 'limit': None}).update(learned)
+
+        if PAGE_SIZES_FILE is None:
+            return
+
+        if os.path.dirname(PAGE_SIZES_FILE) != '':
+            os.makedirs(os.path.dirname(PAGE_SIZES_FILE), exist_ok=True)
+
+        # Written to a temporary file first, so other processes never read a partial file
+        temp_path = '{}.{}.tmp'.format(PAGE_SIZES_FILE, os.getpid())
+        with open(temp_path, mode='w', encoding='utf-8') as sizes_file:
+            json.dump(sizes, sizes_file, indent=1, sort_keys=True)
+        os.replace(temp_path, PAGE_SIZES_FILE)
+
+
+def paginate(make_query, get_connection, default_size, max_size=MAX_PAGE_SIZE, quiet=False):
+    '''
+    Yields (response, connection) for every page of a paginated query.
+
+    make_query(page, per_page) generates the query and variables for a page, and
+    get_connection(response) returns the connection holding the page's nodes and
+    pageInfo, or None to stop. Pages start at the size learned for the query's shape
+    (or default_size). A page that's too complex is fetched again in smaller pages.
+    When a query needed several pages, the next one of the same shape tries larger
+    pages, halfway to the smallest size known to be too complex.
+    '''
+
+    shape = query_shape(make_query(1, default_size)[0])
+
+    with page_sizes_lock:
+        learned = dict(load_page_sizes().get(shape, {}))
+
+    # size: page size to start with, good: largest size that worked, limit: smallest size that was too complex
+    size = min(learned.get('size') or default_size, max_size)
+    good = learned.get('good')
+    limit = learned.get('limit')
+
+    # number of nodes in the pages read so far
+    offset = 0
+    shrunk = False
+    several_pages = False
+
+    try:
+        while True:
+            query, variables = make_query(offset // size + 1, size)
+            resp = send_request(query, variables, quiet=quiet)
+
+            if is_complexity_error(resp) and size > 1:
+                limit = size if limit is None else min(limit, size)
+                next_size = good if good is not None and good < size else max(1, size // 2)
+                learn_page_size(shape, size=next_size, limit=limit)
+
+                # Page numbers depend on the page size, so the new size has to divide the
+                # number of nodes already read for the next page to start at the same node
+                size = next_size
+                while offset % size != 0:
+                    size -= 1
+
+                if not quiet:
+                    print('query too complex, retrying with {} per page'.format(size))
+
+                shrunk = True
+                continue
+
+            try:
+                connection = get_connection(resp)
+            except Exception as e:
+                print(e)
+                print(resp)
+                raise e
+
+            if connection is None:
+                break
+
+            if good is None or size > good:
+                good = size
+                learn_page_size(shape, good=good)
+
+            yield resp, connection
+
+            offset += size
+
+            if offset // size >= connection['pageInfo']['totalPages']:
+                break
+
+            several_pages = True
+    finally:
+        if several_pages and not shrunk:
+            larger = min(size * 2, max_size)
+            if limit is not None:
+                larger = min(larger, (size + limit) // 2)
+
+            # Stop probing once the gain would be small
+            if larger > size + max(1, size // 8):
+                learn_page_size(shape, size=larger)
+
+
 def isolate_slug(url):
     match = startgg_slug_regex.search(url)
 
@@ -88,3 +401,11 @@ def refresh_startgg_key():
     ggkey = ggkeyfile.read()
     ggkeyfile.close()
     ggheader = {"Authorization": "Bearer " + ggkey}
+
+
+def set_startgg_key(key):
+    '''
+    Uses the given start.gg key instead of the one in the key file.
+    '''
+    global ggheader
+    ggheader = {"Authorization": "Bearer " + key.strip()}
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The scripts live at the top of the repository instead of in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def page_sizes_in_memory(monkeypatch):
+    """Keeps the page sizes learned during a test from being saved to tts_values."""
+
+    import startgg_toolkit
+
+    monkeypatch.setattr(startgg_toolkit, 'PAGE_SIZES_FILE', None)
+    monkeypatch.setattr(startgg_toolkit, 'page_sizes', None)
@@ -0,0 +1,122 @@
+import copy
+import json
+
+from ultrank_bulk import summary_row, write_summary
+from ultrank_diff import compare_results, diff_runs, player_key
+
+
+def make_result(slug, score=100, should_count=True, potential=None):
+    return {'slug': slug,
+            'tournament': 'Tournament',
+            'event': 'Singles',
+            'should_count': should_count,
+            'should_count_strict': should_count,
+            'score': score,
+            'max_potential_score': score,
+            'entrants': 64,
+            'dq_count': -1,
+            'region': {'description': 'US', 'note': '', 'multiplier': 1},
+            'values': [{'tag': 'Ace', 'id': 1, 'points': score}],
+            'dqs': [],
+            'potential': potential or [],
+            'attendees': [{'id': 1, 'tag': 'Ace'}]}
+
+
+def potential_match(candidate_id, actual_tag, points, entrant_id=50, tag='ace'):
+    return {'tag': tag, 'id': entrant_id, 'candidate_id': candidate_id, 'points': points, 'note': 'Top 10',
+            'actual_tag': actual_tag, 'dqs': 0}
+
+
+def write_run(directory, results, unscored=()):
+    directory.mkdir()
+
+    rows = [summary_row(slug) for slug in unscored]
+    write_summary(rows, results, str(directory))
+
+    return str(directory)
+
+
+def test_identical_runs_have_no_changes(tmp_path):
+    results = [make_result('tournament/a/event/s'), make_result('tournament/b/event/s')]
+
+    rows, counts = diff_runs(write_run(tmp_path / 'before', results), write_run(tmp_path / 'after', copy.deepcopy(results)))
+
+    assert rows == []
+    assert counts['compared'] == 2
+    assert counts['identical'] == 2
+
+
+def test_reports_changed_fields(tmp_path):
+    before = write_run(tmp_path / 'before', [make_result('tournament/a/event/s', score=100)])
+    after = write_run(tmp_path / 'after', [make_result('tournament/a/event/s', score=20, should_count=False)])
+
+    rows, counts = diff_runs(before, after)
+
+    assert {(row['Field'], row['Before'], row['After']) for row in rows} == {
+        ('should_count', True, False), ('should_count_strict', True, False), ('score', 100, 20),
+        ('max_potential_score', 100, 20), ('values', 'Ace (100 points)', 'Ace (20 points)')}
+    assert counts['changed'] == 1
+    assert counts['count flipped'] == 1
+
+
+def test_fields_that_arent_compared_dont_count_as_changes(tmp_path):
+    changed = make_result('tournament/a/event/s')
+    changed['attendees'].append({'id': 2, 'tag': 'Bee'})
+
+    rows, counts = diff_runs(write_run(tmp_path / 'before', [make_result('tournament/a/event/s')]),
+                             write_run(tmp_path / 'after', [changed]))
+
+    assert rows == []
+    assert counts['unchanged fields'] == 1
+
+
+def test_added_and_removed_events(tmp_path):
+    before = write_run(tmp_path / 'before', [make_result('tournament/a/event/s'), make_result('tournament/b/event/s')],
+                       unscored=['tournament/c/event/s'])
+    after = write_run(tmp_path / 'after', [make_result('tournament/a/event/s'), make_result('tournament/c/event/s')],
+                      unscored=['tournament/b/event/s'])
+
+    rows, counts = diff_runs(before, after)
+
+    assert [(row['Slug'], row['Before'], row['After']) for row in rows] == [
+        ('tournament/b/event/s', 'scored', 'not scored'), ('tournament/c/event/s', 'not scored', 'scored')]
+    assert counts['added'] == 1
+    assert counts['removed'] == 1
+
+
+def test_later_results_of_an_event_replace_earlier_ones(tmp_path):
+    before = write_run(tmp_path / 'before', [make_result('tournament/a/event/s', score=100)])
+    after = write_run(tmp_path / 'after', [make_result('tournament/a/event/s', score=50)])
+
+    # ultrank_live appends a result every time an event's result changes
+    with open(tmp_path / 'after' / 'results.jsonl', mode='a', encoding='utf-8') as results_file:
+        results_file.write(json.dumps(make_result('tournament/a/event/s', score=100)) + '\n')
+
+    rows, _ = diff_runs(before, after)
+
+    assert rows == []
+
+
+def test_potential_matches_are_told_apart_by_candidate():
+    before = make_result('tournament/a/event/s', potential=[potential_match(1, 'Ace', 10), potential_match(2, 'ACE', 20)])
+    after = make_result('tournament/a/event/s', potential=[potential_match(1, 'Ace', 10), potential_match(2, 'ACE', 25)])
+
+    assert compare_results(before, after) == [('potential', 'ace as ACE (20 points)', 'ace as ACE (25 points)')]
+
+
+def test_new_candidates_for_the_same_entrant_are_added():
+    before = make_result('tournament/a/event/s', potential=[potential_match(1, 'Ace', 10)])
+    after = make_result('tournament/a/event/s', potential=[potential_match(1, 'Ace', 10), potential_match(2, 'ACE', 20)])
+
+    assert compare_results(before, after) == [('potential', '', 'ace as ACE (20 points)')]
+
+
+def test_player_keys():
+    assert player_key({'tag': 'Ace', 'id': 1, 'points': 10}) == '1'
+    assert player_key({'tag': 'Ace', 'id': None, 'points': 10}) == 'Ace'
+    assert player_key(potential_match(7, 'Ace', 10)) == '50:7'
+
+    # Results written before potential matches had candidate IDs
+    old_match = potential_match(None, 'Ace', 10)
+    del old_match['candidate_id']
+    assert player_key(old_match) == '50:Ace'
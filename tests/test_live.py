@@ -0,0 +1,122 @@
+import json
+import re
+
+import pytest
+
+import startgg_toolkit
+import ultrank_live
+import ultrank_tiering
+from ultrank_live import LiveTournament
+
+SLUG = 'tournament/weekly/event/singles'
+
+
+class FakeEvent:
+    """Answers the queries LiveTournament sends for an event in progress."""
+
+    def __init__(self):
+        # phase id -> sets, each with the time it was completed
+        self.phases = {1: []}
+        self.entrants = {10: 'Ace', 11: 'Bee', 12: 'Cat'}
+        self.sets_requests = []
+
+    def add_set(self, phase_id, set_id, winner, loser, loser_score, completed_at):
+        self.phases[phase_id].append({'id': set_id,
+                                      'winnerId': winner,
+                                      'completedAt': completed_at,
+                                      'slots': [{'entrant': {'id': winner}, 'standing': {'stats': {'score': {'value': 2}}}},
+                                                {'entrant': {'id': loser},
+                                                 'standing': {'stats': {'score': {'value': loser_score}}}}]})
+
+    def send_request(self, query, variables, quiet=False):
+        operation = re.search(r'query\s+(\w+)', query).group(1)
+        variables = json.loads(variables)
+
+        if operation == 'getLoc':
+            return {'data': {'event': {'startAt': 1750000000}}}
+
+        if operation == 'getPhases':
+            return {'data': {'event': {'state': 'ACTIVE',
+                                       'phases': [{'id': phase_id, 'name': 'Phase {}'.format(phase_id), 'state': 'COMPLETED',
+                                                   'isExhibition': False, 'sets': {'pageInfo': {'total': len(sets)}}}
+                                                  for phase_id, sets in self.phases.items()]}}}
+
+        if operation == 'getEntrants':
+            nodes = [{'id': entrant_id, 'participants': [{'player': {'id': entrant_id + 100, 'gamerTag': tag}}]}
+                     for entrant_id, tag in self.entrants.items()]
+
+            return {'data': {'event': {'entrants': {'pageInfo': {'totalPages': 1}, 'nodes': nodes}}}}
+
+        if operation == 'getSets':
+            updated_after = variables.get('updatedAfter')
+            self.sets_requests.append((variables['phases'], updated_after))
+
+            nodes = [{key: value for key, value in set_data.items() if key != 'completedAt'}
+                     for phase_id in variables['phases'] for set_data in self.phases.get(phase_id, [])
+                     if updated_after is None or set_data['completedAt'] > updated_after]
+
+            return {'data': {'event': {'sets': {'pageInfo': {'page': 1, 'totalPages': 1}, 'nodes': nodes}}}}
+
+        raise AssertionError('unexpected query {}'.format(operation))
+
+
+@pytest.fixture
+def event(monkeypatch):
+    event = FakeEvent()
+
+    for module in [startgg_toolkit, ultrank_tiering, ultrank_live]:
+        monkeypatch.setattr(module, 'send_request', event.send_request)
+
+    return event
+
+
+def tags(players):
+    return sorted(player.tag for player in players)
+
+
+def test_only_updated_sets_are_fetched_for_known_phases(event):
+    event.add_set(1, 1, 10, 11, 1, completed_at=100)
+    tournament = LiveTournament(SLUG, location=False)
+
+    event.add_set(1, 2, 10, 12, 0, completed_at=10 ** 10)
+    event.sets_requests.clear()
+    tournament.gather_entrant_counts()
+
+    [(phase_ids, updated_after)] = event.sets_requests
+    assert phase_ids == [1]
+    assert updated_after is not None
+    assert tournament.sets_seen() == 2
+    assert tags(tournament.participants) == ['Ace', 'Bee', 'Cat']
+
+
+def test_reset_phases_are_fetched_again(event):
+    event.add_set(1, 1, 10, 11, -1, completed_at=100)
+    event.add_set(1, 2, 10, 12, 1, completed_at=200)
+    tournament = LiveTournament(SLUG, location=False)
+
+    assert [dq.tag for dq, _ in tournament.dq_list.values()] == ['Bee']
+
+    # The phase is reset, and played again without the DQ
+    event.phases[1] = []
+    event.add_set(1, 3, 10, 12, 1, completed_at=10 ** 10)
+    tournament.gather_entrant_counts()
+
+    assert tournament.sets_seen() == 1
+    assert tournament.dq_list == {}
+    assert tags(tournament.participants) == ['Ace', 'Cat']
+
+
+def test_sets_of_removed_phases_dont_count(event):
+    event.phases[2] = []
+    event.add_set(1, 1, 10, 11, 1, completed_at=100)
+    event.add_set(2, 2, 10, 12, -1, completed_at=100)
+    tournament = LiveTournament(SLUG, location=False)
+
+    assert tournament.sets_seen() == 2
+
+    del event.phases[2]
+    tournament.gather_entrant_counts()
+
+    assert tournament.sets_seen() == 1
+    assert tournament.dq_list == {}
+    assert tags(tournament.participants) == ['Ace', 'Bee']
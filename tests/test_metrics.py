@@ -0,0 +1,115 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+import ultrank_metrics
+from ultrank_metrics import Counter, Gauge, Histogram
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Collects the metrics made by a test apart from the real ones."""
+
+    registry = []
+    monkeypatch.setattr(ultrank_metrics, 'registry', registry)
+
+    return registry
+
+
+def test_counters_with_labels(registry):
+    requests = Counter('test_requests', 'Requests sent', ['status'])
+    requests.inc('200')
+    requests.inc('200')
+    requests.inc('429', amount=3)
+
+    assert ultrank_metrics.exposition() == ('# TYPE test_requests counter\n'
+                                            '# HELP test_requests Requests sent\n'
+                                            'test_requests_total{status="200"} 2\n'
+                                            'test_requests_total{status="429"} 3\n'
+                                            '# EOF\n')
+
+
+def test_label_values_are_escaped(registry):
+    skipped = Counter('test_skipped', 'Events skipped', ['reason'])
+    skipped.inc('says "hi"\\\n')
+
+    assert 'test_skipped_total{reason="says \\"hi\\"\\\\\\n"} 1' in ultrank_metrics.exposition()
+
+
+def test_gauges(registry):
+    in_progress = Gauge('test_in_progress', 'Events being scored')
+    in_progress.inc()
+    in_progress.inc()
+    in_progress.dec()
+    Gauge('test_computed', 'Computed when exported', function=lambda: 1.5)
+
+    lines = ultrank_metrics.exposition().splitlines()
+
+    assert 'test_in_progress 1' in lines
+    assert 'test_computed 1.5' in lines
+
+
+def test_histograms_are_cumulative(registry):
+    latency = Histogram('test_latency_seconds', 'Request latency', [0.1, 1])
+    for value in [0.05, 0.5, 0.7, 5]:
+        latency.observe(value)
+
+    lines = ultrank_metrics.exposition().splitlines()
+
+    assert lines[2:7] == ['test_latency_seconds_bucket{le="0.1"} 1',
+                          'test_latency_seconds_bucket{le="1"} 3',
+                          'test_latency_seconds_bucket{le="+Inf"} 4',
+                          'test_latency_seconds_count 4',
+                          'test_latency_seconds_sum 6.25']
+
+
+def test_skip_reason_label():
+    assert ultrank_metrics.skip_reason_label('Probable Weekly (contains string "weekly")') == 'Probable Weekly'
+    assert ultrank_metrics.skip_reason_label('Probable Weekly [0.91234] (found tournament Weekly #3 [tournament/w3] which precedes by 7 days)') == 'Probable Weekly'
+    assert ultrank_metrics.skip_reason_label('Tournament Creator Blacklisted') == 'Tournament Creator Blacklisted'
+
+
+def test_record_event_counts_the_last_minute(monkeypatch):
+    monkeypatch.setattr(ultrank_metrics, 'recent_events', type(ultrank_metrics.recent_events)())
+    scored_before = ultrank_metrics.events.values.get(('scored',), 0)
+
+    ultrank_metrics.record_event('scored', 2)
+    ultrank_metrics.record_event('scored', 3)
+
+    assert ultrank_metrics.events.values[('scored',)] == scored_before + 2
+    assert ultrank_metrics.events_per_minute() == 2
+
+    # Events from over a minute ago are dropped
+    ultrank_metrics.recent_events[0] -= 120
+    assert ultrank_metrics.events_per_minute() == 1
+
+
+def test_write_textfile(registry, tmp_path):
+    Counter('test_requests', 'Requests sent').inc()
+    path = tmp_path / 'ultrank.prom'
+
+    ultrank_metrics.write_textfile(str(path))
+
+    assert path.read_text() == ultrank_metrics.exposition()
+    assert [file.name for file in tmp_path.iterdir()] == ['ultrank.prom']
+
+
+def test_http_server(registry):
+    Counter('test_requests', 'Requests sent').inc()
+    server = ultrank_metrics.start_http_server(0)
+
+    try:
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'] == ultrank_metrics.CONTENT_TYPE
+            assert response.read().decode('utf-8') == ultrank_metrics.exposition()
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/other')
+
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,130 @@
+import json
+
+import pytest
+
+import startgg_toolkit
+
+QUERY = 'query getThings($page: Int!, $perPage: Int!) { things(page: $page, perPage: $perPage) { nodes } }'
+
+
+class FakeConnection:
+    """Answers paginated queries from a list of nodes, like start.gg."""
+
+    def __init__(self, count, too_complex=lambda page, per_page: False):
+        self.nodes = list(range(count))
+        self.too_complex = too_complex
+        self.requests = []
+
+    def send_request(self, query, variables, quiet=False):
+        page, per_page = variables['page'], variables['perPage']
+        self.requests.append((page, per_page))
+
+        if self.too_complex(page, per_page):
+            return {'errors': [{'message': 'Your query complexity is too high. A maximum of 1000 objects may be returned'}]}
+
+        total_pages = -(-len(self.nodes) // per_page)
+        nodes = self.nodes[(page - 1) * per_page:page * per_page]
+
+        return {'data': {'things': {'pageInfo': {'totalPages': total_pages}, 'nodes': nodes}}}
+
+
+def make_query(page, per_page):
+    return QUERY, {'page': page, 'perPage': per_page}
+
+
+def read_all(fake, default_size, **kwargs):
+    return [node for _, connection in startgg_toolkit.paginate(make_query, lambda resp: resp['data']['things'],
+                                                               default_size, quiet=True, **kwargs)
+            for node in connection['nodes']]
+
+
+@pytest.fixture(autouse=True)
+def page_sizes_file(tmp_path, monkeypatch):
+    # In a directory that doesn't exist yet, like tts_values before the first run
+    path = tmp_path / 'tts_values' / 'page_sizes.json'
+    monkeypatch.setattr(startgg_toolkit, 'PAGE_SIZES_FILE', str(path))
+    monkeypatch.setattr(startgg_toolkit, 'page_sizes', None)
+
+    return path
+
+
+def use(fake, monkeypatch):
+    monkeypatch.setattr(startgg_toolkit, 'send_request', fake.send_request)
+    return fake
+
+
+def learned(path):
+    return json.loads(path.read_text())[startgg_toolkit.query_shape(QUERY)]
+
+
+def test_reads_every_node_once(monkeypatch):
+    fake = use(FakeConnection(23), monkeypatch)
+
+    assert read_all(fake, 5) == list(range(23))
+    assert fake.requests == [(1, 5), (2, 5), (3, 5), (4, 5), (5, 5)]
+
+
+def test_stops_when_there_is_no_connection(monkeypatch):
+    fake = use(FakeConnection(10), monkeypatch)
+
+    pages = list(startgg_toolkit.paginate(make_query, lambda resp: None, 5, quiet=True))
+
+    assert pages == []
+
+
+def test_shrinks_pages_that_are_too_complex(monkeypatch, page_sizes_file):
+    fake = use(FakeConnection(100, too_complex=lambda page, per_page: per_page > 30), monkeypatch)
+
+    assert read_all(fake, 100) == list(range(100))
+    assert fake.requests[:3] == [(1, 100), (1, 50), (1, 25)]
+    assert learned(page_sizes_file)['limit'] == 50
+
+    # The next query of the same shape starts at a size that works
+    fake.requests.clear()
+
+    assert read_all(fake, 100) == list(range(100))
+    assert all(per_page <= 30 for _, per_page in fake.requests)
+
+
+def test_shrinking_after_the_first_page_keeps_its_place(monkeypatch):
+    # The first page is fine, but later ones are too complex unless they're small
+    fake = use(FakeConnection(40, too_complex=lambda page, per_page: page > 1 and per_page > 4), monkeypatch)
+
+    assert read_all(fake, 10) == list(range(40))
+
+    for page, per_page in fake.requests:
+        assert per_page == 10 or (page - 1) * per_page >= 10
+
+
+def test_grows_pages_of_queries_that_needed_several(monkeypatch, page_sizes_file):
+    fake = use(FakeConnection(100), monkeypatch)
+
+    read_all(fake, 10)
+    assert learned(page_sizes_file)['size'] == 20
+
+    fake.requests.clear()
+    read_all(fake, 10)
+    assert fake.requests[0] == (1, 20)
+
+
+def test_growth_stays_below_known_limits(monkeypatch, page_sizes_file):
+    fake = use(FakeConnection(200, too_complex=lambda page, per_page: per_page > 40), monkeypatch)
+
+    for _ in range(6):
+        assert read_all(fake, 10, max_size=64) == list(range(200))
+
+    sizes = learned(page_sizes_file)
+    assert sizes['good'] <= 40 < sizes['limit'] <= 64
+    assert sizes['size'] <= 64
+
+
+def test_sizes_are_only_kept_in_memory_without_a_file(monkeypatch, tmp_path):
+    monkeypatch.setattr(startgg_toolkit, 'PAGE_SIZES_FILE', None)
+    fake = use(FakeConnection(100), monkeypatch)
+
+    read_all(fake, 10)
+
+    fake.requests.clear()
+    read_all(fake, 10)
+    assert fake.requests[0] == (1, 20)
+    assert list(tmp_path.iterdir()) == []
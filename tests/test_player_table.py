@@ -0,0 +1,126 @@
+import datetime
+import os
+
+import pytest
+
+from ultrank_player_table import MappedPlayerTable, compile_player_table
+from ultrank_tiering import PlayerValue, PlayerValueGroup, group_from_record, read_players
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_players():
+    ace = PlayerValueGroup(1234, 'a1b2', 'Ace', ['AceOfSpades', 'ＡＣＥ'])
+    ace.add_value(300, 'top', 'Top 10', datetime.date(2024, 1, 1), datetime.date(2024, 12, 31), datetime.date(2024, 7, 1))
+    ace.invitational_values.append(PlayerValue(1234, 'a1b2', 'Ace', 50, 'invit', 'Invitational', datetime.date(2024, 1, 1), None))
+
+    zed = PlayerValueGroup(7, 'c3d4', 'Zed')
+    zed.add_value(10, 'other', '', None, None)
+
+    # Players without a start.gg ID are keyed by tag
+    tag_only = PlayerValueGroup('Mystery', '', 'Mystery', ['mystery man'])
+    tag_only.add_value(25, 'other', 'no account')
+
+    players = {1234: ace, 'Mystery': tag_only, 7: zed}
+    tags = {'ace', 'aceofspades', 'ａｃｅ', 'zed', 'mystery', 'mystery man'}
+
+    return players, tags
+
+
+def group_fields(group):
+    def value_fields(value):
+        return (value.id_, value.hex_, value.tag, value.points, value.category, value.note, value.start_time,
+                value.end_time, value.depreciated_from)
+
+    return (group.id_, group.hex_, group.tag, group.other_tags, [value_fields(value) for value in group.values],
+            [value_fields(value) for value in group.invitational_values])
+
+
+@pytest.fixture
+def table(tmp_path):
+    players, tags = make_players()
+    path = str(tmp_path / 'players.bin')
+    compile_player_table(players, tags, path)
+
+    return MappedPlayerTable(path, group_from_record)
+
+
+def test_groups_round_trip(table):
+    players, _ = make_players()
+
+    for id_, group in players.items():
+        assert group_fields(table[id_]) == group_fields(group)
+
+
+def test_depreciated_values_keep_their_original_points(table):
+    values = table[1234].values
+
+    assert [(value.points, value.depreciated_from) for value in values] == [(300, None), (250, 300)]
+
+
+def test_lookups(table):
+    assert 1234 in table
+    assert 'Mystery' in table
+    assert 99 not in table
+    assert 'Nobody' not in table
+    assert table.get(99) is None
+    assert table.get(7).tag == 'Zed'
+
+    with pytest.raises(KeyError):
+        table['Nobody']
+
+
+def test_iteration_keeps_the_original_order(table):
+    players, _ = make_players()
+
+    assert len(table) == 3
+    assert list(table) == list(players) == [1234, 'Mystery', 7]
+    assert [id_ for id_, _ in table.items()] == list(table.keys())
+    assert [group.tag for group in table.values()] == ['Ace', 'Mystery', 'Zed']
+
+
+def test_tags(table):
+    _, tags = make_players()
+
+    assert 'aceofspades' in table.tags
+    assert 'ａｃｅ' in table.tags
+    assert 'AceOfSpades' not in table.tags
+    assert len(table.tags) == len(tags)
+    assert list(table.tags) == sorted(tags)
+
+
+def test_tag_entries_dont_build_groups(tmp_path):
+    players, tags = make_players()
+    path = str(tmp_path / 'players.bin')
+    compile_player_table(players, tags, path)
+
+    def build_group(*args):
+        raise AssertionError('tag_entries built a group')
+
+    entries = list(MappedPlayerTable(path, build_group).tag_entries())
+
+    assert entries == [(1234, 'Ace', ['aceofspades', 'ａｃｅ']), ('Mystery', 'Mystery', ['mystery man']), (7, 'Zed', [])]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not_a_table.bin'
+    path.write_bytes(b'\0' * 256)
+
+    with pytest.raises(ValueError):
+        MappedPlayerTable(str(path), group_from_record)
+
+
+def test_ranking_csvs_round_trip(tmp_path, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    players, tags = read_players()
+
+    path = str(tmp_path / 'players.bin')
+    compile_player_table(players, tags, path)
+    table = MappedPlayerTable(path, group_from_record)
+
+    assert len(table) == len(players)
+    assert list(table) == list(players)
+    assert set(table.tags) == tags
+
+    for id_, group in players.items():
+        assert group_fields(table[id_]) == group_fields(group)
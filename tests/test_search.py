@@ -0,0 +1,86 @@
+import os
+import threading
+
+import pytest
+
+import startgg_toolkit
+from ultrank_bulk import read_summary, write_summary
+from ultrank_mock_server import MockData, MockStartgg, make_server
+from ultrank_search import load_discovery_state, mark_events_scored, retrieve_events
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def mock_data():
+    return MockData(20, seed=3, players_file=os.path.join(REPO_ROOT, 'ultrank_players.csv'))
+
+
+@pytest.fixture
+def startgg(mock_data, monkeypatch):
+    server = make_server(MockStartgg(mock_data, quota=None, complexity_limit=None), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(startgg_toolkit, 'SMASH_GG_ENDPOINT', 'http://127.0.0.1:{}/gql/alpha'.format(server.server_port))
+    monkeypatch.setattr(startgg_toolkit, 'ggheader', {'Authorization': 'Bearer test'})
+    monkeypatch.setattr(startgg_toolkit, 'RATE_LIMIT_PER_MINUTE', None)
+
+    yield mock_data
+
+    server.shutdown()
+    server.server_close()
+
+
+def search(data, directory):
+    return [event['slug'] for event in retrieve_events(data.start_time - 24 * 60 * 60, data.end_time + 24 * 60 * 60,
+                                                       directory=str(directory), incremental=True)]
+
+
+def test_unscored_events_are_returned_again(startgg, tmp_path):
+    first = search(startgg, tmp_path)
+    assert len(first) > 1
+
+    # The first run was interrupted before scoring anything
+    assert search(startgg, tmp_path) == first
+
+    mark_events_scored(first[:1], str(tmp_path))
+    assert search(startgg, tmp_path) == first[1:]
+
+    mark_events_scored(first[1:], str(tmp_path))
+    assert search(startgg, tmp_path) == []
+
+
+def test_marking_events_keeps_the_rest_of_the_state(startgg, tmp_path):
+    search(startgg, tmp_path)
+    before = load_discovery_state(str(tmp_path))
+
+    mark_events_scored([], str(tmp_path))
+
+    assert load_discovery_state(str(tmp_path)) == before
+
+
+def summary(slug, score):
+    return {'Tournament': 'Tournament', 'Event': 'Singles', 'Slug': slug, 'Score': score}
+
+
+def test_merged_summaries_replace_results_of_the_same_slugs(tmp_path):
+    write_summary([summary('a', 10), summary('b', 20)], [{'slug': 'a', 'score': 10}, {'slug': 'b', 'score': 20}],
+                  str(tmp_path))
+
+    # b couldn't be scored this time, and c is new
+    write_summary([{'Slug': 'b'}, summary('c', 30)], [{'slug': 'c', 'score': 30}], str(tmp_path), merge=True)
+
+    rows, result_dicts = read_summary(str(tmp_path))
+
+    assert [(row['Slug'], row['Score']) for row in rows] == [('a', '10'), ('b', ''), ('c', '30')]
+    assert result_dicts == [{'slug': 'a', 'score': 10}, {'slug': 'c', 'score': 30}]
+
+
+def test_summaries_are_replaced_without_merge(tmp_path):
+    write_summary([summary('a', 10)], [{'slug': 'a', 'score': 10}], str(tmp_path))
+    write_summary([summary('c', 30)], [{'slug': 'c', 'score': 30}], str(tmp_path))
+
+    rows, result_dicts = read_summary(str(tmp_path))
+
+    assert [row['Slug'] for row in rows] == ['c']
+    assert result_dicts == [{'slug': 'c', 'score': 30}]
@@ -0,0 +1,123 @@
+import threading
+
+import ultrank_tiering
+from ultrank_shard import WorkQueue, resolve_addresses
+
+
+def make_slugs(count):
+    return [{'slug': 'tournament/t{}/event/e'.format(i), 'invit': i % 2 == 1} for i in range(count)]
+
+
+def claim_all(queue, worker=0):
+    claimed = []
+
+    while True:
+        job = queue.claim(worker)
+        if job is None:
+            return claimed
+
+        claimed.append(job)
+
+
+def test_claims_follow_priority(tmp_path):
+    queue = WorkQueue.create(str(tmp_path / 'queue.sqlite'), make_slugs(4), priorities=[3, 1, 0, 2])
+
+    assert [idx for idx, _ in claim_all(queue)] == [2, 1, 3, 0]
+    assert queue.claim(0) is None
+
+
+def test_claims_keep_invit_and_metadata(tmp_path):
+    metadata = {'tournament': 'Big House', 'event': 'Singles', 'lat': 42.3, 'lng': -83.0, 'num_entrants': 1500}
+    slugs = make_slugs(2)
+    slugs[1]['metadata'] = metadata
+
+    queue = WorkQueue.create(str(tmp_path / 'queue.sqlite'), slugs)
+
+    assert claim_all(queue) == [(0, {'slug': slugs[0]['slug'], 'invit': False, 'metadata': None}),
+                                (1, {'slug': slugs[1]['slug'], 'invit': True, 'metadata': metadata})]
+
+
+def test_jobs_are_returned_in_input_order(tmp_path):
+    queue = WorkQueue.create(str(tmp_path / 'queue.sqlite'), make_slugs(3), priorities=[2, 1, 0])
+
+    for idx, slug_obj in claim_all(queue):
+        queue.complete(idx, {'Slug': slug_obj['slug']}, result='{}', report='report {}'.format(idx))
+
+    jobs = queue.jobs()
+
+    assert [slug for slug, _, _, _, _ in jobs] == [slug_obj['slug'] for slug_obj in make_slugs(3)]
+    assert [report for _, _, _, report, _ in jobs] == ['report 0', 'report 1', 'report 2']
+
+
+def test_unfinished_jobs_are_left_out(tmp_path):
+    queue = WorkQueue.create(str(tmp_path / 'queue.sqlite'), make_slugs(2))
+
+    idx, slug_obj = queue.claim(0)
+    queue.complete(idx, {'Slug': slug_obj['slug']})
+    queue.claim(0)
+
+    assert [slug for slug, _, _, _, _ in queue.jobs()] == [slug_obj['slug']]
+
+
+def test_jobs_of_stopped_workers_are_claimed_again(tmp_path):
+    queue = WorkQueue.create(str(tmp_path / 'queue.sqlite'), make_slugs(3))
+
+    idx, slug_obj = queue.claim(0)
+    queue.complete(idx, {'Slug': slug_obj['slug']})
+    # This worker stops without finishing its job
+    stopped_idx, _ = queue.claim(1)
+
+    assert queue.unfinished() == [(1, make_slugs(3)[1]['slug']), (2, make_slugs(3)[2]['slug'])]
+    assert queue.requeue_unfinished() == 1
+    assert [idx for idx, _ in claim_all(queue)] == [stopped_idx, 2]
+    assert queue.requeue_unfinished() == 2
+
+
+def test_concurrent_workers_never_claim_the_same_job(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    WorkQueue.create(path, make_slugs(200)).close()
+
+    claimed = {}
+
+    def work(worker):
+        queue = WorkQueue(path)
+        claimed[worker] = [idx for idx, _ in claim_all(queue, worker)]
+        queue.close()
+
+    threads = [threading.Thread(target=work, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    all_claimed = [idx for indices in claimed.values() for idx in indices]
+
+    assert sorted(all_claimed) == list(range(200))
+
+
+def test_create_replaces_an_existing_queue(tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    WorkQueue.create(path, make_slugs(5)).close()
+
+    queue = WorkQueue.create(path, make_slugs(2))
+
+    assert len(claim_all(queue)) == 2
+
+
+def test_resolve_addresses_ships_known_addresses(monkeypatch):
+    address = {'country_code': 'us', 'state': 'Michigan'}
+    monkeypatch.setitem(ultrank_tiering.address_cache, (42.3, -83.0), address)
+    # Already fetched, as an online event
+    monkeypatch.setitem(ultrank_tiering.event_locations, 'tournament/resolve-b/event/e', (None, None))
+
+    slugs = [{'slug': 'tournament/resolve-a/event/e', 'invit': False,
+              'metadata': {'tournament': 'A', 'lat': 42.3, 'lng': -83.0}},
+             {'slug': 'tournament/resolve-b/event/e', 'invit': False},
+             {'slug': 'not a slug', 'invit': False}]
+
+    resolved = resolve_addresses(slugs)
+
+    assert resolved[0]['metadata'] == {'tournament': 'A', 'lat': 42.3, 'lng': -83.0, 'address': address}
+    # Online events have no address to look up, and invalid slugs are passed through for the workers to skip
+    assert resolved[1] == slugs[1]
+    assert resolved[2] == slugs[2]
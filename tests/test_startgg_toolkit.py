@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+
+import startgg_toolkit
+
+
+class SlowServer:
+    """Stands in for post_request, holding every request until it's released."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+
+    def post_request(self, query, variables, quiet=False):
+        with self.lock:
+            self.calls.append((query, variables))
+
+        self.release.wait(5)
+
+        return {'data': {'variables': variables}}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = SlowServer()
+    monkeypatch.setattr(startgg_toolkit, 'post_request', server.post_request)
+
+    yield server
+
+    server.release.set()
+
+
+def send_concurrently(requests):
+    responses = [None] * len(requests)
+
+    def send(i, query, variables):
+        responses[i] = startgg_toolkit.send_request(query, variables, quiet=True)
+
+    threads = [threading.Thread(target=send, args=(i, query, variables)) for i, (query, variables) in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+
+    return threads, responses
+
+
+def wait_for_calls(server, count):
+    deadline = time.time() + 5
+    while len(server.calls) < count and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_identical_requests_in_flight_are_sent_once(server):
+    coalesced_before = startgg_toolkit.request_stats['coalesced']
+
+    threads, responses = send_concurrently([('query a', '{"x": 1}')] * 5)
+
+    wait_for_calls(server, 1)
+    # Give the other threads time to find the request in flight
+    deadline = time.time() + 5
+    while startgg_toolkit.request_stats['coalesced'] - coalesced_before < 4 and time.time() < deadline:
+        time.sleep(0.01)
+
+    server.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert server.calls == [('query a', '{"x": 1}')]
+    assert responses == [{'data': {'variables': '{"x": 1}'}}] * 5
+    assert startgg_toolkit.request_stats['coalesced'] - coalesced_before == 4
+    assert startgg_toolkit.in_flight == {}
+
+
+def test_different_requests_are_all_sent(server):
+    requests = [('query a', '{"x": 1}'), ('query a', '{"x": 2}'), ('query b', '{"x": 1}')]
+
+    threads, responses = send_concurrently(requests)
+
+    wait_for_calls(server, 3)
+    server.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(server.calls) == sorted(requests)
+    assert [response['data']['variables'] for response in responses] == ['{"x": 1}', '{"x": 2}', '{"x": 1}']
+
+
+def test_finished_requests_are_sent_again(server):
+    server.release.set()
+
+    startgg_toolkit.send_request('query a', '{"x": 1}', quiet=True)
+    startgg_toolkit.send_request('query a', '{"x": 1}', quiet=True)
+
+    assert len(server.calls) == 2
+
+
+def test_rate_limit_spaces_requests_across_threads(monkeypatch):
+    # 10 requests a second
+    monkeypatch.setattr(startgg_toolkit, 'RATE_LIMIT_PER_MINUTE', 600)
+    monkeypatch.setattr(startgg_toolkit, 'next_request_time', 0)
+
+    sent = []
+
+    def send():
+        startgg_toolkit.wait_for_rate_limit()
+        sent.append(time.time())
+
+    threads = [threading.Thread(target=send) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sent.sort()
+    gaps = [later - earlier for earlier, later in zip(sent, sent[1:])]
+
+    assert all(gap >= 0.09 for gap in gaps)
+
+
+def test_rate_limit_can_be_turned_off(monkeypatch):
+    monkeypatch.setattr(startgg_toolkit, 'RATE_LIMIT_PER_MINUTE', None)
+    monkeypatch.setattr(startgg_toolkit, 'next_request_time', time.time() + 60)
+
+    started = time.time()
+    startgg_toolkit.wait_for_rate_limit()
+
+    assert time.time() - started < 1
+
+
+def test_waiting_requests_are_released_if_the_request_fails(monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing_post_request(query, variables, quiet=False):
+        started.set()
+        release.wait(5)
+        raise RuntimeError('connection lost')
+
+    monkeypatch.setattr(startgg_toolkit, 'post_request', failing_post_request)
+
+    errors = []
+
+    def send_first():
+        try:
+            startgg_toolkit.send_request('query a', '{}', quiet=True)
+        except RuntimeError as e:
+            errors.append(e)
+
+    coalesced_before = startgg_toolkit.request_stats['coalesced']
+
+    first = threading.Thread(target=send_first)
+    first.start()
+    started.wait(5)
+
+    second_response = []
+    second = threading.Thread(target=lambda: second_response.append(startgg_toolkit.send_request('query a', '{}', quiet=True)))
+    second.start()
+
+    deadline = time.time() + 5
+    while startgg_toolkit.request_stats['coalesced'] == coalesced_before and time.time() < deadline:
+        time.sleep(0.01)
+
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert not second.is_alive()
+    assert len(errors) == 1
+    # The waiting request gets an empty response instead of the error
+    assert second_response == [{}]
+    assert startgg_toolkit.in_flight == {}
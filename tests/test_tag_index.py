@@ -0,0 +1,83 @@
+from ultrank_player_table import MappedPlayerTable, compile_player_table
+from ultrank_tag_index import TagIndex, normalize_tag
+from ultrank_tiering import PlayerValueGroup, group_from_record
+
+
+def make_players():
+    players = {}
+
+    for id_, tag, other_tags in [(1, 'Sparg0', ['spargo']),
+                                 (2, 'Tweek', []),
+                                 (3, 'MkLeo', ['leo']),
+                                 (4, 'Leo', []),
+                                 (5, 'Zomba', [])]:
+        players[id_] = PlayerValueGroup(id_, '', tag, other_tags)
+
+    return players
+
+
+def test_normalize_tag():
+    assert normalize_tag('Tweek') == 'tweek'
+    assert normalize_tag('ＴＷＥＥＫ') == 'tweek'
+    assert normalize_tag('SPN | Tweek') == 'tweek'
+    assert normalize_tag('A | B |  Tweek ') == 'tweek'
+    assert normalize_tag('Mr.  R') == 'mr. r'
+    assert normalize_tag('STRASSE') == normalize_tag('Straße')
+
+
+def test_exact_matches_ignore_case():
+    index = TagIndex(make_players())
+
+    assert index.candidates('tweek', fuzzy=False) == [(2, 1)]
+    assert index.candidates('SPARGO', fuzzy=False) == [(1, 1)]
+    assert index.candidates('Nobody', fuzzy=False) == []
+
+
+def test_players_sharing_a_tag_keep_ranking_order():
+    index = TagIndex(make_players())
+
+    assert index.candidates('Leo', fuzzy=False) == [(3, 1), (4, 1)]
+
+
+def test_without_fuzzy_matching_only_exact_tags_match():
+    index = TagIndex(make_players())
+
+    assert index.candidates('SPN | Tweek', fuzzy=False) == []
+    assert index.candidates('ＴＷＥＥＫ', fuzzy=False) == []
+    assert index.candidates('Twek', fuzzy=False) == []
+
+
+def test_fuzzy_matching_normalizes_tags():
+    index = TagIndex(make_players())
+
+    assert index.candidates('SPN | Tweek', fuzzy=True) == [(2, 1)]
+    assert index.candidates('ＴＷＥＥＫ', fuzzy=True) == [(2, 1)]
+
+
+def test_fuzzy_matching_finds_typos():
+    index = TagIndex(make_players())
+
+    [(id_, similarity)] = index.candidates('Zombaa', fuzzy=True)
+    assert id_ == 5
+    assert 0.8 <= similarity < 1
+
+    # Short tags are only matched exactly
+    assert index.candidates('Twek', fuzzy=True) == []
+    # Too different
+    assert index.candidates('Zumbo', fuzzy=True) == []
+
+
+def test_mapped_tables_give_the_same_matches(tmp_path):
+    players = make_players()
+    tags = set(tag for group in players.values() for tag in [group.tag.lower()] + group.other_tags)
+
+    path = str(tmp_path / 'players.bin')
+    compile_player_table(players, tags, path)
+    table = MappedPlayerTable(path, group_from_record)
+
+    index = TagIndex(players)
+    mapped_index = TagIndex(table)
+
+    for tag in ['Leo', 'spargo', 'SPN | Tweek', 'Zombaa', 'Nobody']:
+        for fuzzy in [False, True]:
+            assert mapped_index.candidates(tag, fuzzy=fuzzy) == index.candidates(tag, fuzzy=fuzzy)
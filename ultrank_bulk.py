@@ -1,52 +1,275 @@
-from ultrank_tiering import Tournament, TournamentTieringResult
+from ultrank_tiering import Tournament, TournamentTieringResult, prefetch_locations
+from ultrank_schedule import run_jobs
 from startgg_toolkit import startgg_slug_regex
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import contextlib
 import csv
+import json
 import os 
 import re
 import sys
+import time
+import ultrank_metrics
+import zipfile
 
 true_values = ['true', 't', '1']
 
-def bulk_score(slugs, directory='tts_values'):
-    """Scores multiple slugs, and returns the resultant result."""
+# number of threads used to render and write per-event reports
+REPORT_WORKERS = 8
+
+# number of events scored at the same time
+SCORE_WORKERS = 4
+
+# order events are scored in (see ultrank_schedule.ORDERS); results are always written in input order
+SCORE_ORDER = 'largest'
+
+# raw event data of scored events, used by ultrank_simulate (only written if asked for)
+SNAPSHOT_FILE = 'event_snapshots.jsonl'
+
+SUMMARY_FIELDS = ['Tournament', 'Event', 'Slug', 'URL', 'Invitational?', 'Score', 'Max Potential Score', 'Num Entrants', 'Meets Reqs',
+                  'DQs Not Checked']
+
+def report_name(slug):
+    """Returns the base file name used for an event's report."""
+
+    return re.sub(r'tournament\/([a-z0-9-_]*)\/event\/([a-z0-9-_]*)', r'\1_\2', slug)
+
+
+def score_slug(slug_obj, full_detail=True):
+    """Scores a single slug.
+
+    Returns the result and the tournament it came from, or the slug and None if it couldn't be scored.
+    If full_detail is False, DQs are only checked if they could change whether the event counts.
+    Event details that are already known can be given as slug_obj['metadata'] (see Tournament).
+    """
+
+    slug = slug_obj['slug']
+    invit = slug_obj['invit']
+    metadata = slug_obj.get('metadata')
+
+    if not startgg_slug_regex.fullmatch(slug):
+        print('skipping slug {}'.format(slug))
+        ultrank_metrics.record_event('invalid', 0)
+        return slug, None
+
+    print('calculating for slug {}'.format(slug))
+
+    started = time.time()
+    ultrank_metrics.events_in_progress.inc()
+
+    try:
+        t = Tournament(slug, invit, full_detail=full_detail, metadata=metadata)
+        result = t.calculate_tier()
+
+    except Exception as e:
+        print(e)
+        print('catastrophic failure')
+        ultrank_metrics.record_event('failed', time.time() - started)
+        return slug, None
+
+    finally:
+        ultrank_metrics.events_in_progress.dec()
+
+    ultrank_metrics.record_event('scored', time.time() - started)
+    return result, t
+
+
+def bulk_score(slugs, directory='tts_values', archive=False, full_detail=True, profile=False, workers=SCORE_WORKERS,
+               order=SCORE_ORDER, lean=False, memory=False, memory_budget=None, snapshots=False):
+    """Scores multiple slugs, and returns the resultant result.
+
+    Events are scored on several threads, in the given order (see ultrank_schedule.py),
+    and the results are returned in input order.
+
+    Per-event reports are written on other threads as each event is scored; if archive
+    is set, they are collected in a single compressed file instead of separate .txt
+    files, which is written once all events are scored.
+    If snapshots is set, the fetched data of each event is appended to SNAPSHOT_FILE.
+    If full_detail is False, DQs are only checked for events whose result depends on
+    them. If profile is set, each event is profiled (see ultrank_profile.py), one
+    event at a time.
+
+    If lean is set, each event's fetched data is dropped as soon as it's scored, and its result is rendered right away and kept as text (see
+    TournamentTieringResult.compact). If memory is set, the memory used by each stage
+    is measured (see ultrank_memory.py). memory_budget limits the memory used in bytes,
+    by starting fewer events at once when it gets close.
+    """
 
     # Create results directory
     if not os.path.isdir(directory):
         os.mkdir(directory)
 
+    if memory:
+        from ultrank_memory import MemoryAccounting
+
+        accounting = MemoryAccounting()
+        stage = accounting.stage
+    else:
+        stage = lambda name, count=None: contextlib.nullcontext()
+
+    valid_slugs = [slug_obj for slug_obj in slugs if startgg_slug_regex.fullmatch(slug_obj['slug'])]
+
+    # Look up every event's address in the background while scoring
+    with stage('locations', len(valid_slugs)):
+        prefetch_locations([slug_obj['slug'] for slug_obj in valid_slugs],
+                           known_locations={slug_obj['slug']: (slug_obj['metadata']['lat'], slug_obj['metadata']['lng'])
+                                            for slug_obj in valid_slugs
+                                            if slug_obj.get('metadata') is not None and slug_obj['metadata'].get('lat') is not None})
+
+    if profile:
+        from ultrank_profile import EventProfiler
+
+        profiler = EventProfiler(directory)
+
+        # Only one profiler can be active at a time from Python 3.12, and profiles of
+        # concurrent events would also measure each other's work
+        if workers > 1:
+            print('profiling scores one event at a time')
+            workers = 1
+
+    def score(slug_obj):
+        if profile:
+            return profiler.run(report_name(slug_obj['slug']), score_slug, slug_obj, full_detail=full_detail)
+
+        return score_slug(slug_obj, full_detail=full_detail)
+
     # Get values
-    results = []
+    results = [None] * len(slugs)
+
+    report_executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS)
+    # (slug, future) pairs, whose futures hold the rendered report if it's going in the archive
+    reports = []
+
+    # Keep the raw data of every event if asked, so it can be rescored offline
+    if snapshots:
+        snapshot_file = open(os.path.join(directory, SNAPSHOT_FILE), mode='a', encoding='utf-8')
+    else:
+        snapshot_file = contextlib.nullcontext()
+
+    with stage('scoring', len(slugs)), snapshot_file:
+        for idx, (result, tournament) in run_jobs(slugs, score, workers=workers, order=order, memory_budget=memory_budget):
+            results[idx] = result
 
-    for slug_obj in slugs:
-        slug = slug_obj['slug']
-        invit = slug_obj['invit']
+            if tournament is not None:
+                if snapshots:
+                    snapshot_file.write(json.dumps(tournament.to_snapshot(), ensure_ascii=False) + '\n')
 
-        if startgg_slug_regex.fullmatch(slug):
-            print('calculating for slug {}'.format(slug))
+                if lean:
+                    tournament.release_raw_data()
+                    result.compact()
 
-            try:
-                t = Tournament(slug, invit)
-                result = t.calculate_tier()
+            if isinstance(result, TournamentTieringResult):
+                if archive:
+                    reports.append((result.slug, report_executor.submit(result.render_result)))
+                else:
+                    reports.append((result.slug, report_executor.submit(write_report, result, directory)))
 
-                results.append(result)
+    if memory:
+        accounting.take_snapshot()
 
-                print('writing for slug {}'.format(result.slug))
+    with stage('reports', len(slugs)):
+        print('finishing {} reports'.format(len(reports)))
 
-                with open(os.path.join(directory, '{}.txt'.format(re.sub(r'tournament\/([a-z0-9-_]*)\/event\/([a-z0-9-_]*)', r'\1_\2', result.slug))), mode='w') as write_file:
-                    result.write_result(write_file)
+        report_executor.shutdown()
 
-            except Exception as e:
-                print(e)
-                print('catastrophic failure')
-                results.append(slug)
+        if archive:
+            write_report_texts([(slug, future.result()) for slug, future in reports], directory, archive=True)
         else:
-            print('skipping slug {}'.format(slug))
-            results.append(slug)
+            # Raises any exceptions from writing the reports
+            for _, future in reports:
+                future.result()
+
+    if profile:
+        profiler.write_summary()
+
+    if memory:
+        accounting.write_summary(directory)
 
     return results
 
 
-def write_results(results, directory='tts_values'):
+def write_report(result, directory='tts_values'):
+    """Renders a result's text report and writes it to its own file."""
+
+    write_report_file(result.slug, result.render_result(), directory)
+
+
+def write_report_file(slug, text, directory='tts_values'):
+    with open(os.path.join(directory, '{}.txt'.format(report_name(slug))), mode='w') as write_file:
+        write_file.write(text)
+
+
+def write_report_texts(reports, directory='tts_values', archive=False):
+    """Writes already rendered reports, given as (slug, text) pairs."""
+
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    if archive:
+        # Written from a single thread, since zip files can't be written concurrently
+        with zipfile.ZipFile(os.path.join(directory, 'reports.zip'), mode='w', compression=zipfile.ZIP_DEFLATED) as archive_file:
+            for slug, report in reports:
+                archive_file.writestr('{}.txt'.format(report_name(slug)), report)
+        return
+
+    with ThreadPoolExecutor(max_workers=REPORT_WORKERS) as executor:
+        # Consume the iterator so any exceptions are raised here
+        list(executor.map(lambda report: write_report_file(*report, directory), reports))
+
+
+def summary_row(result):
+    """Returns the summary.csv row for a result, or for a slug that couldn't be scored."""
+
+    if isinstance(result, TournamentTieringResult):
+        return {'Tournament': result.tournament,
+                'Event': result.event,
+                'Slug': result.slug,
+                'URL': 'https://start.gg/' + result.slug,
+                'Invitational?': str(result.is_invitational),
+                'Score': result.score,
+                'Max Potential Score': result.max_potential_score(),
+                'Num Entrants': result.entrants, 
+                'Meets Reqs': str(result.should_count()),
+                'DQs Not Checked': result.pruned or ''}
+
+    return {'Tournament': '',
+            'Event': '',
+            'Slug': str(result),
+            'URL': '',
+            'Invitational?': '',
+            'Score': '',
+            'Max Potential Score': '',
+            'Num Entrants': ''}
+
+
+def write_results(results, directory='tts_values', merge=False):
+    write_summary([summary_row(result) for result in results],
+                  [result.to_dict() for result in results if isinstance(result, TournamentTieringResult)], directory, merge)
+
+
+def read_summary(directory='tts_values'):
+    """Reads the summary rows and structured results written by write_summary."""
+
+    try:
+        with open(os.path.join(directory, 'summary.csv'), newline='') as summary_file:
+            rows = list(csv.DictReader(summary_file))
+
+        with open(os.path.join(directory, 'results.jsonl'), encoding='utf-8') as results_file:
+            result_dicts = [json.loads(line) for line in results_file if line.strip() != '']
+    except FileNotFoundError:
+        return [], []
+
+    return rows, result_dicts
+
+
+def write_summary(rows, result_dicts, directory='tts_values', merge=False):
+    """Writes summary.csv from summary rows, and results.jsonl from structured results.
+
+    If merge is set, the rows and results already in the directory are kept, and those
+    of the same slugs are replaced.
+    """
+
     # Write CSV
 
     print('writing summary file')
@@ -54,43 +277,31 @@ def write_results(results, directory='tts_values'):
     if not os.path.isdir(directory):
         os.mkdir(directory)
 
+    if merge:
+        previous_rows, previous_dicts = read_summary(directory)
+
+        # Earlier rows and results of the slugs being written are replaced, even if they
+        # couldn't be scored this time
+        slugs = set(row['Slug'] for row in rows)
+        rows = [row for row in previous_rows if row['Slug'] not in slugs] + rows
+        result_dicts = [result for result in previous_dicts if result['slug'] not in slugs] + result_dicts
+
     with open(os.path.join(directory, 'summary.csv'), newline='', mode='w') as summary_file:
-        writer = csv.DictWriter(summary_file, ['Tournament', 'Event', 'Slug', 'URL', 'Invitational?', 'Score', 'Max Potential Score', 'Num Entrants', 'Meets Reqs'])
+        writer = csv.DictWriter(summary_file, SUMMARY_FIELDS)
         writer.writeheader()
+        writer.writerows(rows)
 
-        for result in results:
-            if isinstance(result, TournamentTieringResult):
-                writer.writerow({'Tournament': result.tournament,
-                                 'Event': result.event,
-                                 'Slug': result.slug,
-                                 'URL': 'https://start.gg/' + result.slug,
-                                 'Invitational?': str(result.is_invitational),
-                                 'Score': result.score,
-                                 'Max Potential Score': result.max_potential_score(),
-                                 'Num Entrants': result.entrants, 
-                                 'Meets Reqs': str(result.should_count())})
-            else:
-                writer.writerow({'Tournament': '',
-                                 'Event': '',
-                                 'Slug': str(result),
-                                 'URL': '',
-                                 'Invitational?': '',
-                                 'Score': '',
-                                 'Max Potential Score': '',
-                                 'Num Entrants': ''})
+    # Write structured breakdowns
+    with open(os.path.join(directory, 'results.jsonl'), mode='w', encoding='utf-8') as results_file:
+        for result_dict in result_dicts:
+            results_file.write(json.dumps(result_dict, ensure_ascii=False) + '\n')
 
     print('done writing')
 
 
-if __name__ == '__main__':
-    # Get file
-    file = input('input file to read keys from: ')
-
-    if not os.path.exists(file):
-        print('file doesn\'t exist!')
-        sys.exit()
+def read_slugs(file):
+    """Reads slugs and invitational statuses from an input file."""
 
-    # Read in values
     slugs = []
 
     _, ext = os.path.splitext(file)
@@ -113,7 +324,57 @@ if __name__ == '__main__':
             for row in file_obj:
                 slugs.append({'slug': row.strip(), 'invit': False})
 
+    return slugs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score every event in a file.')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile each event, and summarize where the time went (see ultrank_profile.py)')
+    parser.add_argument('--memory', action='store_true',
+                        help='measure the memory used by each stage of the run (see ultrank_memory.py)')
+    parser.add_argument('--lean', action='store_true',
+                        help='drop each event\'s fetched data once it\'s scored, and keep its result as text')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help='start fewer events at once when memory use gets close to this many megabytes')
+    parser.add_argument('--snapshots', action='store_true',
+                        help='add each event\'s fetched data to {} for ultrank_simulate.py'.format(SNAPSHOT_FILE))
+    ultrank_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    ultrank_metrics.export_from_arguments(args)
+
+    # Get file
+    file = input('input file to read keys from: ')
+
+    if not os.path.exists(file):
+        print('file doesn\'t exist!')
+        sys.exit()
+
+    # Read in values
+    slugs = read_slugs(file)
+
     print('read values')
 
-    results = bulk_score(slugs)
-    write_results(results)
\ No newline at end of file
+    key_pool = input('input file with one start.gg API key per line to score in parallel (leave blank to use smashgg.key): ')
+
+    archive = input('write event reports to a single archive? (y/n) ')
+    archive = archive.lower() == 'y' or archive.lower() == 'yes'
+
+    staged = input('only check DQs for events whose result depends on them? (y/n) ')
+    full_detail = not (staged.lower() == 'y' or staged.lower() == 'yes')
+
+    if key_pool.strip() != '':
+        from ultrank_shard import sharded_bulk_score, read_key_pool
+
+        if args.profile:
+            print('profiling is only done without parallel keys')
+
+        sharded_bulk_score(slugs, read_key_pool(key_pool), archive=archive, full_detail=full_detail,
+                           snapshots=args.snapshots)
+    else:
+        results = bulk_score(slugs, archive=archive, full_detail=full_detail, profile=args.profile, lean=args.lean,
+                             memory=args.memory,
+                             memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None,
+                             snapshots=args.snapshots)
+        write_results(results)
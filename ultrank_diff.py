@@ -0,0 +1,213 @@
+"""Finds the events whose results changed between two scoring runs.
+
+Each run is a results directory written by ultrank_bulk or ultrank_search. Results
+are indexed by slug from results.jsonl, with a hash of each line, so events whose
+results are identical are skipped without being parsed. The remaining events are
+compared field by field: score, max potential score, entrants, whether they count,
+region, valued players, DQs and potential matches. Slugs that couldn't be scored
+are read from summary.csv.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+
+# fields of a result that are compared, in the order changes are reported
+SCALAR_FIELDS = ['should_count', 'should_count_strict', 'score', 'max_potential_score', 'entrants', 'dq_count']
+
+# lists of players in a result, compared player by player
+PLAYER_FIELDS = ['values', 'dqs', 'potential']
+
+DIFF_FIELDS = ['Slug', 'Tournament', 'Event', 'Field', 'Before', 'After']
+
+# results.jsonl lines start with the slug, so it can be read without parsing the line
+slug_prefix_regex = re.compile(rb'^\{"slug": "([^"\\]*)"')
+
+
+class RunIndex:
+    """Locates every result of a run in its results.jsonl, along with a hash of the result."""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, 'results.jsonl')
+        # slug -> (offset, length, hash)
+        self.results = {}
+        self.unscored = set()
+
+        with open(self.path, mode='rb') as results_file:
+            offset = 0
+
+            for line in results_file:
+                if line.strip() != b'':
+                    match = slug_prefix_regex.match(line)
+                    slug = match.group(1).decode('utf-8') if match else json.loads(line)['slug']
+
+                    # Later results of the same event replace earlier ones
+                    self.results[slug] = (offset, len(line), hashlib.sha1(line.rstrip(b'\r\n')).digest())
+
+                offset += len(line)
+
+        summary_path = os.path.join(directory, 'summary.csv')
+        if os.path.exists(summary_path):
+            with open(summary_path, newline='') as summary_file:
+                for row in csv.DictReader(summary_file):
+                    if row['Tournament'] == '' and row['Slug'] not in self.results:
+                        self.unscored.add(row['Slug'])
+
+    def read(self, slugs):
+        """Parses the results of the given slugs."""
+
+        results = {}
+
+        with open(self.path, mode='rb') as results_file:
+            for slug in sorted(slugs, key=lambda slug: self.results[slug][0]):
+                offset, length, _ = self.results[slug]
+
+                results_file.seek(offset)
+                results[slug] = json.loads(results_file.read(length))
+
+        return results
+
+
+def player_key(player):
+    key = str(player['id']) if player.get('id') is not None else player['tag']
+
+    # An entrant can be a potential match for several ranked players
+    if 'actual_tag' in player:
+        candidate = player.get('candidate_id')
+        key += ':' + (str(candidate) if candidate is not None else player['actual_tag'])
+
+    return key
+
+
+def describe_player(player):
+    description = player['tag']
+
+    if player.get('actual_tag') not in [None, player['tag']]:
+        description += ' as {}'.format(player['actual_tag'])
+
+    description += ' ({} points'.format(player['points'])
+
+    if player.get('dqs'):
+        description += ', {} DQs'.format(player['dqs'])
+
+    return description + ')'
+
+
+def compare_results(before, after):
+    """Returns (field, before, after) for every compared field that changed."""
+
+    changes = []
+
+    for field in SCALAR_FIELDS:
+        if before.get(field) != after.get(field):
+            changes.append((field, before.get(field), after.get(field)))
+
+    if before['region'] != after['region']:
+        changes.append(('region', '{} [x{}]'.format(before['region']['description'], before['region']['multiplier']),
+                        '{} [x{}]'.format(after['region']['description'], after['region']['multiplier'])))
+
+    for field in PLAYER_FIELDS:
+        players_before = {player_key(player): player for player in before.get(field, [])}
+        players_after = {player_key(player): player for player in after.get(field, [])}
+
+        for key in sorted(players_before.keys() | players_after.keys()):
+            player_before = players_before.get(key)
+            player_after = players_after.get(key)
+
+            if player_before == player_after:
+                continue
+
+            changes.append((field,
+                            describe_player(player_before) if player_before is not None else '',
+                            describe_player(player_after) if player_after is not None else ''))
+
+    return changes
+
+
+def diff_runs(before_directory, after_directory):
+    """Compares two runs, and returns the changes as rows for diff.csv along with counts of each kind of change."""
+
+    before = RunIndex(before_directory)
+    after = RunIndex(after_directory)
+
+    slugs = before.results.keys() | after.results.keys() | before.unscored | after.unscored
+
+    rows = []
+    counts = {'compared': len(slugs), 'identical': 0, 'changed': 0, 'unchanged fields': 0, 'count flipped': 0,
+              'added': 0, 'removed': 0}
+
+    changed_slugs = [slug for slug in slugs if slug in before.results and slug in after.results
+                     and before.results[slug][2] != after.results[slug][2]]
+    counts['identical'] = len([slug for slug in slugs if slug in before.results and slug in after.results]) - len(changed_slugs)
+
+    before_results = before.read(changed_slugs)
+    after_results = after.read(changed_slugs)
+
+    for slug in sorted(slugs):
+        if slug in before.results and slug in after.results:
+            if slug not in before_results:
+                continue
+
+            result = after_results[slug]
+            changes = compare_results(before_results[slug], result)
+
+            # Only fields that aren't compared changed, like the attendee list
+            if len(changes) == 0:
+                counts['unchanged fields'] += 1
+                continue
+
+            counts['changed'] += 1
+            if before_results[slug]['should_count'] != result['should_count']:
+                counts['count flipped'] += 1
+
+            for field, value_before, value_after in changes:
+                rows.append({'Slug': slug, 'Tournament': result['tournament'], 'Event': result['event'],
+                             'Field': field, 'Before': value_before, 'After': value_after})
+
+        else:
+            status_before = 'scored' if slug in before.results else 'not scored' if slug in before.unscored else ''
+            status_after = 'scored' if slug in after.results else 'not scored' if slug in after.unscored else ''
+
+            if status_before == status_after:
+                continue
+
+            counts['added' if status_after == 'scored' or status_before == '' else 'removed'] += 1
+            rows.append({'Slug': slug, 'Tournament': '', 'Event': '', 'Field': 'result',
+                         'Before': status_before, 'After': status_after})
+
+    return rows, counts
+
+
+def write_diff(rows, directory='tts_values'):
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    with open(os.path.join(directory, 'diff.csv'), newline='', mode='w') as diff_file:
+        writer = csv.DictWriter(diff_file, DIFF_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    before_directory = input('input results directory of the earlier run: ')
+    after_directory = input('input results directory of the later run (leave blank for tts_values): ')
+    if after_directory.strip() == '':
+        after_directory = 'tts_values'
+
+    for directory in [before_directory, after_directory]:
+        if not os.path.exists(os.path.join(directory, 'results.jsonl')):
+            print('{} doesn\'t exist!'.format(os.path.join(directory, 'results.jsonl')))
+            sys.exit()
+
+    rows, counts = diff_runs(before_directory, after_directory)
+
+    print('{} events compared: {} identical, {} changed ({} now count differently), {} added, {} removed'.format(
+        counts['compared'], counts['identical'] + counts['unchanged fields'], counts['changed'], counts['count flipped'],
+        counts['added'], counts['removed']))
+
+    write_diff(rows, after_directory)
+
+    print('wrote {} changes to {}'.format(len(rows), os.path.join(after_directory, 'diff.csv')))
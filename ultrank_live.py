@@ -0,0 +1,228 @@
+"""Follows events that are still in progress.
+
+Each poll only fetches the sets that were updated since the previous poll,
+and the tier is recalculated from the sets already seen. A report is written
+whenever an event's result changes.
+"""
+
+from ultrank_tiering import Tournament, get_sets_in_phases, get_entrant_map, classify_set, tally_sets
+from ultrank_bulk import report_name, read_slugs
+from startgg_toolkit import send_request
+import os
+import time
+
+# seconds between polls of the same event
+LIVE_POLL_INTERVAL = 120
+
+# sets updated up to this many seconds before the last poll are fetched again,
+# in case start.gg's clock differs from ours
+LIVE_POLL_OVERLAP = 60
+
+# events that still have no phases after this many polls stop being followed
+LIVE_MAX_EMPTY_POLLS = 90
+
+
+def live_phase_query(event_slug):
+    """Generates a query to retrieve an event's state and its list of phases, with the number of completed sets in each."""
+
+    query = '''query getPhases($eventSlug: String!) {
+  event(slug: $eventSlug) {
+    state
+    phases {
+      id
+      name
+      state
+      isExhibition
+      sets(page: 1, perPage: 1, filters: { state: [3] }) {
+        pageInfo {
+          total
+        }
+      }
+    }
+  }
+}'''
+    variables = '''{{
+        "eventSlug": "{}"
+    }}'''.format(event_slug)
+
+    return query, variables
+
+
+class LiveTournament(Tournament):
+    """Tournament that can be polled for new sets while it's running."""
+
+    def __init__(self, event_slug, is_invitational=False, location=True):
+        # Results of classify_set for every set seen, keyed by phase id and then by set id
+        self.classified_sets = {}
+        # Entrant IDs -> players, used to match the entrants of sets
+        self.entrant_map = {}
+        self.last_poll = None
+        self.finished = False
+        # consecutive polls that found no phases
+        self.empty_polls = 0
+        self.last_result = None
+
+        super().__init__(event_slug, is_invitational, location)
+
+    def sets_seen(self):
+        return sum(len(phase_sets) for phase_sets in self.classified_sets.values())
+
+    def classify_sets(self, sets):
+        """Classifies sets, returning the results keyed by set id."""
+
+        # Entrants can still be added while an event runs, so refetch the map if a set has an unknown one
+        if any(slot['entrant'] is not None and slot['entrant']['id'] not in self.entrant_map
+               for set_data in sets for slot in set_data['slots']):
+            self.entrant_map = get_entrant_map(self.event_slug)
+
+        return {set_data['id']: classify_set(set_data, self.entrant_map) for set_data in sets}
+
+    def gather_entrant_counts(self):
+        poll_time = int(time.time())
+
+        query, variables = live_phase_query(self.event_slug)
+        resp = send_request(query, variables)
+
+        try:
+            event_state = resp['data']['event'].get('state')
+            phases = [phase for phase in resp['data']['event']['phases'] or [] if not phase['isExhibition']]
+        except Exception as e:
+            print(e)
+            print(resp)
+            raise e
+
+        if any(phase.get('state', '') == 'COMPLETED' for phase in phases):
+            for phase in phases:
+                phase_id = phase['id']
+
+                # Phases that weren't seen before are fetched in full, the rest only since the last poll
+                if phase_id not in self.classified_sets:
+                    self.classified_sets[phase_id] = self.classify_sets(get_sets_in_phases(self.event_slug, [phase_id]))
+                else:
+                    self.classified_sets[phase_id].update(self.classify_sets(get_sets_in_phases(
+                        self.event_slug, [phase_id], updated_after=self.last_poll - LIVE_POLL_OVERLAP)))
+
+                # Sets that were deleted, like when the phase is reset, never show up as updated.
+                # If the phase's completed sets don't add up to the ones seen, fetch it again in full.
+                completed_sets = ((phase.get('sets') or {}).get('pageInfo') or {}).get('total')
+
+                if completed_sets is not None and completed_sets != len(self.classified_sets[phase_id]):
+                    print('{} has {} completed sets in phase {}, but {} were seen, fetching it again'.format(
+                        self.event_slug, completed_sets, phase['name'], len(self.classified_sets[phase_id])))
+
+                    self.classified_sets[phase_id] = self.classify_sets(get_sets_in_phases(self.event_slug, [phase_id]))
+
+            # Sets of phases that were removed don't count anymore
+            phase_ids = set(phase['id'] for phase in phases)
+            for phase_id in [phase_id for phase_id in self.classified_sets if phase_id not in phase_ids]:
+                del self.classified_sets[phase_id]
+
+            self.phases = phases
+            self.dq_list, self.participants = tally_sets(
+                classified for phase_sets in self.classified_sets.values() for classified in phase_sets.values())
+            self.count_set_entrants()
+        else:
+            self.entrant_map = get_entrant_map(self.event_slug)
+            self.participants = set(self.entrant_map.values())
+            self.dq_list = {}
+            self.total_entrants = len(self.participants)
+            self.phases = []
+
+        # Comment out if subtracting generic entrant dqs
+        self.total_dqs = -1
+
+        self.last_poll = poll_time
+
+        if len(phases) > 0:
+            self.empty_polls = 0
+            self.finished = all(phase.get('state', '') == 'COMPLETED' for phase in phases)
+        else:
+            # Events without phases never complete any, so go by the event itself
+            self.empty_polls += 1
+            self.finished = event_state == 'COMPLETED' or self.empty_polls >= LIVE_MAX_EMPTY_POLLS
+
+    def poll(self):
+        """Fetches updates, and returns the new result if it changed since the last poll."""
+
+        # The first poll uses the data fetched when the tournament was created
+        if self.last_result is not None:
+            self.gather_entrant_counts()
+
+        self.tier = None
+        result = self.calculate_tier()
+        result_dict = result.to_dict()
+
+        if result_dict == self.last_result:
+            return None
+
+        self.last_result = result_dict
+
+        return result
+
+
+def watch_events(events, interval=LIVE_POLL_INTERVAL, directory='tts_values'):
+    """Polls events until all of them are completed, writing a report every time a result changes."""
+
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    tournaments = []
+
+    for event in events:
+        try:
+            tournaments.append(LiveTournament(event['slug'], event['invit']))
+        except Exception as e:
+            print(e)
+            print('could not start watching {}'.format(event['slug']))
+
+    while len(tournaments) > 0:
+        next_poll = time.time() + interval
+
+        for tournament in tournaments:
+            try:
+                result = tournament.poll()
+            except Exception as e:
+                print(e)
+                print('failed to poll {}'.format(tournament.event_slug))
+                continue
+
+            if result is None:
+                continue
+
+            print('{}: score {}, {} entrants, {} sets seen{}'.format(result.slug, result.score, result.entrants,
+                                                                   tournament.sets_seen(),
+                                                                   ' (final)' if tournament.finished else ''))
+
+            with open(os.path.join(directory, '{}.txt'.format(report_name(result.slug))), mode='w') as write_file:
+                write_file.write(result.render_result())
+
+            with open(os.path.join(directory, 'live_results.jsonl'), mode='a', encoding='utf-8') as results_file:
+                results_file.write(result.to_json() + '\n')
+
+        for tournament in [tournament for tournament in tournaments if tournament.finished]:
+            if tournament.empty_polls >= LIVE_MAX_EMPTY_POLLS:
+                print('{} still has no phases, no longer following it'.format(tournament.event_slug))
+            else:
+                print('{} is completed'.format(tournament.event_slug))
+
+        tournaments = [tournament for tournament in tournaments if not tournament.finished]
+
+        if len(tournaments) > 0:
+            time.sleep(max(0, next_poll - time.time()))
+
+
+if __name__ == '__main__':
+    source = input('input event url, or file to read keys from: ')
+
+    events = []
+
+    if os.path.exists(source):
+        events = [event for event in read_slugs(source) if event['slug'] != '']
+    else:
+        is_invitational = input('is this an invitational? (y/n) ')
+        events.append({'slug': source, 'invit': is_invitational.lower() == 'y' or is_invitational.lower() == 'yes'})
+
+    interval = input('input seconds between polls (leave blank for {}): '.format(LIVE_POLL_INTERVAL))
+    interval = int(interval) if interval.strip() != '' else LIVE_POLL_INTERVAL
+
+    watch_events(events, interval)
@@ -0,0 +1,134 @@
+"""Measures scoring throughput against ultrank_mock_server.py.
+
+Starts a mock start.gg server in the background (unless --endpoint is given),
+scores its events the same way ultrank_bulk or ultrank_search would, and reports
+requests per second, events per hour, the time lost waiting to retry and the
+peak memory used.
+"""
+
+from ultrank_mock_server import MOCK_VENUES, MockData, make_server, add_fault_arguments, mock_from_arguments
+from ultrank_memory import peak_rss, format_bytes
+import argparse
+import threading
+import time
+
+
+def seed_address_cache():
+    """Fills the address cache with the mock venues, so Nominatim is never contacted."""
+
+    from ultrank_tiering import address_cache, address_cache_lock
+
+    with address_cache_lock:
+        for coordinates, address in MOCK_VENUES:
+            address_cache[coordinates] = address
+
+
+def run_load_test(endpoint, data, mode='bulk', directory='loadtest_values', full_detail=True, workers=1, lean=False,
+                  memory=False, memory_budget=None):
+    """Scores the mock events through the given endpoint and returns the measurements."""
+
+    import startgg_toolkit
+    from ultrank_bulk import bulk_score
+    from ultrank_tiering import TournamentTieringResult
+
+    startgg_toolkit.SMASH_GG_ENDPOINT = endpoint
+    seed_address_cache()
+
+    stats_before = dict(startgg_toolkit.request_stats)
+    started = time.time()
+
+    if mode == 'search':
+        from ultrank_search import retrieve_events
+
+        # A day of margin, in case the server's data was generated at a slightly different time
+        events = retrieve_events(data.start_time - 24 * 60 * 60, data.end_time + 24 * 60 * 60, directory=directory)
+        slugs = [{'slug': event['slug'], 'invit': False, 'metadata': event} for event in events]
+    else:
+        slugs = [{'slug': slug, 'invit': False} for slug in data.event_slugs()]
+
+    results = bulk_score(slugs, directory=directory, full_detail=full_detail, workers=workers, lean=lean, memory=memory,
+                         memory_budget=memory_budget)
+
+    elapsed = time.time() - started
+    stats = {name: startgg_toolkit.request_stats[name] - stats_before[name] for name in stats_before}
+    scored = len([result for result in results if isinstance(result, TournamentTieringResult)])
+
+    return {'events': len(slugs),
+            'scored': scored,
+            'elapsed': elapsed,
+            'requests': stats['requests'],
+            'response_bytes': stats['response_bytes'],
+            'retries': stats['retries'],
+            'coalesced': stats['coalesced'],
+            'sleep_seconds': stats['sleep_seconds'],
+            'throttle_seconds': stats['throttle_seconds'],
+            'requests_per_second': stats['requests'] / elapsed if elapsed > 0 else 0,
+            'events_per_hour': scored / elapsed * 3600 if elapsed > 0 else 0,
+            'peak_rss': peak_rss()}
+
+
+def print_report(report):
+    print('events:              {} found, {} scored'.format(report['events'], report['scored']))
+    print('elapsed:             {:.1f}s'.format(report['elapsed']))
+    print('requests:            {} sent, {} retried, {} coalesced'.format(report['requests'], report['retries'],
+                                                                         report['coalesced']))
+    print('requests/sec:        {:.2f}'.format(report['requests_per_second']))
+    print('KiB/event:           {:.1f}'.format(report['response_bytes'] / 1024 / report['scored'] if report['scored'] > 0 else 0))
+    print('events/hour:         {:.0f}'.format(report['events_per_hour']))
+    print('time lost to backoff: {:.1f}s ({:.0%} of elapsed)'.format(
+        report['sleep_seconds'], report['sleep_seconds'] / report['elapsed'] if report['elapsed'] > 0 else 0))
+    print('time throttled:      {:.1f}s across all threads'.format(report['throttle_seconds']))
+    print('peak memory:         {}'.format(format_bytes(report['peak_rss'])))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure scoring throughput against a mock start.gg server.')
+    parser.add_argument('--mode', choices=['bulk', 'search'], default='bulk',
+                        help='score every mock event directly, or search for them first like ultrank_search')
+    parser.add_argument('--endpoint', help='use an already running mock server instead of starting one')
+    parser.add_argument('--retry-sleep', type=float, help='seconds to wait before retrying a failed request')
+    parser.add_argument('--directory', default='loadtest_values')
+    parser.add_argument('--staged', action='store_true', help='only check DQs for events whose result depends on them')
+    parser.add_argument('--workers', type=int, default=1, help='number of events scored at the same time')
+    parser.add_argument('--lean', action='store_true', help='drop each event\'s fetched data once it\'s scored')
+    parser.add_argument('--memory', action='store_true', help='measure the memory used by each stage of the run')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help='start fewer events at once when memory use gets close to this many megabytes')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    import startgg_toolkit
+
+    if args.retry_sleep is not None:
+        startgg_toolkit.RETRY_SLEEP = args.retry_sleep
+
+    # Stay under the mock's quota like a real run stays under start.gg's
+    startgg_toolkit.RATE_LIMIT_PER_MINUTE = args.quota if args.quota > 0 else None
+
+    server = None
+
+    if args.endpoint is not None:
+        # The server's data is generated from the same arguments, so the slugs match
+        data = MockData(args.tournaments, seed=args.seed)
+        endpoint = args.endpoint
+    else:
+        mock = mock_from_arguments(args)
+        data = mock.data
+
+        server = make_server(mock, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+    report = run_load_test(endpoint, data, args.mode, args.directory, full_detail=not args.staged, workers=args.workers,
+                           lean=args.lean, memory=args.memory,
+                           memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None)
+
+    if server is not None:
+        server.shutdown()
+
+        print()
+        for (operation, status), count in sorted(server.mock.stats.items()):
+            print('{:<24} {} {}'.format(operation, status, count))
+
+    print()
+    print_report(report)
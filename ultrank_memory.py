@@ -0,0 +1,155 @@
+"""Measures the memory each stage of a scoring run uses, and keeps runs within a memory budget.
+
+Accounting uses tracemalloc, which only sees memory allocated by Python and slows
+allocation down, so it's only done when asked for. Each stage records the memory
+it left allocated and the most that was allocated at once while it ran, and the
+lines holding the most memory at the end of scoring are listed, since that's
+what's kept until the reports are written.
+
+The budget is checked against the resident set size of the process instead,
+which includes everything tracemalloc doesn't see.
+"""
+
+import contextlib
+import os
+import sys
+import tracemalloc
+
+# new concurrent events are only started while the resident set size is below this share of the budget
+BUDGET_HEADROOM = 0.9
+
+# number of lines holding the most memory listed in the summary
+TOP_ALLOCATIONS = 20
+
+MEMORY_SUMMARY_FILE = 'memory_summary.txt'
+
+
+def current_rss():
+    """Returns the resident set size of this process in bytes, or None if it can't be read."""
+
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        # Not on Linux, so the peak is the closest there is
+        return peak_rss()
+
+
+def peak_rss():
+    """Returns the largest resident set size this process has had in bytes, or None if it can't be read."""
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def within_budget(budget):
+    """Checks whether another event can be started without risking going over budget bytes."""
+
+    if budget is None:
+        return True
+
+    rss = current_rss()
+
+    return rss is None or rss < budget * BUDGET_HEADROOM
+
+
+def format_bytes(size):
+    if size is None:
+        return 'unknown'
+
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return '{:.1f} {}'.format(size, unit)
+
+        size /= 1024
+
+    return '{:.1f} GiB'.format(size)
+
+
+class MemoryAccounting:
+    """Records the memory used by each stage of a run with tracemalloc."""
+
+    def __init__(self):
+        self.stages = []
+        self.snapshot = None
+        self.was_tracing = tracemalloc.is_tracing()
+
+        if not self.was_tracing:
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, count=None):
+        """Measures the code run inside it as one stage. count is the number of events it handled, if any.
+
+        Stages can't be nested, since measuring a stage resets the peak.
+        """
+
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+
+        try:
+            yield
+        finally:
+            after, peak = tracemalloc.get_traced_memory()
+
+            self.stages.append({'name': name,
+                                'count': count,
+                                'retained': after - before,
+                                'peak': peak - before,
+                                'rss': current_rss()})
+
+    def take_snapshot(self):
+        """Remembers what's allocated now, to list where it was allocated in the summary."""
+
+        self.snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+
+    def stop(self):
+        if not self.was_tracing:
+            tracemalloc.stop()
+
+    def summary(self):
+        lines = ['{:<12} {:>12} {:>12} {:>14} {:>12}'.format('stage', 'retained', 'peak', 'retained/event', 'rss after')]
+
+        for stage in self.stages:
+            per_event = format_bytes(stage['retained'] / stage['count']) if stage['count'] else ''
+
+            lines.append('{:<12} {:>12} {:>12} {:>14} {:>12}'.format(
+                stage['name'], format_bytes(stage['retained']), format_bytes(stage['peak']), per_event,
+                format_bytes(stage['rss'])))
+
+        lines.append('')
+        lines.append('peak rss: {}'.format(format_bytes(peak_rss())))
+
+        if self.snapshot is not None:
+            lines.append('')
+            lines.append('most memory held at the end of scoring:')
+
+            for statistic in self.snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                frame = statistic.traceback[0]
+
+                lines.append('  {:>12} in {} blocks  {}:{}'.format(
+                    format_bytes(statistic.size), statistic.count, os.path.basename(frame.filename), frame.lineno))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_summary(self, directory='tts_values'):
+        """Writes the summary to MEMORY_SUMMARY_FILE and prints the stages, then stops tracing."""
+
+        summary = self.summary()
+
+        with open(os.path.join(directory, MEMORY_SUMMARY_FILE), mode='w') as summary_file:
+            summary_file.write(summary)
+
+        print(summary.split('\n\n')[0])
+        print('wrote memory summary to {}'.format(os.path.join(directory, MEMORY_SUMMARY_FILE)))
+
+        self.stop()
@@ -0,0 +1,291 @@
+"""Collects metrics about scoring and search runs, and exports them in the OpenMetrics text format.
+
+Metrics are always collected, since counting costs next to nothing, but they're only
+exported when asked for, in one of two ways:
+ - written to a file every METRICS_INTERVAL seconds, for a textfile collector like
+   node_exporter's (--metrics-file), or
+ - served at http://127.0.0.1:<port>/metrics for Prometheus to scrape (--metrics-port).
+
+start.gg requests are counted by status, along with retries, time spent sleeping before
+retrying, time spent waiting for the rate limit and request latency. Nominatim lookups are counted by outcome, with their
+latency and the time spent waiting for the rate limit. Searches count the tournaments
+checked, the events discovered and the events skipped by reason, and scoring counts
+the events scored or failed, their durations and the number scored in the last minute.
+
+Metrics are kept per process, so workers started by ultrank_shard aren't included.
+"""
+
+import collections
+import math
+import os
+import re
+import threading
+import time
+
+# seconds between writes of the metrics file
+METRICS_INTERVAL = 15
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# every metric, in the order it's exported
+registry = []
+lock = threading.Lock()
+
+# times at which the events scored in the last minute finished
+recent_events = collections.deque()
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if len(names) == 0:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in zip(names, values)) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value that only goes up, like a number of requests."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+
+        registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self.values.items()):
+            yield self.name + '_total', format_labels(self.labels, label_values), value
+
+
+class Gauge:
+    """A value that goes up and down, like the number of events being scored.
+
+    If function is given, the value is whatever it returns when metrics are exported.
+    It's called while the metrics are locked, so it mustn't record any metrics itself.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, function=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = ()
+        self.value = 0
+        self.function = function
+
+        registry.append(self)
+
+    def inc(self, amount=1):
+        with lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        with lock:
+            self.value = value
+
+    def samples(self):
+        yield self.name, '', self.function() if self.function is not None else self.value
+
+
+class Histogram:
+    """Counts observations, like request latencies, in buckets of increasing size."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = sorted(buckets) + [math.inf]
+        # label values -> (count in each bucket, sum)
+        self.values = {}
+
+        registry.append(self)
+
+    def observe(self, value, *label_values):
+        with lock:
+            counts, total = self.values.get(label_values, ([0] * len(self.buckets), 0))
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+
+            self.values[label_values] = (counts, total + value)
+
+    def samples(self):
+        for label_values, (counts, total) in sorted(self.values.items()):
+            for bound, count in zip(self.buckets, counts):
+                yield (self.name + '_bucket', format_labels(self.labels + ('le',), label_values + (format_value(bound),)),
+                       count)
+
+            yield self.name + '_count', format_labels(self.labels, label_values), counts[-1]
+            yield self.name + '_sum', format_labels(self.labels, label_values), total
+
+
+def events_per_minute():
+    cutoff = time.time() - 60
+
+    while len(recent_events) > 0 and recent_events[0] < cutoff:
+        recent_events.popleft()
+
+    return len(recent_events)
+
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+EVENT_BUCKETS = [1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+startgg_requests = Counter('ultrank_startgg_requests', 'Requests sent to start.gg, by response status', ['status'])
+startgg_retries = Counter('ultrank_startgg_retries', 'start.gg requests that failed and were retried')
+startgg_retry_sleep = Counter('ultrank_startgg_retry_sleep_seconds', 'Seconds spent waiting to retry start.gg requests')
+startgg_throttle = Counter('ultrank_startgg_throttle_seconds', 'Seconds spent waiting for start.gg\'s rate limit')
+startgg_coalesced = Counter('ultrank_startgg_coalesced_requests',
+                            'start.gg requests answered by an identical request that was already being sent')
+startgg_response_bytes = Counter('ultrank_startgg_response_bytes', 'Bytes received from start.gg')
+startgg_latency = Histogram('ultrank_startgg_request_duration_seconds', 'Time taken by each request to start.gg',
+                            LATENCY_BUCKETS)
+
+nominatim_requests = Counter('ultrank_nominatim_requests', 'Address lookups sent to Nominatim, by outcome', ['outcome'])
+nominatim_throttle = Counter('ultrank_nominatim_throttle_seconds', 'Seconds spent waiting for Nominatim\'s rate limit')
+nominatim_latency = Histogram('ultrank_nominatim_request_duration_seconds', 'Time taken by each Nominatim lookup',
+                              LATENCY_BUCKETS)
+
+tournaments_checked = Counter('ultrank_tournaments_checked',
+                              'Tournaments checked by searches, by whether they were classified or reused from a previous search',
+                              ['source'])
+events_discovered = Counter('ultrank_events_discovered', 'Events found by searches to be scored')
+events_skipped = Counter('ultrank_events_skipped', 'Events skipped by searches, by reason', ['reason'])
+
+events = Counter('ultrank_events', 'Events that finished scoring, by outcome', ['outcome'])
+event_duration = Histogram('ultrank_event_duration_seconds', 'Time taken to score each event', EVENT_BUCKETS)
+events_in_progress = Gauge('ultrank_events_in_progress', 'Events being scored right now')
+events_per_minute_gauge = Gauge('ultrank_events_per_minute', 'Events that finished scoring in the last minute',
+                                function=events_per_minute)
+last_event = Gauge('ultrank_last_event_timestamp_seconds', 'When the last event finished scoring')
+
+
+def record_event(outcome, seconds):
+    """Records an event that finished scoring. outcome is 'scored', 'failed' or 'invalid'."""
+
+    events.inc(outcome)
+    event_duration.observe(seconds)
+
+    now = time.time()
+    last_event.set(now)
+
+    with lock:
+        recent_events.append(now)
+
+
+def skip_reason_label(reason):
+    """Shortens a skip reason from events.csv to its kind, dropping the details of the particular event."""
+
+    return re.split(r'\s*[\(\[]', reason, maxsplit=1)[0]
+
+
+def exposition():
+    """Returns every metric in the OpenMetrics text format."""
+
+    lines = []
+
+    with lock:
+        for metric in registry:
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            lines.append('# HELP {} {}'.format(metric.name, metric.help_text.replace('\\', '\\\\')))
+
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, format_value(value)))
+
+    lines.append('# EOF')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    # Written to a temporary file first, so a collector never reads a partial file
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+
+    with open(temp_path, mode='w', encoding='utf-8') as metrics_file:
+        metrics_file.write(exposition())
+
+    os.replace(temp_path, path)
+
+
+def start_textfile_writer(path, interval=METRICS_INTERVAL):
+    """Writes the metrics to path every interval seconds, and once more when the process exits."""
+
+    import atexit
+
+    def write_periodically():
+        while True:
+            write_textfile(path)
+            time.sleep(interval)
+
+    threading.Thread(target=write_periodically, daemon=True).start()
+    atexit.register(write_textfile, path)
+
+
+def start_http_server(port, host='127.0.0.1'):
+    """Serves the metrics at /metrics in a background thread, and returns the server."""
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+
+            body = exposition().encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Scrapes would otherwise be printed every few seconds
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-file', metavar='PATH',
+                        help='write metrics to this file every {} seconds, for a textfile collector'.format(METRICS_INTERVAL))
+    parser.add_argument('--metrics-port', type=int, metavar='PORT', help='serve metrics at http://127.0.0.1:PORT/metrics')
+
+
+def export_from_arguments(args):
+    """Starts exporting metrics as asked for by the arguments added by add_metrics_arguments."""
+
+    if args.metrics_file is not None:
+        start_textfile_writer(args.metrics_file)
+
+    if args.metrics_port is not None:
+        server = start_http_server(args.metrics_port)
+        print('serving metrics at http://{}:{}/metrics'.format(*server.server_address[:2]))
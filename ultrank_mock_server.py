@@ -0,0 +1,497 @@
+"""Serves a fake start.gg GraphQL API from synthetic data, for load and throughput testing.
+
+Only the queries this project sends are understood, and they are told apart by
+their operation names. Latency, rate limit (429) and bad gateway (502) errors and a
+per-minute quota for each API key can be injected to see how scoring behaves
+under them.
+
+Start the server with `python ultrank_mock_server.py`, and point the other scripts
+at it by setting the STARTGG_ENDPOINT environment variable to its address.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import collections
+import csv
+import json
+import random
+import re
+import threading
+import time
+
+DEFAULT_PORT = 8766
+
+# start.gg allows 80 requests per minute for each key
+DEFAULT_QUOTA = 80
+
+ULTIMATE_ID = 1386
+
+# Venues of the synthetic tournaments, with the addresses Nominatim gives for them
+MOCK_VENUES = [
+    ((34.0522, -118.2437), {'country_code': 'us', 'state': 'California', 'ISO3166-2-lvl4': 'US-CA',
+                            'county': 'Los Angeles County', 'city': 'Los Angeles'}),
+    ((40.7128, -74.006), {'country_code': 'us', 'state': 'New York', 'ISO3166-2-lvl4': 'US-NY',
+                          'county': 'New York County', 'city': 'New York'}),
+    ((35.6762, 139.6503), {'country_code': 'jp', 'ISO3166-2-lvl4': 'JP-13', 'postcode': '100-0001', 'city': 'Tokyo'}),
+    ((19.4326, -99.1332), {'country_code': 'mx', 'ISO3166-2-lvl4': 'MX-CMX', 'city': 'Ciudad de México'}),
+    ((48.8566, 2.3522), {'country_code': 'fr', 'ISO3166-2-lvl4': 'FR-IDF', 'city': 'Paris'}),
+    ((51.5072, -0.1276), {'country_code': 'gb', 'ISO3166-2-lvl4': 'GB-ENG', 'city': 'London'}),
+]
+
+# share of sets that are DQs
+MOCK_DQ_RATE = 0.03
+
+# start.gg rejects queries that could return more than 1000 objects
+DEFAULT_COMPLEXITY_LIMIT = 1000
+
+operation_regex = re.compile(r'query\s+(\w+)')
+
+
+def read_known_players(path='ultrank_players.csv'):
+    """Reads (id, tag) pairs of ranked players, so synthetic events have some players with values."""
+
+    players = {}
+
+    try:
+        with open(path, newline='', encoding='utf-8') as players_file:
+            for row in csv.DictReader(players_file):
+                if row['Start.gg Num ID'].strip().isdigit():
+                    players[int(row['Start.gg Num ID'])] = row['Player']
+    except FileNotFoundError:
+        pass
+
+    return list(players.items())
+
+
+class MockEvent:
+    """An event's synthetic entrants, phases and sets. Built the first time the event is queried."""
+
+    def __init__(self, index, tournament, slug, num_entrants, known_players, seed):
+        rng = random.Random('{}:{}'.format(seed, slug))
+
+        self.slug = slug
+        self.tournament = tournament
+
+        # A share of the entrants are ranked players, more of them at larger events
+        num_known = min(len(known_players), rng.randint(0, max(1, num_entrants // 4)))
+        players = rng.sample(known_players, num_known)
+        players += [(900000000 + index * 10000 + i, 'Mock Player {}-{}'.format(index, i))
+                    for i in range(num_entrants - num_known)]
+        rng.shuffle(players)
+
+        self.entrants = [{'id': index * 100000 + i, 'participants': [{'player': {'id': id_, 'gamerTag': tag}}]}
+                         for i, (id_, tag) in enumerate(players)]
+
+        self.phases = [{'id': index * 10 + 1, 'name': 'Pools', 'state': 'COMPLETED', 'isExhibition': False},
+                       {'id': index * 10 + 2, 'name': 'Top 16', 'state': 'COMPLETED', 'isExhibition': False},
+                       {'id': index * 10 + 3, 'name': 'Amateur Bracket', 'state': 'COMPLETED', 'isExhibition': True}]
+
+        self.sets = []
+        completed_at = tournament['startAt']
+
+        def add_set(phase, entrant_0, entrant_1):
+            nonlocal completed_at
+            completed_at += rng.randint(60, 600)
+
+            winner = rng.randint(0, 1)
+            scores = [0, 0]
+            scores[winner] = 2
+            scores[1 - winner] = -1 if rng.random() < MOCK_DQ_RATE else rng.randint(0, 1)
+
+            self.sets.append({'id': index * 1000000 + len(self.sets),
+                              'phaseId': phase['id'],
+                              'completedAt': completed_at,
+                              'wPlacement': 1,
+                              'winnerId': (entrant_0, entrant_1)[winner]['id'],
+                              'slots': [{'entrant': entrant, 'standing': {'stats': {'score': {'value': score}}}}
+                                        for entrant, score in zip((entrant_0, entrant_1), scores)]})
+
+            return (entrant_0, entrant_1)[winner]
+
+        # Round robin pools of 4, and a single elimination bracket of the pool winners
+        winners = []
+        for start in range(0, len(self.entrants), 4):
+            pool = self.entrants[start:start + 4]
+
+            for i in range(len(pool)):
+                for j in range(i + 1, len(pool)):
+                    add_set(self.phases[0], pool[i], pool[j])
+
+            winners.append(rng.choice(pool))
+
+        while len(winners) > 1:
+            winners = [add_set(self.phases[1], winners[i], winners[i + 1]) if i + 1 < len(winners) else winners[i]
+                       for i in range(0, len(winners), 2)]
+
+
+class MockData:
+    """Synthetic tournaments, spread evenly between two timestamps."""
+
+    def __init__(self, num_tournaments=100, start_time=None, end_time=None, seed=0, players_file='ultrank_players.csv'):
+        self.end_time = int(end_time if end_time is not None else time.time())
+        self.start_time = int(start_time if start_time is not None else self.end_time - 30 * 24 * 60 * 60)
+        self.seed = seed
+        self.known_players = read_known_players(players_file)
+
+        rng = random.Random(seed)
+
+        self.tournaments = {}
+        # slug -> (index, tournament, number of entrants)
+        self.event_info = {}
+        self.events = {}
+        self.events_lock = threading.Lock()
+
+        num_owners = max(1, num_tournaments // 4)
+        series_numbers = collections.Counter()
+
+        for i in range(num_tournaments):
+            owner = rng.randrange(num_owners)
+
+            # Even owners run a series of similarly named tournaments, so weekly checks have something to find
+            if owner % 2 == 0:
+                series_numbers[owner] += 1
+                name = 'Mock Series {} #{}'.format(owner, series_numbers[owner])
+            else:
+                name = 'Mock Open {}'.format(i)
+
+            (lat, lng), _ = rng.choice(MOCK_VENUES)
+            tournament_slug = 'tournament/mock-{}'.format(i)
+
+            tournament = {'slug': tournament_slug,
+                          'name': name,
+                          'startAt': self.start_time + (self.end_time - self.start_time) * i // max(1, num_tournaments),
+                          'lat': lat,
+                          'lng': lng,
+                          'owner': {'id': 1000 + owner,
+                                    'discriminator': 'm{:07x}'.format(owner),
+                                    'player': {'gamerTag': 'Mock Organizer {}'.format(owner)}},
+                          'hasOfflineEvents': True,
+                          'events': []}
+
+            # Event sizes are skewed like real ones: mostly locals, a few large events
+            singles_entrants = min(2000, int(8 * 1.6 ** rng.expovariate(0.4)))
+            events = [('ultimate-singles', 'Ultimate Singles', 1, singles_entrants)]
+            if rng.random() < 0.4:
+                events.append(('ultimate-doubles', 'Ultimate Doubles', 5, max(2, singles_entrants // 3)))
+            if rng.random() < 0.3:
+                events.append(('redemption-bracket', 'Redemption Bracket', 1, max(2, singles_entrants // 4)))
+
+            for event_name, display_name, event_type, num_entrants in events:
+                event_slug = '{}/event/{}'.format(tournament_slug, event_name)
+
+                tournament['events'].append({'name': display_name,
+                                             'type': event_type,
+                                             'videogame': {'id': ULTIMATE_ID},
+                                             'slug': event_slug,
+                                             'numEntrants': num_entrants,
+                                             'startAt': tournament['startAt']})
+
+                self.event_info[event_slug] = (len(self.event_info) + 1, tournament, num_entrants)
+
+            self.tournaments[tournament_slug] = tournament
+
+    def event_slugs(self):
+        """Returns the slug of the singles event of every tournament."""
+
+        return ['{}/event/ultimate-singles'.format(slug) for slug in self.tournaments]
+
+    def event(self, slug):
+        with self.events_lock:
+            if slug not in self.events:
+                if slug not in self.event_info:
+                    return None
+
+                index, tournament, num_entrants = self.event_info[slug]
+                self.events[slug] = MockEvent(index, tournament, slug, num_entrants, self.known_players, self.seed)
+
+            return self.events[slug]
+
+    def owner_tournaments(self, owner_id):
+        """Returns the tournaments run by an owner, most recent first, like start.gg does."""
+
+        return sorted([tournament for tournament in self.tournaments.values() if tournament['owner']['id'] == owner_id],
+                      key=lambda tournament: tournament['startAt'], reverse=True)
+
+
+def query_complexity(query, variables):
+    """Estimates the objects a query returns: the objects in each of its nodes, times the page size."""
+
+    start = query.find('nodes {')
+    if start == -1:
+        return 1
+
+    depth = 0
+    objects = 0
+    for character in query[start:]:
+        if character == '{':
+            depth += 1
+            objects += 1
+        elif character == '}':
+            depth -= 1
+            if depth == 0:
+                break
+
+    return objects * variables.get('perPage', 1)
+
+
+def paginate(nodes, page, per_page):
+    return {'pageInfo': {'page': page, 'totalPages': max(1, -(-len(nodes) // per_page))},
+            'nodes': nodes[(page - 1) * per_page:page * per_page]}
+
+
+class MockStartgg:
+    """Answers GraphQL requests from MockData, injecting the configured faults."""
+
+    def __init__(self, data, latency=0, error_rate_429=0, error_rate_502=0, quota=DEFAULT_QUOTA,
+                 complexity_limit=DEFAULT_COMPLEXITY_LIMIT, seed=0):
+        self.data = data
+        self.complexity_limit = complexity_limit
+        self.latency = latency
+        self.error_rate_429 = error_rate_429
+        self.error_rate_502 = error_rate_502
+        self.quota = quota
+
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        # API key -> times of the requests it made in the last minute
+        self.recent_requests = collections.defaultdict(collections.deque)
+        # (operation, status code) -> number of responses
+        self.stats = collections.Counter()
+
+    def handle(self, key, body):
+        """Returns the status code and JSON response for a request body."""
+
+        query = body.get('query', '')
+        variables = body.get('variables') or {}
+        if isinstance(variables, str):
+            variables = json.loads(variables)
+
+        match = operation_regex.search(query)
+        operation = match.group(1) if match is not None else ''
+
+        status = self.check_faults(key)
+
+        if status == 200 and self.complexity_limit is not None and query_complexity(query, variables) > self.complexity_limit:
+            status = 400
+            response = {'success': False,
+                        'message': 'Your query complexity is too high. A maximum of {} objects may be returned by each request.'.format(
+                            self.complexity_limit)}
+        elif status == 200:
+            if self.latency > 0:
+                time.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+
+            response = self.resolve(operation, query, variables)
+        else:
+            response = {'success': False, 'message': 'mock error {}'.format(status)}
+
+        with self.lock:
+            self.stats[(operation, status)] += 1
+
+        return status, response
+
+    def check_faults(self, key):
+        now = time.time()
+
+        with self.lock:
+            recent = self.recent_requests[key]
+            while len(recent) > 0 and recent[0] <= now - 60:
+                recent.popleft()
+
+            if self.quota is not None and len(recent) >= self.quota:
+                return 429
+
+            recent.append(now)
+
+            roll = self.rng.random()
+
+        if roll < self.error_rate_429:
+            return 429
+        if roll < self.error_rate_429 + self.error_rate_502:
+            return 502
+
+        return 200
+
+    def resolve(self, operation, query, variables):
+        data = self.data
+
+        if operation == 'getEntrants':
+            event = data.event(variables['eventSlug'])
+            if event is None:
+                return {'data': {'event': None}}
+
+            return {'data': {'event': {'entrants': paginate(event.entrants, variables['pageNum'], variables['perPage'])}}}
+
+        if operation == 'getSets':
+            event = data.event(variables['eventSlug'])
+            if event is None:
+                return {'data': {'event': None}}
+
+            phase_ids = set(int(phase_id) for phase_id in variables.get('phases') or [])
+            updated_after = variables.get('updatedAfter')
+
+            sets = [{key: value for key, value in set_data.items() if key != 'phaseId'} for set_data in event.sets
+                    if (len(phase_ids) == 0 or set_data['phaseId'] in phase_ids)
+                    and (updated_after is None or set_data['completedAt'] > updated_after)]
+
+            # Only send the players of each entrant if they were asked for
+            if 'participants' not in query:
+                sets = [dict(set_data, slots=[dict(slot, entrant={'id': slot['entrant']['id']}) for slot in set_data['slots']])
+                        for set_data in sets]
+
+            return {'data': {'event': {'sets': paginate(sets, variables['pageNum'], variables['perPage'])}}}
+
+        if operation == 'getPhases':
+            event = data.event(variables['eventSlug'])
+            if event is None:
+                return {'data': {'event': None}}
+
+            phases = event.phases
+
+            # Every mock set is completed
+            if 'sets' in query:
+                phases = [dict(phase, sets={'pageInfo': {'total': len([set_data for set_data in event.sets
+                                                                       if set_data['phaseId'] == phase['id']])}})
+                          for phase in phases]
+
+            return {'data': {'event': {'phases': phases}}}
+
+        if operation == 'getLoc':
+            event = data.event(variables['eventSlug'])
+            if event is None:
+                return {'data': {'event': None}}
+
+            # The time query shares its operation name with the location query
+            if 'startAt' in query:
+                return {'data': {'event': {'startAt': event.tournament['startAt']}}}
+
+            return {'data': {'event': {'tournament': {'lat': event.tournament['lat'], 'lng': event.tournament['lng']}}}}
+
+        if operation == 'getLocs':
+            events = {}
+
+            for name, slug in variables.items():
+                event = data.event(slug)
+                events['e' + name[len('slug'):]] = {'tournament': {'lat': event.tournament['lat'],
+                                                                   'lng': event.tournament['lng']}} if event is not None else None
+
+            return {'data': events}
+
+        if operation == 'getCosts':
+            events = {}
+
+            for name, slug in variables.items():
+                event = data.event(slug)
+                events['e' + name[len('slug'):]] = {'numEntrants': data.event_info[slug][2],
+                                                    'phases': event.phases} if event is not None else None
+
+            return {'data': events}
+
+        if operation == 'nameQuery':
+            event = data.event(variables['eventSlug'])
+            if event is None:
+                return {'data': {'event': None}}
+
+            return {'data': {'event': {'name': next(e['name'] for e in event.tournament['events'] if e['slug'] == event.slug),
+                                       'tournament': {'name': event.tournament['name']}}}}
+
+        if operation == 'tournamentsQuery':
+            tournaments = [tournament for tournament in data.tournaments.values()
+                           if variables['startTime'] <= tournament['startAt'] <= variables['endTime']]
+
+            return {'data': {'tournaments': paginate(tournaments, variables['pageNum'], variables['perPage'])}}
+
+        if operation == 'tournamentAdminQuery':
+            tournament = data.tournaments.get(variables['tournamentSlug'])
+            if tournament is None:
+                return {'data': {'tournament': None}}
+
+            owner = dict(tournament['owner'])
+            owner['tournaments'] = paginate(data.owner_tournaments(owner['id']), variables['pageNum'], variables['perPage'])
+
+            return {'data': {'tournament': dict(tournament, owner=owner)}}
+
+        if operation == 'tournamentOwnerQuery':
+            tournament = data.tournaments.get(variables['tournamentSlug'])
+
+            return {'data': {'tournament': tournament}}
+
+        return {'errors': [{'message': 'mock server doesn\'t know the operation "{}"'.format(operation)}]}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json([{'operation': operation, 'status': status, 'count': count}
+                            for (operation, status), count in sorted(self.server.mock.stats.items())])
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json({'errors': [{'message': 'invalid JSON body'}]}, 400)
+            return
+
+        status, response = self.server.mock.handle(self.headers.get('Authorization', ''), body)
+        self.send_json(response, status)
+
+    def log_message(self, format, *args):
+        # Every request would be logged otherwise, which is too much under load
+        pass
+
+
+def make_server(mock, host='127.0.0.1', port=DEFAULT_PORT):
+    """Creates an HTTP server for a MockStartgg. Port 0 picks any free port."""
+
+    server = ThreadingHTTPServer((host, port), MockRequestHandler)
+    server.mock = mock
+
+    return server
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--tournaments', type=int, default=100, help='number of synthetic tournaments')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.1, help='average seconds taken to answer a request')
+    parser.add_argument('--error-429', type=float, default=0, help='share of requests answered with 429')
+    parser.add_argument('--error-502', type=float, default=0, help='share of requests answered with 502')
+    parser.add_argument('--quota', type=int, default=DEFAULT_QUOTA, help='requests allowed per minute for each key')
+    parser.add_argument('--complexity-limit', type=int, default=DEFAULT_COMPLEXITY_LIMIT,
+                        help='most objects a query may return')
+
+
+def mock_from_arguments(args):
+    return MockStartgg(MockData(args.tournaments, seed=args.seed), latency=args.latency, error_rate_429=args.error_429,
+                       error_rate_502=args.error_502, quota=args.quota if args.quota > 0 else None,
+                       complexity_limit=args.complexity_limit if args.complexity_limit > 0 else None, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake start.gg API from synthetic data.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    mock = mock_from_arguments(args)
+    server = make_server(mock, args.host, args.port)
+
+    print('serving {} tournaments between {} and {}'.format(len(mock.data.tournaments), mock.data.start_time,
+                                                           mock.data.end_time))
+    print('set STARTGG_ENDPOINT=http://{}:{}/ to use it'.format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,303 @@
+"""Compiles the player CSVs into a read-only binary table that can be memory-mapped.
+
+Worker processes that map the same file share its pages through the OS page
+cache, instead of each parsing the CSVs into their own objects.
+
+File layout (little-endian):
+ header       - magic, section counts and offsets
+ int ids      - sorted start.gg IDs of players that have one (int64)
+ str ids      - string indices of players identified by tag only, sorted by string (uint32)
+ order        - record indices of the players in the order they were given, for iterating (uint32)
+ players      - one record per player, int ID players first, in the same order as the ID indices
+ values       - point values, each player's values stored together
+ alt tags     - string indices of alternative tags
+ tags         - string indices of every known tag (lowercase), sorted by string
+ strings      - end offsets of every string (uint32), followed by the UTF-8 string pool
+"""
+
+import bisect
+import datetime
+import mmap
+import struct
+
+PLAYER_TABLE_MAGIC = b'ULTRPT02'
+
+HEADER = struct.Struct('<8s7I8Q')
+# tag, hex, alt tags start, alt tags count, values start, values count, invit values start, invit values count
+PLAYER_RECORD = struct.Struct('<8I')
+# points, category, note, start date ordinal, end date ordinal, depreciated from (-1 if not depreciated)
+VALUE_RECORD = struct.Struct('<iIIiii')
+
+
+class StringPool:
+    """Collects strings while compiling, storing each distinct string once."""
+
+    def __init__(self):
+        self.indices = {}
+        self.strings = []
+
+    def add(self, string):
+        if string not in self.indices:
+            self.indices[string] = len(self.strings)
+            self.strings.append(string)
+
+        return self.indices[string]
+
+
+def date_ordinal(date):
+    return date.toordinal() if date is not None else 0
+
+
+def ordinal_date(ordinal):
+    return datetime.date.fromordinal(ordinal) if ordinal != 0 else None
+
+
+def compile_player_table(players, tags, path):
+    """Writes players and tags (as returned by ultrank_tiering.read_players) to a table file.
+
+    The table iterates over players in the same order as players does.
+    """
+
+    pool = StringPool()
+
+    int_ids = sorted(id_ for id_ in players if isinstance(id_, int))
+    str_ids = sorted(id_ for id_ in players if not isinstance(id_, int))
+
+    player_records = []
+    value_records = []
+    alt_tags = []
+
+    def add_values(values):
+        start = len(value_records)
+
+        for value in values:
+            value_records.append(VALUE_RECORD.pack(value.points, pool.add(value.category), pool.add(value.note),
+                                                   date_ordinal(value.start_time), date_ordinal(value.end_time),
+                                                   value.depreciated_from if value.depreciated_from is not None else -1))
+
+        return start, len(values)
+
+    for id_ in int_ids + str_ids:
+        group = players[id_]
+
+        alt_tags_start = len(alt_tags)
+        alt_tags.extend(pool.add(tag) for tag in group.other_tags)
+
+        values_start, values_count = add_values(group.values)
+        invit_start, invit_count = add_values(group.invitational_values)
+
+        player_records.append(PLAYER_RECORD.pack(pool.add(group.tag), pool.add(group.hex_), alt_tags_start,
+                                                 len(group.other_tags), values_start, values_count, invit_start, invit_count))
+
+    str_id_indices = [pool.add(id_) for id_ in str_ids]
+
+    record_indices = {id_: index for index, id_ in enumerate(int_ids + str_ids)}
+    order = [record_indices[id_] for id_ in players]
+    tag_indices = [pool.add(tag) for tag in sorted(tags)]
+
+    encoded = [string.encode('utf-8') for string in pool.strings]
+    string_offsets = []
+    end = 0
+    for string in encoded:
+        end += len(string)
+        string_offsets.append(end)
+
+    sections = [struct.pack('<{}q'.format(len(int_ids)), *int_ids),
+                struct.pack('<{}I'.format(len(str_id_indices)), *str_id_indices),
+                struct.pack('<{}I'.format(len(order)), *order),
+                b''.join(player_records),
+                b''.join(value_records),
+                struct.pack('<{}I'.format(len(alt_tags)), *alt_tags),
+                struct.pack('<{}I'.format(len(tag_indices)), *tag_indices),
+                struct.pack('<{}I'.format(len(string_offsets)), *string_offsets) + b''.join(encoded)]
+
+    offsets = []
+    position = HEADER.size
+    for section in sections:
+        # Keep every section 8-byte aligned so it can be cast directly
+        position += -position % 8
+        offsets.append(position)
+        position += len(section)
+
+    with open(path, mode='wb') as table_file:
+        table_file.write(HEADER.pack(PLAYER_TABLE_MAGIC, len(int_ids), len(str_ids), len(player_records),
+                                     len(value_records), len(alt_tags), len(tag_indices), len(encoded), *offsets))
+
+        for offset, section in zip(offsets, sections):
+            table_file.write(b'\0' * (offset - table_file.tell()))
+            table_file.write(section)
+
+
+class StringSequence:
+    """Sequence of strings looked up by index, so bisect can search sorted string sections."""
+
+    def __init__(self, table, indices):
+        self.table = table
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.table.string(self.indices[i])
+
+
+class MappedTagSet:
+    """Set of known tags, read from a mapped table."""
+
+    def __init__(self, table, indices):
+        self.tags = StringSequence(table, indices)
+
+    def __contains__(self, tag):
+        i = bisect.bisect_left(self.tags, tag)
+        return i < len(self.tags) and self.tags[i] == tag
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __iter__(self):
+        return (self.tags[i] for i in range(len(self.tags)))
+
+
+class MappedPlayerTable:
+    """Read-only mapping of player IDs to player value groups, backed by a table file.
+
+    Groups are built on access by build_group, which receives the player's ID, hex ID,
+    tag, alternative tags, values and invitational values. Values are given as tuples of
+    (points, category, note, start date, end date, depreciated from).
+    """
+
+    def __init__(self, path, build_group):
+        self.path = path
+        self.build_group = build_group
+
+        with open(path, mode='rb') as table_file:
+            self.map = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = HEADER.unpack_from(self.map, 0)
+
+        if header[0] != PLAYER_TABLE_MAGIC:
+            raise ValueError('{} is not a compiled player table, or was compiled by an older version'.format(path))
+
+        n_int, n_str, n_players, n_values, n_alt_tags, n_tags, n_strings = header[1:8]
+        offsets = header[8:]
+
+        view = memoryview(self.map)
+
+        self.int_ids = view[offsets[0]:offsets[0] + 8 * n_int].cast('q')
+        self.str_id_indices = view[offsets[1]:offsets[1] + 4 * n_str].cast('I')
+        self.order = view[offsets[2]:offsets[2] + 4 * n_players].cast('I')
+        self.players_offset = offsets[3]
+        self.values_offset = offsets[4]
+        self.alt_tags = view[offsets[5]:offsets[5] + 4 * n_alt_tags].cast('I')
+        self.string_ends = view[offsets[7]:offsets[7] + 4 * n_strings].cast('I')
+        self.strings_offset = offsets[7] + 4 * n_strings
+        self.num_players = n_players
+
+        self.str_ids = StringSequence(self, self.str_id_indices)
+        self.tags = MappedTagSet(self, view[offsets[6]:offsets[6] + 4 * n_tags].cast('I'))
+
+    def string(self, i):
+        start = self.string_ends[i - 1] if i > 0 else 0
+        return self.map[self.strings_offset + start:self.strings_offset + self.string_ends[i]].decode('utf-8')
+
+    def index_of(self, id_):
+        """Returns the record index of a player, or None if the player isn't in the table."""
+
+        if isinstance(id_, int):
+            i = bisect.bisect_left(self.int_ids, id_)
+            if i < len(self.int_ids) and self.int_ids[i] == id_:
+                return i
+        else:
+            i = bisect.bisect_left(self.str_ids, id_)
+            if i < len(self.str_ids) and self.str_ids[i] == id_:
+                return len(self.int_ids) + i
+
+        return None
+
+    def id_at(self, index):
+        if index < len(self.int_ids):
+            return self.int_ids[index]
+
+        return self.str_ids[index - len(self.int_ids)]
+
+    def read_values(self, start, count):
+        values = []
+
+        for i in range(start, start + count):
+            points, category, note, start_ordinal, end_ordinal, depreciated_from = VALUE_RECORD.unpack_from(
+                self.map, self.values_offset + i * VALUE_RECORD.size)
+
+            values.append((points, self.string(category), self.string(note), ordinal_date(start_ordinal),
+                           ordinal_date(end_ordinal), depreciated_from if depreciated_from != -1 else None))
+
+        return values
+
+    def tags_at(self, index):
+        """Returns the tag and alternative tags of a player, without building its group."""
+
+        tag, _, alt_start, alt_count = PLAYER_RECORD.unpack_from(self.map, self.players_offset + index * PLAYER_RECORD.size)[:4]
+
+        return self.string(tag), [self.string(self.alt_tags[i]) for i in range(alt_start, alt_start + alt_count)]
+
+    def tag_entries(self):
+        """Yields (ID, tag, alternative tags) for every player, without building their groups."""
+
+        for index in self.order:
+            yield (self.id_at(index), *self.tags_at(index))
+
+    def group_at(self, index):
+        tag, hex_, alt_start, alt_count, values_start, values_count, invit_start, invit_count = PLAYER_RECORD.unpack_from(
+            self.map, self.players_offset + index * PLAYER_RECORD.size)
+
+        return self.build_group(self.id_at(index), self.string(hex_), self.string(tag),
+                                [self.string(self.alt_tags[i]) for i in range(alt_start, alt_start + alt_count)],
+                                self.read_values(values_start, values_count),
+                                self.read_values(invit_start, invit_count))
+
+    def __contains__(self, id_):
+        return self.index_of(id_) is not None
+
+    def __getitem__(self, id_):
+        index = self.index_of(id_)
+
+        if index is None:
+            raise KeyError(id_)
+
+        return self.group_at(index)
+
+    def get(self, id_, default=None):
+        index = self.index_of(id_)
+
+        return self.group_at(index) if index is not None else default
+
+    def __len__(self):
+        return self.num_players
+
+    # Players are iterated in the order they were compiled in, like the dict they came from
+
+    def __iter__(self):
+        return (self.id_at(index) for index in self.order)
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        return (self.group_at(index) for index in self.order)
+
+    def items(self):
+        return ((self.id_at(index), self.group_at(index)) for index in self.order)
+
+
+if __name__ == '__main__':
+    from ultrank_tiering import read_players
+
+    path = input('input file to write the player table to (leave blank for ultrank_players.bin): ')
+    if path.strip() == '':
+        path = 'ultrank_players.bin'
+
+    players, tags = read_players()
+    compile_player_table(players, tags, path)
+
+    print('wrote {} players to {}'.format(len(players), path))
+    print('set the ULTRANK_PLAYER_TABLE environment variable to this file to use it')
@@ -0,0 +1,107 @@
+"""Profiles the scoring of individual events.
+
+Each event is scored under cProfile, and its profile is written next to its
+report as <report name>.prof. Profiles measure CPU time, so functions waiting on
+the network don't crowd out the ones doing the work. Once the run is done, the
+profiles are merged into profile_all.prof, and profile_summary.txt lists the
+slowest events, with the time spent waiting on start.gg and Nominatim split from
+CPU time, followed by the functions the whole run spent the most time in.
+
+Profiles can be opened with `python -m pstats <file>` or a viewer like snakeviz.
+
+Events have to be profiled one at a time, since only one profiler can be active
+at a time from Python 3.12.
+"""
+
+from startgg_toolkit import thread_network_wait
+import cProfile
+import io
+import os
+import pstats
+import time
+
+# number of functions listed in the hotspot summary
+HOTSPOT_COUNT = 30
+
+# number of events listed in the summary, slowest first
+SLOWEST_EVENT_COUNT = 20
+
+
+class EventTiming:
+    def __init__(self, name, wall, cpu, network):
+        self.name = name
+        self.wall = wall
+        self.cpu = cpu
+        self.network = network
+
+    def other(self):
+        """Returns the time that was neither CPU time nor network wait, like waiting for locks."""
+
+        return max(0, self.wall - self.cpu - self.network)
+
+
+class EventProfiler:
+    def __init__(self, directory='tts_values'):
+        self.directory = directory
+        self.paths = []
+        self.timings = []
+
+    def run(self, name, func, *args, **kwargs):
+        """Calls func under the profiler, and writes its profile to <name>.prof."""
+
+        profile = cProfile.Profile(time.thread_time)
+
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        network = thread_network_wait()
+
+        profile.enable()
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+
+            self.timings.append(EventTiming(name, time.perf_counter() - wall, time.thread_time() - cpu,
+                                            thread_network_wait() - network))
+
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+
+            path = os.path.join(self.directory, '{}.prof'.format(name))
+            profile.dump_stats(path)
+            self.paths.append(path)
+
+    def write_summary(self, hotspots=HOTSPOT_COUNT):
+        """Merges the profiles of every event, and writes the summary of the run."""
+
+        if len(self.paths) == 0:
+            return
+
+        summary = io.StringIO()
+
+        total_wall = sum(timing.wall for timing in self.timings)
+        total_cpu = sum(timing.cpu for timing in self.timings)
+        total_network = sum(timing.network for timing in self.timings)
+
+        summary.write('{} events profiled\n'.format(len(self.timings)))
+        summary.write('wall time:    {:.1f}s\n'.format(total_wall))
+        summary.write('CPU time:     {:.1f}s\n'.format(total_cpu))
+        summary.write('network wait: {:.1f}s\n'.format(total_network))
+        summary.write('\n')
+
+        summary.write('{:>9} {:>9} {:>9} {:>9}  {}\n'.format('wall', 'cpu', 'network', 'other', 'event'))
+        for timing in sorted(self.timings, key=lambda timing: timing.wall, reverse=True)[:SLOWEST_EVENT_COUNT]:
+            summary.write('{:>8.2f}s {:>8.2f}s {:>8.2f}s {:>8.2f}s  {}\n'.format(
+                timing.wall, timing.cpu, timing.network, timing.other(), timing.name))
+        summary.write('\n')
+
+        stats = pstats.Stats(*self.paths, stream=summary)
+        stats.dump_stats(os.path.join(self.directory, 'profile_all.prof'))
+        stats.sort_stats('tottime').print_stats(hotspots)
+
+        summary_path = os.path.join(self.directory, 'profile_summary.txt')
+        with open(summary_path, mode='w') as summary_file:
+            summary_file.write(summary.getvalue())
+
+        print('wrote profile summary to {}'.format(summary_path))
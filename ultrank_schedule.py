@@ -0,0 +1,235 @@
+"""Orders bulk scoring jobs by their estimated cost, and reports progress with an ETA.
+
+The cost of an event is estimated in start.gg requests from its number of entrants
+and whether any of its phases are complete: entrants are fetched in pages, and
+events that have progressed also have their sets fetched. Events found by
+ultrank_search already know their size. The sizes of other events are fetched in
+batches before scoring starts.
+
+Scoring the largest events first keeps concurrent workers balanced, since no large
+event is left to run alone at the end. Progress reports estimate the time left
+from how long each unit of estimated cost has taken so far.
+
+With a memory budget, new events are only started alongside running ones while the
+process is comfortably under budget (see ultrank_memory.py), so a run that's close
+to its budget carries on one event at a time.
+"""
+
+from startgg_toolkit import send_request, startgg_slug_regex
+from ultrank_memory import within_budget, current_rss, format_bytes
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import datetime
+import json
+import math
+import threading
+import time
+
+# requests every event makes whatever its size, like its phases, name and location
+BASE_REQUESTS = 4
+
+# requests that aren't needed if the event's name, start time and location are already known
+METADATA_REQUESTS = 3
+
+ENTRANTS_PER_PAGE = 200
+SETS_PER_PAGE = 80
+
+# a double elimination bracket has about two sets per entrant
+SETS_PER_ENTRANT = 2
+
+# number of events whose sizes are fetched in one query
+COST_BATCH_SIZE = 50
+
+# seconds between progress reports
+PROGRESS_INTERVAL = 10
+
+# 'largest' runs the most expensive events first, which balances workers best,
+# 'smallest' runs the cheapest first for quick feedback, and 'input' keeps the input order
+ORDERS = ['largest', 'smallest', 'input']
+
+
+def estimate_cost(num_entrants, progressed, known_metadata=False):
+    """Estimates the number of requests it takes to score an event."""
+
+    num_entrants = max(1, num_entrants)
+
+    entrant_pages = math.ceil(num_entrants / ENTRANTS_PER_PAGE)
+    set_pages = math.ceil(num_entrants * SETS_PER_ENTRANT / SETS_PER_PAGE) if progressed else 0
+
+    return BASE_REQUESTS - (METADATA_REQUESTS if known_metadata else 0) + entrant_pages + set_pages
+
+
+def costs_query(event_slugs):
+    """Generates a query to retrieve the sizes and phase states of several events at once.
+
+    The event with slug event_slugs[i] is returned as e{i}.
+    """
+
+    events = ''.join('''  e{0}: event(slug: $slug{0}) {{
+    numEntrants
+    phases {{
+      state
+      isExhibition
+    }}
+  }}
+'''.format(i) for i in range(len(event_slugs)))
+
+    query = 'query getCosts({}) {{\n{}}}'.format(
+        ', '.join('$slug{}: String'.format(i) for i in range(len(event_slugs))), events)
+    variables = json.dumps({'slug{}'.format(i): slug for i, slug in enumerate(event_slugs)})
+
+    return query, variables
+
+
+def estimate_costs(slugs):
+    """Returns the estimated cost of every slug object, in order.
+
+    Events that can't be found are given the cost of an event with a single entrant.
+    """
+
+    costs = [None] * len(slugs)
+    unknown = {}
+    now = time.time()
+
+    for idx, slug_obj in enumerate(slugs):
+        metadata = slug_obj.get('metadata') or {}
+
+        if metadata.get('num_entrants') is not None:
+            # Events found by a search are assumed to have progressed once they've started
+            progressed = metadata.get('start_at') is not None and metadata['start_at'] < now
+            costs[idx] = estimate_cost(metadata['num_entrants'], progressed, known_metadata=True)
+        elif startgg_slug_regex.fullmatch(slug_obj['slug']):
+            unknown.setdefault(slug_obj['slug'], []).append(idx)
+
+    unknown_slugs = list(unknown)
+
+    for i in range(0, len(unknown_slugs), COST_BATCH_SIZE):
+        batch = unknown_slugs[i:i + COST_BATCH_SIZE]
+
+        query, variables = costs_query(batch)
+        resp = send_request(query, variables)
+
+        try:
+            for j, slug in enumerate(batch):
+                event = resp['data']['e{}'.format(j)]
+
+                if event is None:
+                    continue
+
+                progressed = any(phase['state'] == 'COMPLETED' and not phase['isExhibition']
+                                 for phase in event['phases'] or [])
+                cost = estimate_cost(event['numEntrants'] or 0, progressed)
+
+                for idx in unknown[slug]:
+                    costs[idx] = cost
+        except Exception as e:
+            print(e)
+            print(resp)
+
+    return [cost if cost is not None else estimate_cost(1, False) for cost in costs]
+
+
+def order_jobs(costs, order='largest'):
+    """Returns the indices of the jobs in the order they should be run."""
+
+    indices = list(range(len(costs)))
+
+    if order == 'largest':
+        indices.sort(key=lambda idx: costs[idx], reverse=True)
+    elif order == 'smallest':
+        indices.sort(key=lambda idx: costs[idx])
+
+    return indices
+
+
+class Progress:
+    """Tracks finished jobs, and reports throughput and the estimated time left."""
+
+    def __init__(self, costs):
+        self.total_jobs = len(costs)
+        self.total_cost = sum(costs)
+        self.done_jobs = 0
+        self.done_cost = 0
+        self.started = time.time()
+        self.last_report = self.started
+        self.lock = threading.Lock()
+
+    def complete(self, cost):
+        with self.lock:
+            self.done_jobs += 1
+            self.done_cost += cost
+
+            now = time.time()
+            if now - self.last_report >= PROGRESS_INTERVAL or self.done_jobs == self.total_jobs:
+                self.last_report = now
+                print(self.report())
+
+    def seconds_left(self):
+        """Estimates the time left from the time each unit of cost has taken so far, or returns None if nothing is done."""
+
+        if self.done_cost == 0:
+            return None
+
+        return (time.time() - self.started) / self.done_cost * (self.total_cost - self.done_cost)
+
+    def report(self):
+        elapsed = time.time() - self.started
+        seconds_left = self.seconds_left()
+
+        return 'scored {}/{} events ({:.0%} of estimated requests), {:.1f} events/min, {} left'.format(
+            self.done_jobs, self.total_jobs, self.done_cost / self.total_cost if self.total_cost > 0 else 1,
+            self.done_jobs / elapsed * 60 if elapsed > 0 else 0,
+            datetime.timedelta(seconds=round(seconds_left)) if seconds_left is not None else 'unknown time')
+
+
+def run_jobs(slugs, score, workers=1, order='largest', costs=None, memory_budget=None):
+    """Calls score on every slug object, and yields (index, result) pairs as they finish.
+
+    Jobs are started in the given order (see ORDERS), on up to workers threads. If a
+    memory budget is given in bytes, jobs only run alongside others while there's room
+    left in it.
+    """
+
+    if costs is None:
+        costs = estimate_costs(slugs)
+
+    progress = Progress(costs)
+
+    def run(idx):
+        result = score(slugs[idx])
+        progress.complete(costs[idx])
+
+        return result
+
+    if workers <= 1:
+        for idx in order_jobs(costs, order):
+            yield idx, run(idx)
+        return
+
+    queue = iter(order_jobs(costs, order))
+    running = {}
+    throttled = False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            # One job always runs, so the run finishes even when it's over budget
+            while len(running) < workers:
+                if len(running) > 0 and not within_budget(memory_budget):
+                    if not throttled:
+                        print('memory use is {}, close to the budget of {}, so no more events are started alongside running ones'.format(
+                            format_bytes(current_rss()), format_bytes(memory_budget)))
+                        throttled = True
+                    break
+
+                idx = next(queue, None)
+                if idx is None:
+                    break
+
+                running[executor.submit(run, idx)] = idx
+
+            if len(running) == 0:
+                return
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                yield running.pop(future), future.result()
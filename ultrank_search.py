@@ -1,13 +1,17 @@
 # Requires dateparser, which you can install via `pip install dateparser`.
 
-from startgg_toolkit import send_request
-import dateparser
+from startgg_toolkit import send_request, paginate, request_stats, RATE_LIMIT_PER_MINUTE
 import csv
+import hashlib
+import json
+import math
 import os
+import time
 import traceback
-from Levenshtein import jaro_winkler
 from datetime import datetime, timedelta
 from ultrank_bulk import bulk_score, write_results
+from ultrank_tiering import TournamentTieringResult
+import ultrank_metrics
 
 # defines the minimum Jaro-Winkler similarity to
 # categorize a tournament as a related iteration.
@@ -22,6 +26,23 @@ skip_weekly_check = ['Smash Mouth', 'The Big Bang Hadoken edition', 'Gengar Leag
     'Undiscovered Turbo', 'BeeSmash BIG', 'Smash Pro League']
 organizer_blacklist = ['f014e14d', '6d94b652', 'fef75a6a', 'ebbf7fac', '4472fa92', '886decc2']
 
+EVENTS_FIELDS = ['Tournament', 'Event', 'Slug', 'Used', 'Skip Reason']
+
+# files used to remember tournaments classified by previous searches
+DISCOVERY_STATE_FILE = 'discovery_state.json'
+CUMULATIVE_EVENTS_FILE = 'events_cumulative.csv'
+
+# when resuming from the last watermark, search this many days before it again
+# to pick up tournaments whose events changed after the last run.
+DISCOVERY_OVERLAP_DAYS = 7
+
+# a dry run recommends enough keys to finish a search within this many minutes
+TARGET_SEARCH_MINUTES = 60
+
+# a dry run really checks the tournaments of this many organizers for weeklies,
+# to estimate how many of the events that need a weekly check are skipped
+DRY_RUN_WEEKLY_OWNERS = 10
+
 class Tournament:
     def __init__(self, name, slug, start_at):
         self.name = name
@@ -51,6 +72,13 @@ def tournaments_query(start_time, end_time, page=1, per_page=75):
     nodes {
       slug
       name
+      startAt
+      lat
+      lng
+      owner {
+        id
+        discriminator
+      }
       events {
         name
         type
@@ -59,6 +87,7 @@ def tournaments_query(start_time, end_time, page=1, per_page=75):
         }
         slug
         numEntrants
+        startAt
       }
     }
   }
@@ -138,16 +167,17 @@ def get_admined_tournaments(tournament_slug, day_range=15):
     Puts the requested tournament as the first item in the returned array.
     """
 
-    page = 1
     tournaments = []
     tournament_name = None
     tournament_owner_id = None
     tournament_start = None
     range_start = None
 
-    while True:
-        query, variables = admin_query(tournament_slug, page)
-        resp = send_request(query, variables, quiet=True)
+    # The owner's tournaments are None if they can't be seen, which is read as an empty last page
+    for resp, owner_tournaments in paginate(lambda page, per_page: admin_query(tournament_slug, page, per_page),
+                                            lambda resp: resp['data']['tournament']['owner']['tournaments']
+                                            or {'pageInfo': {'totalPages': 1}, 'nodes': []},
+                                            default_size=75, quiet=True):
         # print(resp)
 
         # Set tournament-specific variables if not set
@@ -164,23 +194,16 @@ def get_admined_tournaments(tournament_slug, day_range=15):
             range_start = (tournament_start_datetime -
                            range_start_timedelta).timestamp()
 
-        if resp['data']['tournament']['owner']['tournaments'] is None:
-            break
-
         # Gather tournaments
-        tournaments.extend([Tournament(tournament['name'], tournament['slug'], tournament['startAt']) for tournament in resp['data']['tournament']['owner']['tournaments']['nodes'] if (
+        tournaments.extend([Tournament(tournament['name'], tournament['slug'], tournament['startAt']) for tournament in owner_tournaments['nodes'] if (
             tournament['owner']['id'] == tournament_owner_id and tournament['slug'] != tournament_slug and tournament['startAt'] >= range_start and tournament['startAt'] <= tournament_start
             and tournament['hasOfflineEvents'])])
 
         # Check if all tournaments are before the requested tournament.
         # Since the API returns tournaments in reverse chronological order, this means that we don't need to check the rest.
-        if len([tournament for tournament in resp['data']['tournament']['owner']['tournaments']['nodes'] if (tournament['owner']['id'] == resp['data']['tournament']['owner']['id'] and tournament['startAt'] < tournament_start)]) == 0:
+        if len([tournament for tournament in owner_tournaments['nodes'] if (tournament['owner']['id'] == resp['data']['tournament']['owner']['id'] and tournament['startAt'] < tournament_start)]) == 0:
             break
 
-        if page >= resp['data']['tournament']['owner']['tournaments']['pageInfo']['totalPages']:
-            break
-        page += 1
-
     tournaments.insert(0, Tournament(
         tournament_name, tournament_slug, tournament_start))
 
@@ -188,6 +211,8 @@ def get_admined_tournaments(tournament_slug, day_range=15):
 
 
 def check_potential_weekly(tournament_slug):
+    from Levenshtein import jaro_winkler
+
     other_admined_tournaments = get_admined_tournaments(tournament_slug)
 
     base_tournament = other_admined_tournaments[0]
@@ -208,236 +233,706 @@ def check_blacklist(tournament_slug):
     return resp['data']['tournament']['owner']['discriminator'] in organizer_blacklist
 
 
-def retrieve_event_slugs(start_time, end_time, directory='tts_values'):
-    page = 1
+def is_blacklisted(tournament):
+    """Checks a tournament from the search against the organizer blacklist, only querying its owner if it's unknown."""
+
+    if tournament.get('owner') is not None and tournament['owner'].get('discriminator') is not None:
+        return tournament['owner']['discriminator'] in organizer_blacklist
+
+    return check_blacklist(tournament['slug'])
+
+
+def weekly_range_start(start_at, day_range=15):
+    """Returns the earliest start of a tournament that could be the predecessor of one starting at start_at."""
+
+    return (datetime.fromtimestamp(start_at) - timedelta(days=day_range)).timestamp()
+
+
+def get_owner_history(tournament_slug, owner_id, range_start):
+    """Gathers the offline tournaments of an owner that started since range_start, newest first.
+
+    The owner is found through one of their tournaments.
+    """
+
+    tournaments = []
+
+    for _, owner_tournaments in paginate(lambda page, per_page: admin_query(tournament_slug, page, per_page),
+                                         lambda resp: resp['data']['tournament']['owner']['tournaments']
+                                         or {'pageInfo': {'totalPages': 1}, 'nodes': []},
+                                         default_size=75, quiet=True):
+        tournaments.extend([Tournament(tournament['name'], tournament['slug'], tournament['startAt'])
+                            for tournament in owner_tournaments['nodes'] if (
+                                tournament['owner']['id'] == owner_id and tournament['startAt'] >= range_start
+                                and tournament['hasOfflineEvents'])])
+
+        # Tournaments are returned newest first, so the rest are all too old
+        if len(owner_tournaments['nodes']) > 0 and owner_tournaments['nodes'][-1]['startAt'] < range_start:
+            break
+
+    return tournaments
+
+
+def name_similarities(names, other_names):
+    """Compares every name to every other name with the same Jaro-Winkler similarity as check_potential_weekly.
+
+    Returns one row per name, with 0 wherever the similarity is below MINIMUM_JARO_SIMILARITY.
+    rapidfuzz's cdist needs numpy, so without it the rows are compared one at a time.
+    """
+
+    from rapidfuzz import process
+    from rapidfuzz.distance import JaroWinkler
+
+    if len(names) == 0 or len(other_names) == 0:
+        return [[0] * len(other_names) for _ in names]
+
+    try:
+        return process.cdist(names, other_names, scorer=JaroWinkler.similarity,
+                             score_cutoff=MINIMUM_JARO_SIMILARITY).tolist()
+    except ImportError:
+        rows = []
+
+        for name in names:
+            row = [0] * len(other_names)
+
+            for _, similarity, idx in process.extract(name, other_names, scorer=JaroWinkler.similarity,
+                                                      score_cutoff=MINIMUM_JARO_SIMILARITY, limit=None):
+                row[idx] = similarity
+
+            rows.append(row)
+
+        return rows
+
+
+class WeeklyClassifier:
+    """Finds the probable predecessors of the tournaments in a search window, one owner at a time.
+
+    The first time a tournament is checked, its owner's tournaments are fetched once for the
+    whole window, and every one of the owner's tournaments in the window is compared to them
+    at once. The results are the same as check_potential_weekly's.
+    """
+
+    def __init__(self, tournaments, day_range=15):
+        self.day_range = day_range
+        self.owner_tournaments = {}
+        self.predecessors = {}
+
+        for tournament in tournaments:
+            if tournament.get('owner') is not None and tournament.get('startAt') is not None:
+                self.owner_tournaments.setdefault(tournament['owner']['id'], []).append(tournament)
+
+    def check_potential_weekly(self, tournament):
+        """Returns the tournament's probable predecessor, or None if it doesn't seem to have one."""
+
+        if tournament.get('owner') is None or tournament.get('startAt') is None:
+            return check_potential_weekly(tournament['slug'])
+
+        if tournament['slug'] not in self.predecessors:
+            self.classify_owner(tournament['owner']['id'])
+
+        return self.predecessors[tournament['slug']]
+
+    def classify_owner(self, owner_id):
+        tournaments = self.owner_tournaments[owner_id]
+        range_starts = [weekly_range_start(tournament['startAt'], self.day_range) for tournament in tournaments]
+
+        history = get_owner_history(tournaments[0]['slug'], owner_id, min(range_starts))
+        similarities = name_similarities([tournament['name'] for tournament in tournaments],
+                                         [previous.name for previous in history])
+
+        for tournament, range_start, row in zip(tournaments, range_starts, similarities):
+            self.predecessors[tournament['slug']] = None
+
+            # The newest similar tournament in range is the predecessor, like in check_potential_weekly
+            for previous, similarity in zip(history, row):
+                if (similarity != 0 and previous.slug != tournament['slug']
+                        and range_start <= previous.start_at <= tournament['startAt']):
+                    predecessor = Tournament(previous.name, previous.slug, previous.start_at)
+                    predecessor.time_since = tournament['startAt'] - previous.start_at
+                    predecessor.similarity = similarity
+
+                    self.predecessors[tournament['slug']] = predecessor
+                    break
+
+
+def tournament_fingerprint(tournament):
+    """Hashes the parts of a tournament that classification depends on."""
+
+    events = sorted([event['slug'], event['name'], event['type'], event['videogame']['id'] if event['videogame'] else None,
+                     event['numEntrants']] for event in tournament['events'])
+
+    return hashlib.sha1(json.dumps([tournament['name'], events]).encode('utf-8')).hexdigest()
+
+
+def load_discovery_state(directory='tts_values'):
+    """Loads the tournaments classified by previous searches."""
+
+    try:
+        with open(os.path.join(directory, DISCOVERY_STATE_FILE), encoding='utf-8') as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {'watermark': None, 'tournaments': {}}
+
+
+def save_discovery_state(state, directory='tts_values'):
+    path = os.path.join(directory, DISCOVERY_STATE_FILE)
+
+    # Write to a temporary file first so an interrupted run can't corrupt the state
+    with open(path + '.tmp', mode='w', encoding='utf-8') as state_file:
+        json.dump(state, state_file)
+
+    os.replace(path + '.tmp', path)
+
+
+def mark_events_scored(slugs, directory='tts_values'):
+    """Records events as scored, so later incremental searches don't return them again.
+
+    Until then, events found by an incremental search are returned again by the next one,
+    in case the run that found them was interrupted before scoring them.
+    """
+
+    slugs = set(slugs)
+    state = load_discovery_state(directory)
+
+    for tournament in state['tournaments'].values():
+        if 'unscored' in tournament:
+            tournament['unscored'] = [slug for slug in tournament['unscored'] if slug not in slugs]
+
+    save_discovery_state(state, directory)
+
+
+def write_cumulative_events(state, directory='tts_values'):
+    """Writes every event classified so far, across all searches, to one table."""
+
+    with open(os.path.join(directory, CUMULATIVE_EVENTS_FILE), newline='', mode='w') as events_file:
+        writer = csv.DictWriter(events_file, EVENTS_FIELDS)
+        writer.writeheader()
+
+        for tournament in state['tournaments'].values():
+            writer.writerows(tournament['rows'])
+
+
+class CountingWeeklyClassifier(WeeklyClassifier):
+    """Stands in for WeeklyClassifier in a dry run, counting the weekly checks instead of doing them.
+
+    Every tournament is treated as not being a weekly, so its events are counted as
+    events to score.
+    """
+
+    def __init__(self, tournaments, day_range=15):
+        super().__init__(tournaments, day_range)
+        self.owners_checked = set()
+        self.unowned_checks = 0
+        self.tournaments_checked = set()
+
+    def check_potential_weekly(self, tournament):
+        self.tournaments_checked.add(tournament['slug'])
+
+        if tournament.get('owner') is None or tournament.get('startAt') is None:
+            self.unowned_checks += 1
+        else:
+            self.owners_checked.add(tournament['owner']['id'])
+
+        return None
+
+
+def classify_tournament(tournament, weekly_classifier=None):
+    """Decides which events of a tournament should be scored.
+
+    Returns the rows to write to events.csv and the list of event slugs to use. If a
+    WeeklyClassifier is given, it's used to check whether the tournament is a weekly.
+    """
+
+    rows = []
     slugs = []
 
+    events = [event for event in tournament['events'] if (
+        event['type'] == 1 and event['videogame']['id'] == 1386 and event['numEntrants'] != None)]
+
+    events.sort(
+        reverse=True, key=lambda event: event['numEntrants'])
+
+    added_event = False
+
+    potential_weekly = "not checked"
+    
+    for skip in skip_weekly_check:
+        if skip.lower() in tournament['name'].lower():
+            potential_weekly = "skip"
+
+    ladder_potential = None
+
+    blacklisted = None
+
+    for event in events:
+        if blacklisted is None:
+            blacklisted = is_blacklisted(tournament)
+
+        if blacklisted:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Tournament Creator Blacklisted'})
+            continue
+
+        if tournament['name'].lower().find('weekly') != -1 or event['name'].lower().find('weekly') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Weekly (contains string "weekly")'})
+            continue
+
+        if tournament['name'].lower().find('weeklies') != -1 or event['name'].lower().find('weeklies') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Weekly (contains string "weeklies")'})
+            continue
+
+        if tournament['name'].lower().find('arcadian') != -1 or event['name'].lower().find('arcadian') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Arcadian (contains string "arcadian")'})
+            continue
+
+        if event['name'].lower().find('ladder') != -1:
+            ladder_potential = event
+            continue
+
+        if event['name'].lower().find('redemption') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "redemption")'})
+            continue
+
+        if event['name'].lower().find('resurrection') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "resurrection")'})
+            continue
+
+        if event['name'].lower().find('buster') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "buster")'})
+            continue
+
+        if event['name'].lower().find('amateur') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "amateur")'})
+            continue
+
+        if event['name'].lower().find('squad') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "squad")'})
+            continue
+
+        if event['name'].lower().find('random') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "random")'})
+            continue
+
+        if event['name'].lower().find('cpu') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "cpu")'})
+            continue
+
+        if event['name'].lower().find('amiibo') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "amiibo")'})
+            continue
+
+        if event['name'].lower().find('hdr') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "hdr")'})
+            continue
+
+        if event['name'].lower().find('wait') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Waitlist (contains string "wait")'})
+            continue
+
+        if added_event:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Other Larger Event in Tournament'})
+            continue
+
+        if tournament['name'].lower().find('monthly') != -1 or event['name'].lower().find('monthly') != -1:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'True'})
+
+            slugs.append(event['slug'])
+            added_event = True
+            continue
+
+        if potential_weekly == "not checked":
+            if weekly_classifier is not None:
+                potential_weekly = weekly_classifier.check_potential_weekly(tournament)
+            else:
+                potential_weekly = check_potential_weekly(tournament['slug'])
+
+        if isinstance(potential_weekly, Tournament):
+            days_since = str(
+                round(potential_weekly.time_since / (24 * 60 * 60)))
+
+            rows.append({'Tournament': tournament['name'],
+                         'Event': event['name'],
+                         'Slug': event['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Weekly [{:.5f}] (found tournament {} [{}] which precedes by {} days)'.format(potential_weekly.similarity, potential_weekly.name, potential_weekly.slug, days_since)})
+            added_event = True
+
+            continue
+
+        rows.append({'Tournament': tournament['name'],
+                     'Event': event['name'],
+                     'Slug': event['slug'],
+                     'Used': 'True'})
+
+        slugs.append(event['slug'])
+        added_event = True
+
+    if ladder_potential:
+        if added_event:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': ladder_potential['name'],
+                         'Slug': ladder_potential['slug'],
+                         'Used': 'False',
+                         'Skip Reason': 'Probable Side Event (contains string "ladder")'})
+        else:
+            rows.append({'Tournament': tournament['name'],
+                         'Event': ladder_potential['name'],
+                         'Slug': ladder_potential['slug'],
+                         'Used': 'True'})
+
+            slugs.append(ladder_potential['slug'])
+            added_event = True
+
+    return rows, slugs
+
+
+def event_descriptor(tournament, event):
+    """Collects what the search already knows about an event, so scoring doesn't fetch it again."""
+
+    return {'slug': event['slug'],
+            'tournament': tournament['name'],
+            'event': event['name'],
+            'start_at': event.get('startAt'),
+            'lat': tournament.get('lat'),
+            'lng': tournament.get('lng'),
+            'num_entrants': event['numEntrants']}
+
+
+def retrieve_event_slugs(start_time, end_time, directory='tts_values', incremental=False):
+    """Searches for tournaments between the two timestamps and returns the event slugs to score."""
+
+    return [event['slug'] for event in retrieve_events(start_time, end_time, directory, incremental)]
+
+
+def retrieve_events(start_time, end_time, directory='tts_values', incremental=False):
+    """Searches for tournaments between the two timestamps and returns the events to score.
+
+    Each event is described by event_descriptor. If incremental is set, tournaments that
+    were already classified in a previous run (and haven't changed since) are not
+    reclassified, and only the events of new or changed tournaments are returned, along
+    with events of earlier runs that weren't scored. Call mark_events_scored once the
+    returned events are scored.
+    """
+
+    events = []
+
     if not os.path.isdir(directory):
         os.mkdir(directory)
 
+    state = load_discovery_state(directory) if incremental else None
+
+    reused = 0
+    unscored = 0
+
     with open(os.path.join(directory, 'events.csv'), newline='', mode='w') as events_file:
         writer = csv.DictWriter(
-            events_file, ['Tournament', 'Event', 'Slug', 'Used', 'Skip Reason'])
+            events_file, EVENTS_FIELDS)
         writer.writeheader()
-        # iter_ = 0
-        while True:
-            # iter_ += 1
-            query, variables = tournaments_query(
-                start_time, end_time, page=page)
-            resp = send_request(query, variables, quiet=True)
-
-            print('checking {} tournaments'.format(len(resp['data']['tournaments']['nodes'])))
-
-            for tournament in resp['data']['tournaments']['nodes']:
-                try:
-                    events = [event for event in tournament['events'] if (
-                        event['type'] == 1 and event['videogame']['id'] == 1386 and event['numEntrants'] != None)]
-
-                    events.sort(
-                        reverse=True, key=lambda event: event['numEntrants'])
-
-                    added_event = False
-
-                    potential_weekly = "not checked"
-                    
-                    for skip in skip_weekly_check:
-                        if skip.lower() in tournament['name'].lower():
-                            potential_weekly = "skip"
-
-                    ladder_potential = None
-
-                    for event in events:
-                        # if iter_ == 7:
-                        #     print(event['slug'])
-                        if check_blacklist(tournament['slug']):
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Tournament Creator Blacklisted'})
-                            continue
-
-                        if tournament['name'].lower().find('weekly') != -1 or event['name'].lower().find('weekly') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Weekly (contains string "weekly")'})
-                            continue
-
-                        if tournament['name'].lower().find('weeklies') != -1 or event['name'].lower().find('weeklies') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Weekly (contains string "weeklies")'})
-                            continue
-
-                        if tournament['name'].lower().find('arcadian') != -1 or event['name'].lower().find('arcadian') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Arcadian (contains string "arcadian")'})
-                            continue
-
-                        if event['name'].lower().find('ladder') != -1:
-                            ladder_potential = event
-                            continue
-
-                        if event['name'].lower().find('redemption') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "redemption")'})
-                            continue
-
-                        if event['name'].lower().find('resurrection') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "resurrection")'})
-                            continue
-
-                        if event['name'].lower().find('buster') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "buster")'})
-                            continue
-
-                        if event['name'].lower().find('amateur') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "amateur")'})
-                            continue
-
-                        if event['name'].lower().find('squad') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "squad")'})
-                            continue
-
-                        if event['name'].lower().find('random') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "random")'})
-                            continue
-
-                        if event['name'].lower().find('cpu') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "cpu")'})
-                            continue
-
-                        if event['name'].lower().find('amiibo') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "amiibo")'})
-                            continue
-
-                        if event['name'].lower().find('hdr') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "hdr")'})
-                            continue
-
-                        if event['name'].lower().find('wait') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Waitlist (contains string "wait")'})
-                            continue
-
-                        if added_event:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Other Larger Event in Tournament'})
-                            continue
-
-                        if tournament['name'].lower().find('monthly') != -1 or event['name'].lower().find('monthly') != -1:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'True'})
-
-                            slugs.append(event['slug'])
-                            added_event = True
-                            continue
-
-                        if potential_weekly == "not checked":
-                            potential_weekly = check_potential_weekly(tournament['slug'])
-
-                        if isinstance(potential_weekly, Tournament):
-                            days_since = str(
-                                round(potential_weekly.time_since / (24 * 60 * 60)))
-
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': event['name'],
-                                             'Slug': event['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Weekly [{:.5f}] (found tournament {} [{}] which precedes by {} days)'.format(potential_weekly.similarity, potential_weekly.name, potential_weekly.slug, days_since)})
-                            added_event = True
-
-                            continue
-
-                        writer.writerow({'Tournament': tournament['name'],
-                                         'Event': event['name'],
-                                         'Slug': event['slug'],
-                                         'Used': 'True'})
-
-                        slugs.append(event['slug'])
-                        added_event = True
-
-                    if ladder_potential:
-                        if added_event:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': ladder_potential['name'],
-                                             'Slug': ladder_potential['slug'],
-                                             'Used': 'False',
-                                             'Skip Reason': 'Probable Side Event (contains string "ladder")'})
-                        else:
-                            writer.writerow({'Tournament': tournament['name'],
-                                             'Event': ladder_potential['name'],
-                                             'Slug': ladder_potential['slug'],
-                                             'Used': 'True'})
-
-                            slugs.append(ladder_potential['slug'])
-                            added_event = True
-                except Exception as e:
-                    print(e)
-                    print(tournament['slug'])
-                    traceback.print_exc()
-
-            if page >= resp['data']['tournaments']['pageInfo']['totalPages']:
-                break
-            page += 1
-
-    return slugs
+
+        # The whole window is read first, so weeklies can be found one owner at a time
+        window = []
+
+        for _, connection in paginate(lambda page, per_page: tournaments_query(start_time, end_time, page, per_page),
+                                      lambda resp: resp['data']['tournaments'], default_size=75, quiet=True):
+            window.extend(connection['nodes'])
+
+        print('checking {} tournaments'.format(len(window)))
+
+        weekly_classifier = WeeklyClassifier(window)
+
+        for tournament in window:
+            try:
+                fingerprint = tournament_fingerprint(tournament)
+                previous = state['tournaments'].get(tournament['slug']) if state is not None else None
+
+                if previous is not None and previous['fingerprint'] == fingerprint:
+                    writer.writerows(previous['rows'])
+                    reused += 1
+                    ultrank_metrics.tournaments_checked.inc('reused')
+
+                    # Events found by an earlier run that didn't finish scoring them
+                    tournament_events = {event['slug']: event for event in tournament['events']}
+                    for slug in previous.get('unscored', []):
+                        events.append(event_descriptor(tournament, tournament_events[slug]))
+                        unscored += 1
+                    continue
+
+                rows, tournament_slugs = classify_tournament(tournament, weekly_classifier)
+
+                writer.writerows(rows)
+
+                ultrank_metrics.tournaments_checked.inc('classified')
+                ultrank_metrics.events_discovered.inc(amount=len(tournament_slugs))
+                for row in rows:
+                    if row['Used'] == 'False':
+                        ultrank_metrics.events_skipped.inc(ultrank_metrics.skip_reason_label(row['Skip Reason']))
+
+                tournament_events = {event['slug']: event for event in tournament['events']}
+                events.extend(event_descriptor(tournament, tournament_events[slug]) for slug in tournament_slugs)
+
+                if state is not None:
+                    state['tournaments'][tournament['slug']] = {'name': tournament['name'],
+                                                                'fingerprint': fingerprint,
+                                                                'rows': rows,
+                                                                'slugs': tournament_slugs,
+                                                                'unscored': list(tournament_slugs)}
+            except Exception as e:
+                print(e)
+                print(tournament['slug'])
+                traceback.print_exc()
+
+    if state is not None:
+        print('reused {} previously classified tournaments'.format(reused))
+        if unscored > 0:
+            print('scoring {} events that earlier searches found but didn\'t score'.format(unscored))
+
+        state['watermark'] = max(end_time, state.get('watermark') or end_time)
+        save_discovery_state(state, directory)
+        write_cumulative_events(state, directory)
+
+    return events
+
+
+def estimate_search(start_time, end_time, directory='tts_values', incremental=False):
+    """Estimates the requests and time a search would take, from its first page of tournaments.
+
+    Nothing is written. Only the first page of tournaments is fetched, and the tournaments
+    of up to DRY_RUN_WEEKLY_OWNERS organizers are checked for weeklies. Everything else is
+    counted rather than requested, and scaled up to the whole search.
+    """
+
+    from ultrank_schedule import estimate_costs
+    from ultrank_tiering import address_cache, address_cache_lock, NOMINATIM_INTERVAL
+
+    requests_before = request_stats['requests']
+    started = time.time()
+
+    pages = paginate(lambda page, per_page: tournaments_query(start_time, end_time, page, per_page),
+                     lambda resp: resp['data']['tournaments'], default_size=75, quiet=True)
+    _, connection = next(pages)
+    pages.close()
+
+    sample = connection['nodes']
+    total_pages = connection['pageInfo']['totalPages']
+    num_tournaments = len(sample) * total_pages if total_pages > 1 else len(sample)
+    scale = num_tournaments / len(sample) if len(sample) > 0 else 0
+
+    state = load_discovery_state(directory) if incremental else None
+
+    counting_classifier = CountingWeeklyClassifier(sample)
+    reused = 0
+    # (tournament, slugs of the events that would be scored if it isn't a weekly)
+    classified = []
+
+    for tournament in sample:
+        previous = state['tournaments'].get(tournament['slug']) if state is not None else None
+
+        if previous is not None and previous['fingerprint'] == tournament_fingerprint(tournament):
+            reused += 1
+            continue
+
+        _, tournament_slugs = classify_tournament(tournament, counting_classifier)
+        classified.append((tournament, tournament_slugs))
+
+    # Check the tournaments of a few organizers, spread across the sample, to see how many events weeklies rule out
+    owners = sorted(counting_classifier.owners_checked)
+    owners = set(owners[::max(1, len(owners) // DRY_RUN_WEEKLY_OWNERS)][:DRY_RUN_WEEKLY_OWNERS])
+
+    owner_tournaments = [(tournament, tournament_slugs) for tournament, tournament_slugs in classified
+                         if tournament['slug'] in counting_classifier.tournaments_checked
+                         and tournament.get('owner') is not None and tournament['owner']['id'] in owners]
+    weekly_classifier = WeeklyClassifier([tournament for tournament, _ in owner_tournaments])
+
+    checked_events = 0
+    kept_events = 0
+    for tournament, tournament_slugs in owner_tournaments:
+        checked_events += len(tournament_slugs)
+        kept_events += len(classify_tournament(tournament, weekly_classifier)[1])
+
+    kept_share = kept_events / checked_events if checked_events > 0 else 1
+
+    events = []
+    weighted_events = 0
+    for tournament, tournament_slugs in classified:
+        # Events of tournaments that needed a weekly check are only scored as often as the checked ones were
+        weight = kept_share if tournament['slug'] in counting_classifier.tournaments_checked else 1
+
+        tournament_events = {event['slug']: event for event in tournament['events']}
+        for slug in tournament_slugs:
+            events.append((event_descriptor(tournament, tournament_events[slug]), weight))
+            weighted_events += weight
+
+    costs = estimate_costs([{'slug': event['slug'], 'invit': False, 'metadata': event} for event, _ in events])
+    scoring = sum(cost * weight for cost, (_, weight) in zip(costs, events))
+
+    with address_cache_lock:
+        venues = set((event['lat'], event['lng']) for event, _ in events if event['lat'] is not None) - address_cache.keys()
+
+    # Owner histories usually fit in a page, and tournaments without an owner also need their owner looked up
+    requests = {'discovery': total_pages,
+                'weekly checks': round((len(counting_classifier.owners_checked)
+                                        + 2 * counting_classifier.unowned_checks) * scale),
+                'scoring': round(scoring * scale)}
+
+    sample_requests = request_stats['requests'] - requests_before
+
+    return {'tournaments': num_tournaments,
+            'pages': total_pages,
+            'sampled': len(sample),
+            'reused': round(reused * scale),
+            'events': round(weighted_events * scale),
+            'kept_share': kept_share,
+            'requests': requests,
+            'total_requests': sum(requests.values()),
+            'sample_requests': sample_requests,
+            'latency': (time.time() - started) / sample_requests if sample_requests > 0 else 0,
+            'venues': round(len(venues) * scale),
+            'geocoding_minutes': len(venues) * scale * NOMINATIM_INTERVAL / 60}
+
+
+def print_estimate(estimate, workers=None):
+    from ultrank_bulk import SCORE_WORKERS
+
+    if workers is None:
+        workers = SCORE_WORKERS
+
+    minutes = estimate['total_requests'] / RATE_LIMIT_PER_MINUTE
+
+    print('about {} tournaments in {} pages (sampled {})'.format(estimate['tournaments'], estimate['pages'], estimate['sampled']))
+    if estimate['reused'] > 0:
+        print('about {} tournaments were already classified by previous searches and will be skipped'.format(estimate['reused']))
+    print('about {} events to score ({:.0%} of the events of possible weeklies are kept)'.format(
+        estimate['events'], estimate['kept_share']))
+    print()
+
+    print('estimated requests:')
+    for name, count in estimate['requests'].items():
+        print('  {:<14} {:>8}'.format(name, count))
+    print('  {:<14} {:>8}'.format('total', estimate['total_requests']))
+    print('(the dry run itself took {} requests)'.format(estimate['sample_requests']))
+    print()
+
+    print('about {:.0f} minutes with one key at {} requests/minute'.format(minutes, RATE_LIMIT_PER_MINUTE))
+    if estimate['venues'] > 0:
+        print('about {} venues to look up, taking {:.0f} minutes in the background'.format(
+            estimate['venues'], estimate['geocoding_minutes']))
+    print()
+
+    # Workers needed to keep a key at its rate limit, given how long a request takes
+    needed_workers = max(1, math.ceil(RATE_LIMIT_PER_MINUTE / 60 * estimate['latency']))
+    if needed_workers > workers:
+        print('requests take {:.1f}s, so raise SCORE_WORKERS in ultrank_bulk.py to {} to reach the rate limit'.format(
+            estimate['latency'], needed_workers))
+    else:
+        print('{} workers are enough to reach the rate limit'.format(workers))
+
+    keys = math.ceil(max(minutes, estimate['geocoding_minutes']) / TARGET_SEARCH_MINUTES)
+    if math.ceil(minutes / TARGET_SEARCH_MINUTES) > 1:
+        print('give a file of {} start.gg keys to score in parallel and finish in about {} minutes'.format(
+            math.ceil(minutes / TARGET_SEARCH_MINUTES), TARGET_SEARCH_MINUTES))
+    elif keys > 1:
+        print('looking up venues will take longer than the requests, whatever the number of keys')
+    else:
+        print('one start.gg key is enough')
 
 
 if __name__ == '__main__':
-    start_time_str = input('input starting time for search: ')
-    start_time = dateparser.parse(start_time_str)
-    start_timestamp = int(start_time.timestamp())
+    import argparse
+    import dateparser
+    import sys
+
+    parser = argparse.ArgumentParser(description='Search start.gg for tournaments and score them.')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile each event, and summarize where the time went (see ultrank_profile.py)')
+    parser.add_argument('--memory', action='store_true',
+                        help='measure the memory used by each stage of the run (see ultrank_memory.py)')
+    parser.add_argument('--lean', action='store_true',
+                        help='drop each event\'s fetched data once it\'s scored, and keep its result as text')
+    parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+                        help='start fewer events at once when memory use gets close to this many megabytes')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='only estimate how many requests and how long the search would take')
+    parser.add_argument('--snapshots', action='store_true',
+                        help='add each event\'s fetched data to event_snapshots.jsonl for ultrank_simulate.py')
+    ultrank_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    incremental = input('only process tournaments that are new or changed since the last search? (y/n) ')
+    incremental = incremental.lower() == 'y' or incremental.lower() == 'yes'
+
+    watermark = load_discovery_state()['watermark'] if incremental else None
+
+    if watermark is not None:
+        start_time_str = input('input starting time for search (leave blank to resume from the last search): ')
+    else:
+        start_time_str = input('input starting time for search: ')
+
+    if start_time_str.strip() == '' and watermark is not None:
+        start_timestamp = int(watermark - DISCOVERY_OVERLAP_DAYS * 24 * 60 * 60)
+    else:
+        start_time = dateparser.parse(start_time_str)
+        start_timestamp = int(start_time.timestamp())
 
     end_time_str = input('input ending time for search: ')
     end_time = dateparser.parse(end_time_str)
@@ -446,8 +941,38 @@ if __name__ == '__main__':
     print('using start timestamp {} and end timestamp {}'.format(
         str(start_timestamp), str(end_timestamp)))
 
-    slugs = retrieve_event_slugs(start_timestamp, end_timestamp)
+    if args.dry_run:
+        print_estimate(estimate_search(start_timestamp, end_timestamp, incremental=incremental))
+        sys.exit()
+
+    ultrank_metrics.export_from_arguments(args)
+
+    staged = input('only check DQs for events whose result depends on them? (y/n) ')
+    full_detail = not (staged.lower() == 'y' or staged.lower() == 'yes')
+
+    key_pool = input('input file with one start.gg API key per line to score in parallel (leave blank to use smashgg.key): ')
+
+    events = retrieve_events(start_timestamp, end_timestamp, incremental=incremental)
+
+    print('discovered {} tournaments'.format(len(events)))
+    slugs = [{'slug': event['slug'], 'invit': False, 'metadata': event} for event in events]
+
+    if key_pool.strip() != '':
+        from ultrank_shard import sharded_bulk_score, read_key_pool
+
+        if args.profile:
+            print('profiling is only done without parallel keys')
+
+        # An incremental search only scores new events, so the results of earlier ones are kept
+        result_dicts = sharded_bulk_score(slugs, read_key_pool(key_pool), full_detail=full_detail, snapshots=args.snapshots,
+                                          merge=incremental)
+        scored_slugs = [result['slug'] for result in result_dicts]
+    else:
+        results = bulk_score(slugs, full_detail=full_detail, profile=args.profile, lean=args.lean, memory=args.memory,
+                             memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget is not None else None,
+                             snapshots=args.snapshots)
+        write_results(results, merge=incremental)
+        scored_slugs = [result.slug for result in results if isinstance(result, TournamentTieringResult)]
 
-    print('discovered {} tournaments'.format(len(slugs)))
-    results = bulk_score([{'slug': slug, 'invit': False} for slug in slugs])
-    write_results(results)
\ No newline at end of file
+    if incremental:
+        mark_events_scored(scored_slugs)
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""Aggregates scored events into per-player season standings.
+
+Results (as written to results.jsonl by ultrank_bulk) are stored in a SQLite
+index of events and the players that attended them. Adding an event only
+recomputes the standings of the players that attended it, so new events can be
+added as they're scored.
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+
+SEASON_FILE = 'season.sqlite'
+
+# number of a player's best counted events that make up their season score
+TOP_EVENTS = 10
+
+STANDINGS_FIELDS = ['Rank', 'Player ID', 'Tag', 'Counted Events', 'Top Events Score', 'Best Event']
+
+
+class SeasonIndex:
+    """SQLite index of scored events and the players that attended them."""
+
+    def __init__(self, path=SEASON_FILE, top_events=TOP_EVENTS):
+        self.path = path
+        self.top_events = top_events
+        self.connection = sqlite3.connect(path)
+
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                slug TEXT PRIMARY KEY,
+                tournament TEXT,
+                event TEXT,
+                date TEXT,
+                score INTEGER NOT NULL,
+                max_potential_score INTEGER,
+                entrants INTEGER,
+                should_count INTEGER NOT NULL,
+                region TEXT
+            );
+            CREATE TABLE IF NOT EXISTS attendance (
+                player_id TEXT NOT NULL,
+                slug TEXT NOT NULL,
+                tag TEXT,
+                PRIMARY KEY (player_id, slug)
+            );
+            CREATE INDEX IF NOT EXISTS attendance_slug ON attendance (slug);
+            CREATE TABLE IF NOT EXISTS standings (
+                player_id TEXT PRIMARY KEY,
+                tag TEXT,
+                counted_events INTEGER NOT NULL,
+                top_score INTEGER NOT NULL,
+                best_event TEXT
+            );
+            CREATE INDEX IF NOT EXISTS standings_score ON standings (top_score);
+        ''')
+
+    def add_result(self, result):
+        """Adds or replaces an event from its structured result (TournamentTieringResult.to_dict)."""
+
+        slug = result['slug']
+
+        with self.connection:
+            # Players that attended an older version of this event need their standings updated too
+            affected = set(row[0] for row in self.connection.execute(
+                'SELECT player_id FROM attendance WHERE slug = ?', (slug,)))
+
+            self.connection.execute('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (slug, result['tournament'], result['event'], result['date'], result['score'],
+                                     result['max_potential_score'], result['entrants'], int(result['should_count']),
+                                     result['region']['description']))
+
+            self.connection.execute('DELETE FROM attendance WHERE slug = ?', (slug,))
+
+            # Player IDs are stored as text, since some players are identified by tag only
+            attendees = {str(id_): tag for id_, tag in result.get('attendees', [])}
+            self.connection.executemany('INSERT INTO attendance VALUES (?, ?, ?)',
+                                        [(id_, slug, tag) for id_, tag in attendees.items()])
+
+            affected.update(attendees)
+            self.update_standings(affected)
+
+        return len(affected)
+
+    def update_standings(self, player_ids):
+        for player_id in player_ids:
+            events = self.events_for_player(player_id)
+
+            if len(events) == 0:
+                self.connection.execute('DELETE FROM standings WHERE player_id = ?', (player_id,))
+                continue
+
+            tag = self.connection.execute(
+                'SELECT attendance.tag FROM attendance JOIN events ON attendance.slug = events.slug '
+                'WHERE player_id = ? ORDER BY events.date DESC LIMIT 1', (player_id,)).fetchone()[0]
+
+            top = events[:self.top_events]
+
+            self.connection.execute('INSERT OR REPLACE INTO standings VALUES (?, ?, ?, ?, ?)',
+                                    (player_id, tag, len(events), sum(event['score'] for event in top), top[0]['slug']))
+
+    def events_for_player(self, player_id, counted_only=True):
+        """Returns the events a player attended, highest score first."""
+
+        query = ('SELECT events.slug, tournament, event, date, score, should_count FROM attendance '
+                 'JOIN events ON attendance.slug = events.slug WHERE player_id = ?')
+        if counted_only:
+            query += ' AND should_count = 1'
+        query += ' ORDER BY score DESC, date'
+
+        return [{'slug': slug, 'tournament': tournament, 'event': event, 'date': date, 'score': score,
+                 'should_count': bool(should_count)}
+                for slug, tournament, event, date, score, should_count
+                in self.connection.execute(query, (str(player_id),))]
+
+    def leaderboard(self, limit=None):
+        """Returns the season standings, best first."""
+
+        query = ('SELECT player_id, tag, counted_events, top_score, best_event FROM standings '
+                 'ORDER BY top_score DESC, counted_events DESC, tag')
+        if limit is not None:
+            query += ' LIMIT {}'.format(int(limit))
+
+        return [{'player_id': player_id, 'tag': tag, 'counted_events': counted_events, 'top_score': top_score,
+                 'best_event': best_event}
+                for player_id, tag, counted_events, top_score, best_event in self.connection.execute(query)]
+
+    def import_results(self, path):
+        """Adds every result in a results.jsonl file. Returns the number of events added.
+
+        Results whose DQs weren't checked are skipped, since their scores are only upper bounds.
+        """
+
+        count = 0
+        skipped = 0
+
+        with open(path, encoding='utf-8') as results_file:
+            for line in results_file:
+                if line.strip() == '':
+                    continue
+
+                result = json.loads(line)
+
+                if result.get('pruned') is not None:
+                    skipped += 1
+                    continue
+
+                self.add_result(result)
+                count += 1
+
+        if skipped > 0:
+            print('skipped {} events whose DQs weren\'t checked; score them with DQs checked to add them'.format(skipped))
+
+        return count
+
+    def write_standings(self, path):
+        with open(path, newline='', mode='w', encoding='utf-8') as standings_file:
+            writer = csv.DictWriter(standings_file, STANDINGS_FIELDS)
+            writer.writeheader()
+
+            for rank, standing in enumerate(self.leaderboard(), start=1):
+                writer.writerow({'Rank': rank,
+                                 'Player ID': standing['player_id'],
+                                 'Tag': standing['tag'],
+                                 'Counted Events': standing['counted_events'],
+                                 'Top Events Score': standing['top_score'],
+                                 'Best Event': standing['best_event']})
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == '__main__':
+    file = input('input results file to add to the season (leave blank for tts_values/results.jsonl): ')
+    if file.strip() == '':
+        file = os.path.join('tts_values', 'results.jsonl')
+
+    if not os.path.exists(file):
+        print('file doesn\'t exist!')
+        sys.exit()
+
+    season_file = input('input season index file (leave blank for {}): '.format(SEASON_FILE))
+    if season_file.strip() == '':
+        season_file = SEASON_FILE
+
+    season = SeasonIndex(season_file)
+
+    print('added {} events'.format(season.import_results(file)))
+
+    season.write_standings(os.path.join(os.path.dirname(file), 'standings.csv'))
+
+    for rank, standing in enumerate(season.leaderboard(10), start=1):
+        print('{}. {} - {} ({} counted events)'.format(rank, standing['tag'], standing['top_score'],
+                                                      standing['counted_events']))
+
+    season.close()
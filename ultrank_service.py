@@ -0,0 +1,199 @@
+"""Runs a local HTTP server that scores events on request.
+
+The ranking CSVs, the geocoding cache and the connection to start.gg stay
+loaded between requests, so scoring an event only costs the start.gg queries
+it needs.
+
+Endpoints (all POST bodies and responses are JSON):
+ GET  /status  - sizes of the loaded ranking data and caches
+ GET  /metrics - request, geocoding and scoring metrics in the OpenMetrics format (see ultrank_metrics.py)
+ POST /score   - {"slug": ..., "invit": false}
+ POST /batch   - {"events": [{"slug": ..., "invit": false}, ...]}
+ POST /search  - {"start": ..., "end": ...}, as timestamps or dates dateparser understands
+ POST /reload  - rereads the ranking CSVs
+"""
+
+from ultrank_tiering import Tournament, address_cache, current_rankings, reload_rankings, prefetch_locations
+from startgg_toolkit import startgg_slug_regex, isolate_slug, InvalidEventUrlException, request_stats
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import datetime
+import json
+import threading
+import time
+import traceback
+import ultrank_metrics
+
+DEFAULT_PORT = 8765
+
+# number of events scored at once for batch and search requests
+SERVICE_WORKERS = 4
+
+# only one search may run at a time, since it writes to tts_values/events.csv
+search_lock = threading.Lock()
+
+loaded_at = datetime.datetime.now()
+
+
+def score_event(slug, invit=False, full_detail=True, metadata=None):
+    """Scores a single event, returning its structured result or the error that occurred."""
+
+    try:
+        slug = isolate_slug(slug)
+    except InvalidEventUrlException:
+        ultrank_metrics.record_event('invalid', 0)
+        return {'slug': slug, 'error': 'invalid event slug'}
+
+    if not startgg_slug_regex.fullmatch(slug):
+        ultrank_metrics.record_event('invalid', 0)
+        return {'slug': slug, 'error': 'invalid event slug'}
+
+    started = time.time()
+    ultrank_metrics.events_in_progress.inc()
+
+    try:
+        result = Tournament(slug, invit, full_detail=full_detail, metadata=metadata).calculate_tier()
+    except Exception as e:
+        traceback.print_exc()
+        ultrank_metrics.record_event('failed', time.time() - started)
+        return {'slug': slug, 'error': str(e)}
+    finally:
+        ultrank_metrics.events_in_progress.dec()
+
+    ultrank_metrics.record_event('scored', time.time() - started)
+    return {'slug': slug, 'result': result.to_dict()}
+
+
+def score_events(events, full_detail=True):
+    slugs = []
+    known_locations = {}
+    for event in events:
+        try:
+            slugs.append(isolate_slug(event['slug']))
+        except InvalidEventUrlException:
+            continue
+
+        metadata = event.get('metadata')
+        if metadata is not None and metadata.get('lat') is not None:
+            known_locations[slugs[-1]] = (metadata['lat'], metadata['lng'])
+
+    prefetch_locations(slugs, known_locations=known_locations)
+
+    with ThreadPoolExecutor(max_workers=SERVICE_WORKERS) as executor:
+        return list(executor.map(lambda event: score_event(event['slug'], event.get('invit', False), full_detail,
+                                                           event.get('metadata')), events))
+
+
+def parse_time(value):
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    # Only load dateparser if a search is actually requested
+    import dateparser
+
+    return int(dateparser.parse(value).timestamp())
+
+
+def search_events(start, end, incremental=False, full_detail=True):
+    from ultrank_search import retrieve_events, mark_events_scored
+
+    with search_lock:
+        events = retrieve_events(parse_time(start), parse_time(end), incremental=incremental)
+
+    results = score_events([{'slug': event['slug'], 'metadata': event} for event in events], full_detail=full_detail)
+
+    if incremental:
+        with search_lock:
+            mark_events_scored([result['slug'] for result in results if 'result' in result])
+
+    return {'slugs': [event['slug'] for event in events], 'results': results}
+
+
+def reload():
+    global loaded_at
+
+    reload_rankings()
+    loaded_at = datetime.datetime.now()
+
+    return status()
+
+
+def status():
+    players, tags, regions = current_rankings()
+
+    return {'players': len(players),
+            'tags': len(tags),
+            'regions': len(regions),
+            'cached_addresses': len(address_cache),
+            'coalesced_requests': request_stats['coalesced'],
+            'rankings_loaded_at': loaded_at.isoformat()}
+
+
+class ScoringRequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, data, status_code=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/status':
+            self.send_json(status())
+        elif self.path == '/metrics':
+            body = ultrank_metrics.exposition().encode('utf-8')
+
+            self.send_response(200)
+            self.send_header('Content-Type', ultrank_metrics.CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json({'error': 'invalid JSON body'}, 400)
+            return
+
+        try:
+            if self.path == '/score':
+                self.send_json(score_event(body['slug'], body.get('invit', False)))
+            elif self.path == '/batch':
+                self.send_json(score_events(body['events']))
+            elif self.path == '/search':
+                self.send_json(search_events(body['start'], body['end'], body.get('incremental', False),
+                                             body.get('full_detail', True)))
+            elif self.path == '/reload':
+                self.send_json(reload())
+            else:
+                self.send_json({'error': 'not found'}, 404)
+        except KeyError as e:
+            self.send_json({'error': 'missing field {}'.format(e)}, 400)
+        except Exception as e:
+            traceback.print_exc()
+            self.send_json({'error': str(e)}, 500)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve UltRank scoring over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    # Read the rankings before the first request, so it isn't slowed down by them
+    current_rankings()
+
+    server = ThreadingHTTPServer((args.host, args.port), ScoringRequestHandler)
+    print('listening on {}:{}'.format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,312 @@
+"""Scores events in bulk across several processes, each with its own start.gg key.
+
+Slugs are put in a SQLite work queue. Every worker process claims slugs from the
+queue one at a time, in the order given by ultrank_schedule, and stores its results
+there. Once every slug is done, the results are written out in input order, just
+like ultrank_bulk.
+
+Addresses are looked up by the coordinator before the workers start and passed on
+with each job, since Nominatim's limit of one request per second can only be kept
+within a single process.
+"""
+
+from ultrank_bulk import score_slug, summary_row, write_summary, write_report_texts, read_slugs, SNAPSHOT_FILE, SCORE_ORDER
+from ultrank_schedule import estimate_costs, order_jobs
+from ultrank_tiering import (current_rankings, use_player_table, prefetch_locations, event_locations, address_cache,
+                             address_cache_lock, PLAYER_TABLE_ENV)
+from ultrank_player_table import compile_player_table
+from startgg_toolkit import set_startgg_key, startgg_slug_regex
+import startgg_toolkit
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+
+WORK_QUEUE_FILE = 'work_queue.sqlite'
+PLAYER_TABLE_FILE = 'players.bin'
+
+# times to start new workers for slugs left unfinished by workers that stopped
+UNFINISHED_RETRIES = 1
+
+
+class WorkQueue:
+    """SQLite-backed queue of slugs shared between worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        # Autocommit mode, so claims can be done in explicit transactions
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+
+    @classmethod
+    def create(cls, path, slugs, priorities=None):
+        """Creates a queue of slugs. Slugs with lower priorities are claimed first."""
+
+        if priorities is None:
+            priorities = list(range(len(slugs)))
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        queue = cls(path)
+        queue.connection.execute('''CREATE TABLE jobs (
+            idx INTEGER PRIMARY KEY,
+            slug TEXT NOT NULL,
+            invit INTEGER NOT NULL,
+            metadata TEXT,
+            priority INTEGER NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            worker INTEGER,
+            summary TEXT,
+            result TEXT,
+            report TEXT,
+            snapshot TEXT
+        )''')
+        queue.connection.execute('BEGIN')
+        # Event details found by a search are kept, so workers don't fetch them again
+        queue.connection.executemany('INSERT INTO jobs (idx, slug, invit, metadata, priority) VALUES (?, ?, ?, ?, ?)',
+                                     [(idx, slug_obj['slug'], int(slug_obj['invit']),
+                                       json.dumps(slug_obj['metadata'], ensure_ascii=False)
+                                       if slug_obj.get('metadata') is not None else None, priority)
+                                      for idx, (slug_obj, priority) in enumerate(zip(slugs, priorities))])
+        queue.connection.execute('COMMIT')
+
+        return queue
+
+    def claim(self, worker):
+        """Claims the next pending slug. Returns None once the queue is empty."""
+
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same job
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.connection.execute(
+                "SELECT idx, slug, invit, metadata FROM jobs WHERE state = 'pending' ORDER BY priority, idx LIMIT 1").fetchone()
+
+            if row is not None:
+                self.connection.execute("UPDATE jobs SET state = 'running', worker = ? WHERE idx = ?", (worker, row[0]))
+        finally:
+            self.connection.execute('COMMIT')
+
+        if row is None:
+            return None
+
+        return row[0], {'slug': row[1], 'invit': bool(row[2]), 'metadata': json.loads(row[3]) if row[3] is not None else None}
+
+    def complete(self, idx, summary, result=None, report=None, snapshot=None):
+        self.connection.execute(
+            "UPDATE jobs SET state = 'done', summary = ?, result = ?, report = ?, snapshot = ? WHERE idx = ?",
+            (json.dumps(summary), result, report, snapshot, idx))
+
+    def requeue_unfinished(self):
+        """Puts jobs claimed by workers that stopped before finishing them back in the queue.
+
+        Only call this once no workers are running. Returns the number of jobs requeued.
+        """
+
+        return self.connection.execute("UPDATE jobs SET state = 'pending', worker = NULL WHERE state = 'running'").rowcount
+
+    def unfinished(self):
+        """Returns (idx, slug) for every job that isn't done, in input order."""
+
+        return self.connection.execute("SELECT idx, slug FROM jobs WHERE state != 'done' ORDER BY idx").fetchall()
+
+    def jobs(self):
+        """Returns the finished jobs in input order."""
+
+        return self.connection.execute(
+            "SELECT slug, summary, result, report, snapshot FROM jobs WHERE state = 'done' ORDER BY idx").fetchall()
+
+    def close(self):
+        self.connection.close()
+
+
+def read_key_pool(path):
+    """Reads start.gg keys from a file, one per line."""
+
+    with open(path) as key_file:
+        return [line.strip() for line in key_file if line.strip() != '']
+
+
+def resolve_addresses(slugs):
+    """Looks up the address of every event once, and returns the slugs with their coordinates and addresses as metadata."""
+
+    valid_slugs = [slug_obj for slug_obj in slugs if startgg_slug_regex.fullmatch(slug_obj['slug'])]
+
+    prefetch_locations([slug_obj['slug'] for slug_obj in valid_slugs],
+                       known_locations={slug_obj['slug']: (slug_obj['metadata']['lat'], slug_obj['metadata']['lng'])
+                                        for slug_obj in valid_slugs
+                                        if slug_obj.get('metadata') is not None and slug_obj['metadata'].get('lat') is not None}).join()
+
+    resolved = []
+
+    for slug_obj in slugs:
+        lat, lng = event_locations.get(slug_obj['slug'], (None, None))
+
+        if lat is None or lng is None:
+            resolved.append(slug_obj)
+            continue
+
+        metadata = dict(slug_obj.get('metadata') or {}, lat=lat, lng=lng)
+
+        with address_cache_lock:
+            address = address_cache.get((lat, lng))
+
+        # Addresses that couldn't be looked up are left for the worker to try again
+        if address is not None:
+            metadata['address'] = address
+
+        resolved.append(dict(slug_obj, metadata=metadata))
+
+    return resolved
+
+
+def work(worker, key, queue_path, player_table_path=None, full_detail=True, snapshots=False):
+    """Scores slugs from the queue until it's empty."""
+
+    # A forked worker inherits the parent's connection pool and in-flight requests, and
+    # sharing those sockets between processes would mix up their requests
+    with startgg_toolkit.session_lock:
+        startgg_toolkit.session = None
+    with startgg_toolkit.in_flight_lock:
+        startgg_toolkit.in_flight.clear()
+
+    set_startgg_key(key)
+
+    if player_table_path is not None:
+        use_player_table(player_table_path)
+
+    queue = WorkQueue(queue_path)
+
+    while True:
+        job = queue.claim(worker)
+
+        if job is None:
+            break
+
+        idx, slug_obj = job
+
+        result, tournament = score_slug(slug_obj, full_detail=full_detail)
+
+        if tournament is None:
+            queue.complete(idx, summary_row(result))
+        else:
+            queue.complete(idx, summary_row(result), result.to_json(), result.render_result(),
+                           json.dumps(tournament.to_snapshot(), ensure_ascii=False) if snapshots else None)
+
+    queue.close()
+
+
+def sharded_bulk_score(slugs, keys, directory='tts_values', archive=False, full_detail=True, snapshots=False, merge=False):
+    """Scores slugs with one worker process per key, then writes the results like ultrank_bulk.
+
+    Returns the structured results of the slugs that were scored. If snapshots is set,
+    the fetched data of each event is appended to SNAPSHOT_FILE. If merge is set, results
+    already in the directory are kept (see write_summary).
+    """
+
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    queue_path = os.path.join(directory, WORK_QUEUE_FILE)
+
+    slugs = resolve_addresses(slugs)
+
+    priorities = [0] * len(slugs)
+    for priority, idx in enumerate(order_jobs(estimate_costs(slugs), SCORE_ORDER)):
+        priorities[idx] = priority
+
+    # Closed while the workers run, since connections shouldn't be shared with child processes
+    WorkQueue.create(queue_path, slugs, priorities).close()
+
+    # Workers map one compiled copy of the player values instead of each building their own
+    player_table_path = os.path.join(directory, PLAYER_TABLE_FILE)
+    players, tags, _ = current_rankings()
+    compile_player_table(players, tags, player_table_path)
+
+    print('scoring {} slugs with {} workers'.format(len(slugs), len(keys)))
+
+    # Also passed through the environment, so workers that are started by reimporting
+    # the modules map the table instead of reading the CSVs first
+    previous_table = os.environ.get(PLAYER_TABLE_ENV)
+    os.environ[PLAYER_TABLE_ENV] = player_table_path
+
+    for attempt in range(UNFINISHED_RETRIES + 1):
+        workers = [multiprocessing.Process(target=work, args=(worker, key, queue_path, player_table_path, full_detail, snapshots))
+                   for worker, key in enumerate(keys)]
+
+        for process in workers:
+            process.start()
+        for process in workers:
+            process.join()
+
+        # A worker that crashed or was killed leaves the slug it was scoring claimed
+        queue = WorkQueue(queue_path)
+        queue.requeue_unfinished()
+        remaining = len(queue.unfinished())
+        queue.close()
+
+        if remaining == 0:
+            break
+
+        if attempt < UNFINISHED_RETRIES:
+            print('{} slugs were left unfinished by workers that stopped, trying them again'.format(remaining))
+
+    if previous_table is None:
+        del os.environ[PLAYER_TABLE_ENV]
+    else:
+        os.environ[PLAYER_TABLE_ENV] = previous_table
+
+    queue = WorkQueue(queue_path)
+
+    # Slugs that still weren't finished are listed as unscored, like slugs that failed
+    unfinished = queue.unfinished()
+    for idx, slug in unfinished:
+        queue.complete(idx, summary_row(slug))
+
+    jobs = queue.jobs()
+    queue.close()
+
+    if len(unfinished) > 0:
+        print('{} slugs were not finished by any worker'.format(len(unfinished)))
+
+    if snapshots:
+        with open(os.path.join(directory, SNAPSHOT_FILE), mode='a', encoding='utf-8') as snapshot_file:
+            for _, _, _, _, snapshot in jobs:
+                if snapshot is not None:
+                    snapshot_file.write(snapshot + '\n')
+
+    write_report_texts([(json.loads(result)['slug'], report) for _, _, result, report, _ in jobs if report is not None],
+                       directory, archive=archive)
+
+    result_dicts = [json.loads(result) for _, _, result, _, _ in jobs if result is not None]
+
+    write_summary([json.loads(summary) for _, summary, _, _, _ in jobs], result_dicts, directory, merge)
+
+    os.remove(queue_path)
+    os.remove(player_table_path)
+
+    return result_dicts
+
+
+if __name__ == '__main__':
+    file = input('input file to read keys from: ')
+    key_file = input('input file with one start.gg API key per line: ')
+
+    if not os.path.exists(file) or not os.path.exists(key_file):
+        print('file doesn\'t exist!')
+        sys.exit()
+
+    slugs = read_slugs(file)
+
+    print('read values')
+
+    archive = input('write event reports to a single archive? (y/n) ')
+    archive = archive.lower() == 'y' or archive.lower() == 'yes'
+
+    staged = input('only check DQs for events whose result depends on them? (y/n) ')
+    full_detail = not (staged.lower() == 'y' or staged.lower() == 'yes')
+
+    snapshots = input('add each event\'s fetched data to {} for ultrank_simulate.py? (y/n) '.format(SNAPSHOT_FILE))
+    snapshots = snapshots.lower() == 'y' or snapshots.lower() == 'yes'
+
+    sharded_bulk_score(slugs, read_key_pool(key_file), archive=archive, full_detail=full_detail, snapshots=snapshots)
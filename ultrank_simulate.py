@@ -0,0 +1,339 @@
+"""Re-scores stored events under alternative rulesets.
+
+Events are read from the event_snapshots.jsonl file written by ultrank_bulk, so
+no start.gg queries are needed. Each ruleset can override the floors, the
+multiplier caps, the midpoint depreciation table and the date of the new
+multiplier system. The simulator reports which events would change whether they
+meet the requirements to be counted.
+"""
+
+from ultrank_tiering import (Tournament, find_region, current_rankings, get_tag_index, FUZZY_TAG_MATCHING, NUM_PLAYERS_FLOOR,
+                             SCORE_FLOOR, ENTRANT_FLOOR, NEW_MULT_SYSTEM_DATE, MIDPOINT_DEPRECIATION, MULTIPLIER_CAPS)
+import csv
+import datetime
+import itertools
+import json
+import os
+import sys
+
+
+class RuleSet:
+    """Stores one set of tiering parameters. Anything not given uses the current rules."""
+
+    def __init__(self, name='current', score_floor=None, entrant_floor=None, num_players_floor=None,
+                 midpoint_depreciation=None, new_mult_system_date=None, multiplier_caps=None):
+        self.name = name
+        self.score_floor = {**SCORE_FLOOR, **score_floor} if score_floor else SCORE_FLOOR
+        self.entrant_floor = {**ENTRANT_FLOOR, **entrant_floor} if entrant_floor else ENTRANT_FLOOR
+        self.num_players_floor = num_players_floor if num_players_floor is not None else NUM_PLAYERS_FLOOR
+        self.midpoint_depreciation = {**MIDPOINT_DEPRECIATION, **midpoint_depreciation} if midpoint_depreciation else MIDPOINT_DEPRECIATION
+        self.new_mult_system_date = new_mult_system_date if new_mult_system_date is not None else NEW_MULT_SYSTEM_DATE
+        self.multiplier_caps = {**MULTIPLIER_CAPS, **multiplier_caps} if multiplier_caps else MULTIPLIER_CAPS
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a ruleset from JSON data, where tables are keyed by strings."""
+
+        def int_keys(table):
+            return {int(key): value for key, value in table.items()} if table else None
+
+        date = data.get('new_mult_system_date')
+
+        return cls(name=data.get('name', 'unnamed'),
+                   score_floor=int_keys(data.get('score_floor')),
+                   entrant_floor=int_keys(data.get('entrant_floor')),
+                   num_players_floor=data.get('num_players_floor'),
+                   midpoint_depreciation=int_keys(data.get('midpoint_depreciation')),
+                   new_mult_system_date=datetime.date.fromisoformat(date) if date else None,
+                   multiplier_caps=int_keys(data.get('multiplier_caps')))
+
+    def depreciation_key(self):
+        return tuple(sorted(self.midpoint_depreciation.items()))
+
+    def entrant_score(self, entrants, multiplier, date):
+        if date > self.new_mult_system_date:
+            score = entrants
+
+            for mult, cap in self.multiplier_caps.items():
+                if multiplier >= mult:
+                    score += min(cap, entrants)
+
+            return score
+
+        return entrants * multiplier
+
+
+class SimulatedValue:
+    """Stores the values a player could be worth at one event.
+
+    Only the depreciated values depend on the ruleset, so the rest are
+    reduced to a single number up front.
+    """
+
+    def __init__(self, fixed_points, depreciated_from, invitational_points):
+        self.fixed_points = fixed_points
+        self.depreciated_from = depreciated_from
+        self.invitational_points = invitational_points
+
+    def points(self, depreciation):
+        points = self.fixed_points
+
+        for original in self.depreciated_from:
+            points = max(points, depreciation[original])
+
+        return points + self.invitational_points
+
+
+class SimulatedEvent:
+    """Stores the parts of an event needed to rescore it."""
+
+    def __init__(self, tournament):
+        players, _, regions = current_rankings()
+        tag_index = get_tag_index(players)
+
+        self.slug = tournament.event_slug
+        self.date = tournament.start_time
+        self.entrants = tournament.total_entrants
+        self.multiplier = find_region(tournament.address, tournament.start_time, regions).multiplier
+
+        self.values = []
+        self.potential = {}
+        self.dqs = []
+        self.num_players = 0
+
+        for participant in tournament.participants:
+            if participant.id_ in tournament.dq_list:
+                continue
+
+            if participant.id_ in players:
+                value = simulated_value(players[participant.id_], tournament)
+
+                if value is not None:
+                    self.values.append(value)
+                    self.num_players += 1
+            else:
+                self.add_potential(participant, tournament, players, tag_index)
+
+        for participant, _ in tournament.dq_list.values():
+            if participant.id_ in players:
+                value = simulated_value(players[participant.id_], tournament)
+
+                if value is not None:
+                    self.dqs.append(value)
+                    self.num_players += 1
+            else:
+                self.add_potential(participant, tournament, players, tag_index)
+
+        self.potential = list(self.potential.values())
+
+        # Totals per depreciation table, since most sweeps only change floors
+        self.cache = {}
+
+    def add_potential(self, participant, tournament, players, tag_index):
+        for player_id, _ in tag_index.candidates(participant.tag, fuzzy=FUZZY_TAG_MATCHING):
+            value = simulated_value(players[player_id], tournament)
+
+            if value is not None:
+                self.potential.setdefault(participant.id_, []).append(value)
+                self.num_players += 1
+
+    def player_points(self, rules):
+        """Returns the points from counted players and the points from potential players/DQs."""
+
+        key = rules.depreciation_key()
+
+        if key not in self.cache:
+            depreciation = rules.midpoint_depreciation
+
+            counted = sum(value.points(depreciation) for value in self.values)
+            potential = sum(max(value.points(depreciation) for value in values) for values in self.potential)
+            potential += sum(value.points(depreciation) for value in self.dqs)
+
+            self.cache[key] = (counted, potential)
+
+        return self.cache[key]
+
+    def score(self, rules):
+        return rules.entrant_score(self.entrants, self.multiplier, self.date) + self.player_points(rules)[0]
+
+    def max_potential_score(self, rules):
+        return self.score(rules) + self.player_points(rules)[1]
+
+    def should_count(self, rules):
+        if self.entrants >= rules.entrant_floor[self.multiplier]:
+            return True
+
+        return self.max_potential_score(rules) >= rules.score_floor[self.multiplier] and self.num_players >= rules.num_players_floor
+
+
+def simulated_value(player_value_group, tournament):
+    """Mirrors PlayerValueGroup.retrieve_value, keeping depreciated values open."""
+
+    fixed_points = None
+    depreciated_from = []
+
+    for value in player_value_group.values:
+        if value.is_within_timeframe(tournament.start_time):
+            if value.depreciated_from is not None:
+                depreciated_from.append(value.depreciated_from)
+            else:
+                fixed_points = max(value.points, fixed_points or 0)
+
+    invitational_points = 0
+    has_invitational = False
+
+    if tournament.is_invitational:
+        for value in player_value_group.invitational_values:
+            if value.is_within_timeframe(tournament.start_time):
+                invitational_points = value.points
+                has_invitational = True
+                break
+
+    if fixed_points is None and len(depreciated_from) == 0 and not has_invitational:
+        return None
+
+    return SimulatedValue(fixed_points or 0, depreciated_from, invitational_points)
+
+
+def load_events(path):
+    """Loads events from a snapshot file. Later snapshots of the same event replace earlier ones.
+
+    Snapshots of events whose DQs weren't checked (see Tournament.check_outcome_without_dqs)
+    are skipped, since their entrant counts and scores are only upper bounds.
+    """
+
+    snapshots = {}
+    pruned = set()
+
+    with open(path, encoding='utf-8') as snapshot_file:
+        for line in snapshot_file:
+            if line.strip() == '':
+                continue
+
+            snapshot = json.loads(line)
+
+            if snapshot.get('pruned') is not None:
+                pruned.add(snapshot['slug'])
+                continue
+
+            snapshots[snapshot['slug']] = snapshot
+
+    skipped = pruned - snapshots.keys()
+    if len(skipped) > 0:
+        print('skipping {} events whose DQs weren\'t checked; score them with DQs checked to simulate them'.format(
+            len(skipped)))
+
+    return [SimulatedEvent(Tournament.from_snapshot(snapshot)) for snapshot in snapshots.values()]
+
+
+def load_rulesets(path):
+    """Reads rulesets from a JSON file.
+
+    The file holds either a list of rulesets, or a grid of the form
+    {"grid": {"parameter": [option, ...], ...}} which is expanded into every combination.
+    """
+
+    with open(path, encoding='utf-8') as rules_file:
+        data = json.load(rules_file)
+
+    if isinstance(data, dict) and 'grid' in data:
+        data = expand_grid(data['grid'])
+
+    return [RuleSet.from_dict(rules) for rules in data]
+
+
+def expand_grid(grid):
+    keys = list(grid.keys())
+    rulesets = []
+
+    for combination in itertools.product(*[grid[key] for key in keys]):
+        rules = dict(zip(keys, combination))
+        rules['name'] = ', '.join('{}={}'.format(key, json.dumps(value)) for key, value in rules.items())
+        rulesets.append(rules)
+
+    return rulesets
+
+
+def simulate(events, rulesets, baseline=None):
+    """Rescores every event under every ruleset.
+
+    Returns a list of (ruleset, number of counted events, events that would start counting,
+    events that would stop counting), compared to the baseline ruleset.
+    """
+
+    if baseline is None:
+        baseline = RuleSet()
+
+    baseline_counts = {event.slug: event.should_count(baseline) for event in events}
+
+    results = []
+
+    for rules in rulesets:
+        counted = 0
+        gained = []
+        lost = []
+
+        for event in events:
+            counts = event.should_count(rules)
+
+            if counts:
+                counted += 1
+
+            if counts != baseline_counts[event.slug]:
+                (gained if counts else lost).append(event)
+
+        results.append((rules, counted, gained, lost))
+
+    return results
+
+
+def write_simulation(results, events, directory='tts_values'):
+    if not os.path.isdir(directory):
+        os.mkdir(directory)
+
+    with open(os.path.join(directory, 'simulation.csv'), newline='', mode='w') as summary_file:
+        writer = csv.DictWriter(summary_file, ['Ruleset', 'Counted Events', 'Newly Counted', 'No Longer Counted'])
+        writer.writeheader()
+
+        for rules, counted, gained, lost in results:
+            writer.writerow({'Ruleset': rules.name,
+                             'Counted Events': counted,
+                             'Newly Counted': len(gained),
+                             'No Longer Counted': len(lost)})
+
+    with open(os.path.join(directory, 'simulation_flips.csv'), newline='', mode='w') as flips_file:
+        writer = csv.DictWriter(flips_file, ['Ruleset', 'Slug', 'Meets Reqs', 'Score', 'Max Potential Score', 'Num Entrants'])
+        writer.writeheader()
+
+        for rules, _, gained, lost in results:
+            for event in gained + lost:
+                writer.writerow({'Ruleset': rules.name,
+                                 'Slug': event.slug,
+                                 'Meets Reqs': str(event in gained),
+                                 'Score': event.score(rules),
+                                 'Max Potential Score': event.max_potential_score(rules),
+                                 'Num Entrants': event.entrants})
+
+
+if __name__ == '__main__':
+    snapshot_path = input('input event snapshot file (leave blank for tts_values/event_snapshots.jsonl): ')
+    if snapshot_path.strip() == '':
+        snapshot_path = os.path.join('tts_values', 'event_snapshots.jsonl')
+
+    rules_path = input('input ruleset file: ')
+
+    if not os.path.exists(snapshot_path) or not os.path.exists(rules_path):
+        print('file doesn\'t exist!')
+        sys.exit()
+
+    events = load_events(snapshot_path)
+    rulesets = load_rulesets(rules_path)
+
+    print('simulating {} rulesets over {} events'.format(len(rulesets), len(events)))
+
+    results = simulate(events, rulesets)
+
+    for rules, counted, gained, lost in results:
+        print('{}: {} counted (+{}, -{})'.format(rules.name, counted, len(gained), len(lost)))
+
+    write_simulation(results, events)
@@ -0,0 +1,88 @@
+"""Measures how long the entry points take to start.
+
+Each module is imported in a fresh interpreter with `python -X importtime`, and
+the time to import it is reported along with any heavy dependencies that were
+loaded on the way. Exits with an error if a module takes longer than --max-ms or
+loads a heavy dependency, so slow imports can be caught before they're merged.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ENTRY_POINTS = ['ultrank_tiering', 'ultrank_bulk', 'ultrank_search', 'ultrank_live', 'ultrank_service',
+                'ultrank_shard', 'ultrank_simulate', 'ultrank_season']
+
+# Dependencies that are slow to import, and should only be loaded when they're used
+HEAVY_MODULES = ['dateparser', 'geopy', 'requests', 'Levenshtein', 'rapidfuzz']
+
+
+def import_times(module):
+    """Imports a module in a new interpreter, and returns the cumulative import time of every module in microseconds."""
+
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                             cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+
+    if process.returncode != 0:
+        raise RuntimeError('importing {} failed:\n{}'.format(module, process.stderr))
+
+    times = {}
+
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+
+        # import time: self [us] | cumulative | imported package
+        fields = line[len('import time:'):].split('|')
+
+        try:
+            times[fields[2].strip()] = int(fields[1])
+        except ValueError:
+            # the header line
+            continue
+
+    return times
+
+
+def measure(module, repeat=3):
+    """Returns the fastest of several import times of a module in milliseconds, and the heavy modules it loaded."""
+
+    best = None
+    heavy = []
+
+    for _ in range(repeat):
+        times = import_times(module)
+
+        if best is None or times[module] < best:
+            best = times[module]
+
+        heavy = [name for name in HEAVY_MODULES if name in times]
+
+    return best / 1000, heavy
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure how long the UltRank entry points take to import.')
+    parser.add_argument('modules', nargs='*', default=ENTRY_POINTS)
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each module is imported')
+    parser.add_argument('--max-ms', type=float, help='fail if a module takes longer than this to import')
+    parser.add_argument('--allow-heavy', action='store_true', help='don\'t fail if a module loads a heavy dependency')
+    args = parser.parse_args()
+
+    failed = False
+
+    for module in args.modules:
+        ms, heavy = measure(module, args.repeat)
+
+        print('{:<20} {:>8.1f} ms  {}'.format(module, ms, ', '.join(heavy)))
+
+        if args.max_ms is not None and ms > args.max_ms:
+            print('  slower than {} ms'.format(args.max_ms))
+            failed = True
+
+        if len(heavy) > 0 and not args.allow_heavy:
+            print('  loads {} at import'.format(', '.join(heavy)))
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,161 @@
+"""Scores events read as JSON lines, and writes each result as a JSON line as soon as it's ready.
+
+Meant to be run by other programs rather than by hand: nothing is asked, and only
+results are written to stdout. Progress messages go to stderr.
+
+Each input line is one event, given as any of
+ - a slug or event URL, on its own or as a JSON string,
+ - {"slug": ..., "invit": false, "metadata": {...}}, like the body of POST /score
+   in ultrank_service, or
+ - an event found by ultrank_search.retrieve_events, whose details are used as
+   its metadata so they aren't fetched again.
+
+Each output line is {"line": n, "slug": ..., "result": {...}}, with the structured
+result of the event on input line n, or {"line": n, "slug": ..., "error": ...} if it
+couldn't be scored. Results are written in the order events finish, or in input order
+with --ordered.
+
+At most --window events are read ahead of the results written so far, so a reader
+that falls behind slows scoring down instead of results piling up in memory.
+"""
+
+from ultrank_service import score_event
+from ultrank_bulk import SCORE_WORKERS
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import argparse
+import contextlib
+import json
+import sys
+import ultrank_metrics
+
+# fields of an event found by ultrank_search, any of which marks a line as one
+DESCRIPTOR_FIELDS = ['tournament', 'event', 'start_at', 'lat', 'lng', 'num_entrants']
+
+
+def parse_event(line):
+    """Reads an event from an input line, as {'slug': ..., 'invit': ..., 'metadata': ...}.
+
+    Raises ValueError if the line isn't a slug or a JSON event.
+    """
+
+    line = line.strip()
+
+    try:
+        event = json.loads(line)
+    except ValueError:
+        # Plain slugs and URLs aren't valid JSON
+        event = line
+
+    if isinstance(event, str):
+        return {'slug': event, 'invit': False, 'metadata': None}
+
+    if not isinstance(event, dict) or not isinstance(event.get('slug'), str):
+        raise ValueError('expected a slug, or an object with a slug')
+
+    metadata = event.get('metadata')
+    if metadata is None and any(field in event for field in DESCRIPTOR_FIELDS):
+        metadata = event
+
+    return {'slug': event['slug'], 'invit': bool(event.get('invit', False)), 'metadata': metadata}
+
+
+def stream_scores(lines, emit, workers=SCORE_WORKERS, window=None, ordered=False, full_detail=True):
+    """Scores the events in lines, calling emit with each output as it's ready.
+
+    Input is only read while fewer than window events are being scored or waiting
+    to be emitted, so emit blocking holds back the rest of the input. Returns the
+    number of events read.
+    """
+
+    if window is None:
+        window = 2 * workers
+
+    window = max(1, window)
+
+    # future -> (position, line number)
+    pending = {}
+    # position -> output, for outputs that are waiting for earlier ones in ordered mode
+    finished = {}
+    next_position = 0
+    position = 0
+
+    def finish(output_position, output):
+        nonlocal next_position
+
+        if not ordered:
+            emit(output)
+            return
+
+        finished[output_position] = output
+
+        while next_position in finished:
+            emit(finished.pop(next_position))
+            next_position += 1
+
+    def collect(futures):
+        for future in futures:
+            output_position, number = pending.pop(future)
+            finish(output_position, dict(line=number, **future.result()))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for number, line in enumerate(lines, 1):
+            if line.strip() == '':
+                continue
+
+            try:
+                event = parse_event(line)
+            except ValueError as e:
+                finish(position, {'line': number, 'slug': None, 'error': 'invalid input: {}'.format(e)})
+            else:
+                future = executor.submit(score_event, event['slug'], event['invit'], full_detail, event['metadata'])
+                pending[future] = (position, number)
+
+            position += 1
+
+            while len(pending) + len(finished) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        while len(pending) > 0:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+
+    return position
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Score events read as JSON lines, writing one JSON result per line.')
+    parser.add_argument('input', nargs='?', default='-', help='file to read events from (stdin by default)')
+    parser.add_argument('--output', default='-', help='file to write results to (stdout by default)')
+    parser.add_argument('--workers', type=int, default=SCORE_WORKERS, help='number of events scored at the same time')
+    parser.add_argument('--window', type=int, default=None,
+                        help='most events read ahead of the results written (twice the workers by default)')
+    parser.add_argument('--ordered', action='store_true', help='write results in input order')
+    parser.add_argument('--staged', action='store_true', help='only check DQs for events whose result depends on them')
+    ultrank_metrics.add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    output_file = sys.stdout if args.output == '-' else open(args.output, mode='w', encoding='utf-8')
+
+    def emit(output):
+        output_file.write(json.dumps(output, ensure_ascii=False) + '\n')
+        output_file.flush()
+
+    try:
+        # Everything printed while scoring is progress, so keep it out of the results
+        with contextlib.redirect_stdout(sys.stderr):
+            ultrank_metrics.export_from_arguments(args)
+
+            count = stream_scores(input_file, emit, workers=args.workers, window=args.window, ordered=args.ordered,
+                                  full_detail=not args.staged)
+
+        print('scored {} events'.format(count), file=sys.stderr)
+    except BrokenPipeError:
+        # The reader stopped reading, so there's no one left to write results for
+        sys.exit(1)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
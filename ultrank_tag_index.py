@@ -0,0 +1,141 @@
+"""Index of known tags used to find potentially mismatched players.
+
+Tags are normalized (NFKC, casefolded, sponsor prefixes removed) before being
+compared, so "SPN | Tag", "ＴＡＧ" and "tag" all match the same player. Tags that
+don't match exactly are compared by edit distance to the known tags that share
+the most trigrams with them.
+"""
+
+from ultrank_player_table import MappedPlayerTable
+import threading
+import unicodedata
+
+# minimum similarity (1 - edit distance / length of the longer tag) for a fuzzy match
+FUZZY_TAG_THRESHOLD = 0.8
+
+# tags shorter than this are only matched exactly, since a single typo changes them too much
+FUZZY_MIN_LENGTH = 5
+
+# number of known tags sharing the most trigrams with a tag that are compared by edit distance
+FUZZY_CANDIDATES = 20
+
+
+def normalize_tag(tag):
+    """Normalizes a tag for comparison."""
+
+    tag = unicodedata.normalize('NFKC', tag).casefold()
+
+    # Drop sponsor prefixes, e.g. "SPN | Tag"
+    if '|' in tag:
+        tag = tag.rsplit('|', 1)[1]
+
+    return ' '.join(tag.split())
+
+
+def trigrams(tag):
+    padded = ' {} '.format(tag)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class TagIndex:
+    """Finds the players a tag could belong to.
+
+    The tags of a MappedPlayerTable are read straight from the table, without building
+    its player groups. Normalized tags and trigrams are only indexed the first time a
+    fuzzy match is asked for.
+    """
+
+    def __init__(self, players):
+        # exact lowercase tag -> player ids, matching PlayerValueGroup.match_tag
+        self.exact = {}
+        # normalized tag -> player ids
+        self.normalized = None
+        # trigram -> normalized tags containing it
+        self.grams = None
+        self.fuzzy_lock = threading.Lock()
+        # player id -> position in players, so results keep the order of the ranking data
+        self.order = {}
+
+        if isinstance(players, MappedPlayerTable):
+            entries = players.tag_entries()
+        else:
+            entries = ((id_, group.tag, group.other_tags) for id_, group in players.items())
+
+        for position, (id_, tag, other_tags) in enumerate(entries):
+            self.order[id_] = position
+
+            for known_tag in set([tag.lower()] + other_tags):
+                self.exact.setdefault(known_tag, []).append(id_)
+
+    def build_fuzzy_index(self):
+        with self.fuzzy_lock:
+            if self.normalized is not None:
+                return
+
+            normalized_tags = {}
+            grams = {}
+
+            for tag, ids in self.exact.items():
+                normalized = normalize_tag(tag)
+                if normalized == '':
+                    continue
+
+                if normalized not in normalized_tags:
+                    normalized_tags[normalized] = []
+                    for gram in trigrams(normalized):
+                        grams.setdefault(gram, []).append(normalized)
+
+                normalized_tags[normalized].extend(ids)
+
+            self.grams = grams
+            self.normalized = normalized_tags
+
+    def candidates(self, tag, fuzzy=True):
+        """Returns (player id, similarity) pairs for every player the tag could belong to.
+
+        Exact matches (ignoring case) have a similarity of 1. If fuzzy is set, tags that
+        are the same once normalized also have a similarity of 1, and similar tags are
+        matched too. Results are ordered by similarity, then by their order in the
+        ranking data.
+        """
+
+        matches = {}
+
+        for id_ in self.exact.get(tag.lower(), []):
+            matches[id_] = 1
+
+        if not fuzzy:
+            return sorted(matches.items(), key=lambda match: self.order[match[0]])
+
+        if self.normalized is None:
+            self.build_fuzzy_index()
+
+        normalized = normalize_tag(tag)
+
+        for id_ in self.normalized.get(normalized, []):
+            matches.setdefault(id_, 1)
+
+        if len(normalized) >= FUZZY_MIN_LENGTH:
+            from Levenshtein import distance
+
+            shared = {}
+            for gram in trigrams(normalized):
+                for known_tag in self.grams.get(gram, []):
+                    shared[known_tag] = shared.get(known_tag, 0) + 1
+
+            for known_tag in sorted(shared, key=shared.get, reverse=True)[:FUZZY_CANDIDATES]:
+                length = max(len(known_tag), len(normalized))
+                max_distance = int(length * (1 - FUZZY_TAG_THRESHOLD))
+
+                if len(known_tag) < FUZZY_MIN_LENGTH or abs(len(known_tag) - len(normalized)) > max_distance:
+                    continue
+
+                dist = distance(normalized, known_tag, score_cutoff=max_distance)
+                if dist > max_distance:
+                    continue
+
+                similarity = 1 - dist / length
+                for id_ in self.normalized[known_tag]:
+                    matches[id_] = max(similarity, matches.get(id_, 0))
+
+        return sorted(matches.items(), key=lambda match: (-match[1], self.order[match[0]]))
@@ -9,13 +9,17 @@ Requirements:
   ultrank_invitational.csv
 """
 
-from startgg_toolkit import send_request, isolate_slug, refresh_startgg_key
-from geopy.geocoders import Nominatim
+from startgg_toolkit import send_request, paginate, isolate_slug, refresh_startgg_key, add_network_wait
+from ultrank_tag_index import TagIndex
 import csv
+import os
 import re
 import sys
 import json
 import datetime
+import threading
+import time
+import ultrank_metrics
 
 NUM_PLAYERS_FLOOR = 2
 
@@ -33,6 +37,13 @@ ENTRANT_FLOOR = {
 
 NEW_MULT_SYSTEM_DATE = datetime.date.fromisoformat('2024-12-16')
 
+# Under the new multiplier system, regions with a multiplier of at least
+# the key count entrants again, up to the given number of entrants.
+MULTIPLIER_CAPS = {
+    2: 256,
+    3: 128
+}
+
 MIDPOINT_DEPRECIATION = {
     300: 250,
     250: 200,
@@ -46,11 +57,48 @@ MIDPOINT_DEPRECIATION = {
 
 ADDRESS_DEBUG = False
 
+# Also look for players whose tags are similar to, not only the same as, an entrant's tag.
+# Similar tags are added to the potential matches, so they raise max potential scores.
+FUZZY_TAG_MATCHING = False
+
+# When scoring without full detail, DQs are always skipped for events that can't meet the
+# requirements even with no DQs, since DQs can only lower the score and entrant count.
+# If this is set, they're also skipped for events that would still clear the entrant floor
+# with this share of their entrants missing. That's a guess, not a bound: an event with more
+# DQs than that is counted when it shouldn't be, so it's off unless set.
+PRUNE_ENTRANT_MARGIN = None
+
+# If set, player values are read from this compiled player table
+# (see ultrank_player_table.py) instead of the player CSVs.
+PLAYER_TABLE_ENV = 'ULTRANK_PLAYER_TABLE'
+
+# Addresses already looked up through Nominatim, keyed by (lat, lng)
+address_cache = {}
+address_cache_lock = threading.Lock()
+geolocator = None
+
+# Nominatim allows at most one request per second
+NOMINATIM_INTERVAL = 1
+nominatim_lock = threading.Lock()
+last_nominatim_request = 0
+
+# Coordinates being looked up in the background by prefetch_locations, with an event
+# that's set once the lookup is done
+pending_addresses = {}
+
+# Coordinates of events fetched ahead of time by prefetch_locations, keyed by slug
+event_locations = {}
+
+# number of events whose locations are fetched in one query
+LOCATION_BATCH_SIZE = 50
+
 
 class PotentialMatchWithDqs:
-    def __init__(self, tag, id_, points, note, actual_tag='', dqs=0):
+    def __init__(self, tag, id_, points, note, actual_tag='', dqs=0, candidate_id=None):
         self.tag = tag.strip()
         self.id_ = id_
+        # ID of the ranked player the entrant might be
+        self.candidate_id = candidate_id
         self.points = points
         self.note = note
         self.actual_tag = actual_tag if actual_tag != '' else self.tag
@@ -62,6 +110,15 @@ class PotentialMatchWithDqs:
             self.dqs, 's' if self.dqs == 1 else '')
         return '{} (id {}) - {}{} points [{}]{}'.format(self.tag, self.id_, actual_tag_portion, self.points, self.note, dq_portion)
 
+    def to_dict(self):
+        return {'tag': self.tag,
+                'id': self.id_,
+                'candidate_id': self.candidate_id,
+                'points': self.points,
+                'note': self.note,
+                'actual_tag': self.actual_tag,
+                'dqs': self.dqs}
+
 
 class DisqualificationValue:
     """Stores a player value with DQ count."""
@@ -73,6 +130,11 @@ class DisqualificationValue:
     def __str__(self):
         return '{} - {} DQ{}'.format(str(self.value), str(self.dqs), '' if self.dqs == 1 else 's')
 
+    def to_dict(self):
+        ret = self.value.to_dict()
+        ret['dqs'] = self.dqs
+        return ret
+
 
 class CountedValue:
     """Stores a counted player value with additional data."""
@@ -94,11 +156,19 @@ class CountedValue:
 
         return '{} - {} points [{}]'.format(full_tag, self.points, self.player_value.note)
 
+    def to_dict(self):
+        return {'tag': self.tag,
+                'alt_tag': self.alt_tag,
+                'id': self.id_,
+                'points': self.points,
+                'category': self.player_value.category,
+                'note': self.player_value.note}
+
 
 class PlayerValue:
     """Stores scores for players."""
 
-    def __init__(self, id_, hex_, tag, points=0, category='', note='', start_time=None, end_time=None):
+    def __init__(self, id_, hex_, tag, points=0, category='', note='', start_time=None, end_time=None, depreciated_from=None):
         self.id_ = id_
         self.hex_ = hex_
         self.tag = tag
@@ -107,10 +177,19 @@ class PlayerValue:
         self.note = note
         self.start_time = start_time
         self.end_time = end_time
+        # Original point value, if these points come from MIDPOINT_DEPRECIATION
+        self.depreciated_from = depreciated_from
 
     def __str__(self):
         return '{} (id {}) - {} points [{}]'.format(self.tag, self.id_, self.points,  self.note)
 
+    def to_dict(self):
+        return {'tag': self.tag,
+                'id': self.id_,
+                'points': self.points,
+                'category': self.category,
+                'note': self.note}
+
     def is_within_timeframe(self, time):
         if self.start_time != None and time < self.start_time:
             return False
@@ -139,7 +218,7 @@ class PlayerValueGroup:
             self.values.append(PlayerValue(
                 self.id_, self.hex_, self.tag, points, category, note, start_time, midpt_time))
             self.values.append(PlayerValue(
-                self.id_, self.hex_, self.tag, MIDPOINT_DEPRECIATION[points], category, note + " (dep.)", midpt_time, end_time))
+                self.id_, self.hex_, self.tag, MIDPOINT_DEPRECIATION[points], category, note + " (dep.)", midpt_time, end_time, depreciated_from=points))
 
         self.values.sort(reverse=True, key=lambda val: val.points)
 
@@ -171,7 +250,7 @@ class PlayerValueGroup:
 
 
 class TournamentTieringResult:
-    def __init__(self, slug, score, entrants, region, values, dqs, potential, date, is_invitational=False, phases=[], dq_count=-1):
+    def __init__(self, slug, score, entrants, region, values, dqs, potential, date, is_invitational=False, phases=[], dq_count=-1, names=None, attendees=[], pruned=None):
         self.slug = slug
         self.score = score
         self.values = values
@@ -183,81 +262,169 @@ class TournamentTieringResult:
         self.is_invitational = is_invitational
         self.dq_count = dq_count
         self.phases = phases
+        self.attendees = attendees
+        # Why sets weren't checked for DQs, if they weren't
+        self.pruned = pruned
         self.max_score = None
+        # Rendered ahead of time by compact
+        self.counts = None
+        self.report = None
+        self.serialized = None
 
-        name = get_name(slug)
+        name = names if names is not None else get_name(slug)
         self.tournament = name['tournament']
         self.event = name['event']
 
     def using_new_tiering_system(self):
         return self.date > NEW_MULT_SYSTEM_DATE
 
-    def write_result(self, filelike=None):
-        original_stdout = sys.stdout
-
-        if filelike != None:
-            sys.stdout = filelike
-
-        print('{} - {} ({}){}'.format(self.tournament, self.event,
-                                      self.slug, ' (invitational)' if self.is_invitational else ''))
-        print('Phases used: {}'.format(str(self.phases)))
-        print()
-
-        if not self.should_count():
-            print('WARNING: This tournament does not meet the criteria of at least {} entrants or a score of at least {} with {} qualified players'.format(
-                self.region.entrant_floor, self.region.score_floor, NUM_PLAYERS_FLOOR))
-            print()
-        elif not self.should_count_strict():
-            print('WARNING: This tournament may not meet the criteria of at least {} entrants or a score of at least {} with {} qualified players'.format(
-                self.region.entrant_floor, self.region.score_floor, NUM_PLAYERS_FLOOR))
-            print()
+    def entrant_score(self):
+        """Returns the points given for entrants, along with a readable breakdown of the math."""
 
         participants_string = '{} - {} DQs = {}'.format(
             self.entrants + self.dq_count, self.dq_count, self.entrants) if self.dq_count != -1 else str(self.entrants)
 
         if self.date > NEW_MULT_SYSTEM_DATE:
-            print_str = 'Entrants: '
-            print_str += participants_string
+            breakdown = participants_string
             entrants_score = self.entrants
             if self.region.multiplier >= 2:
-                print_str += ' + {} (x2)'.format(str(min(256, self.entrants)))
-                entrants_score += min(256, self.entrants)
+                breakdown += ' + {} (x2)'.format(str(min(MULTIPLIER_CAPS[2], self.entrants)))
+                entrants_score += min(MULTIPLIER_CAPS[2], self.entrants)
             if self.region.multiplier >= 3:
-                print_str += ' + {} (x3)'.format(str(min(128, self.entrants)))
-                entrants_score += min(128, self.entrants)
+                breakdown += ' + {} (x3)'.format(str(min(MULTIPLIER_CAPS[3], self.entrants)))
+                entrants_score += min(MULTIPLIER_CAPS[3], self.entrants)
             if self.region.multiplier == 1:
-                print_str += ' (x1)'
-            print_str += f' = {entrants_score} [x{self.region.multiplier}, {self.region.note}]'
-            print(print_str)
+                breakdown += ' (x1)'
+            breakdown += f' = {entrants_score} [x{self.region.multiplier}, {self.region.note}]'
 
         else:
-            print('Entrants: {} x {} [{}] = {}'.format(
-                participants_string, self.region.multiplier, self.region.note, self.entrants * self.region.multiplier))
+            entrants_score = self.entrants * self.region.multiplier
+            breakdown = '{} x {} [{}] = {}'.format(
+                participants_string, self.region.multiplier, self.region.note, entrants_score)
+
+        return entrants_score, breakdown
 
-        print()
-        print('Top Player Points: ')
+    def render_result(self):
+        """Builds the text report for this result."""
+
+        if self.report is not None:
+            return self.report
+
+        lines = []
+
+        lines.append('{} - {} ({}){}'.format(self.tournament, self.event,
+                                             self.slug, ' (invitational)' if self.is_invitational else ''))
+        lines.append('Phases used: {}'.format(str(self.phases)))
+        if self.pruned is not None:
+            lines.append('DQs not checked: {}'.format(self.pruned))
+        lines.append('')
+
+        if not self.should_count():
+            lines.append('WARNING: This tournament does not meet the criteria of at least {} entrants or a score of at least {} with {} qualified players'.format(
+                self.region.entrant_floor, self.region.score_floor, NUM_PLAYERS_FLOOR))
+            lines.append('')
+        elif not self.should_count_strict():
+            lines.append('WARNING: This tournament may not meet the criteria of at least {} entrants or a score of at least {} with {} qualified players'.format(
+                self.region.entrant_floor, self.region.score_floor, NUM_PLAYERS_FLOOR))
+            lines.append('')
+
+        lines.append('Entrants: {}'.format(self.entrant_score()[1]))
+
+        lines.append('')
+        lines.append('Top Player Points: ')
 
         for participant in self.values:
-            print('  {}'.format(str(participant)))
+            lines.append('  {}'.format(str(participant)))
 
-        print()
-        print('Total Score: {}'.format(self.score))
+        lines.append('')
+        lines.append('Total Score: {}'.format(self.score))
 
         if len(self.dqs) > 0:
-            print()
-            print('-----')
-            print('DQs')
+            lines.append('')
+            lines.append('-----')
+            lines.append('DQs')
             for dq in self.dqs:
-                print('  {}'.format(str(dq)))
+                lines.append('  {}'.format(str(dq)))
 
         if len(self.potential) > 0:
-            print()
-            print('-----')
-            print('Potentially Mismatched Players')
+            lines.append('')
+            lines.append('-----')
+            lines.append('Potentially Mismatched Players')
             for match in self.potential:
-                print('  {}'.format(str(match)))
+                lines.append('  {}'.format(str(match)))
+
+        lines.append('')
+
+        return '\n'.join(lines)
+
+    def write_result(self, filelike=None):
+        """Writes the text report to the given file, or to stdout if none is given."""
+
+        if filelike == None:
+            filelike = sys.stdout
+
+        filelike.write(self.render_result())
+
+    def to_dict(self):
+        """Returns the breakdown of this result in a JSON-serializable form."""
+
+        if self.serialized is not None:
+            return json.loads(self.serialized)
+
+        entrants_score, entrants_breakdown = self.entrant_score()
+
+        return {'slug': self.slug,
+                'tournament': self.tournament,
+                'event': self.event,
+                'date': self.date.isoformat(),
+                'is_invitational': self.is_invitational,
+                'phases': list(self.phases),
+                'pruned': self.pruned,
+                'upper_bound': self.pruned is not None,
+                'region': {'description': str(self.region),
+                           'note': self.region.note,
+                           'multiplier': self.region.multiplier},
+                'floors': {'entrants': self.region.entrant_floor,
+                           'score': self.region.score_floor,
+                           'num_players': NUM_PLAYERS_FLOOR},
+                'entrants': self.entrants,
+                'dq_count': self.dq_count,
+                'entrants_score': entrants_score,
+                'entrants_breakdown': entrants_breakdown,
+                'score': self.score,
+                'max_potential_score': self.max_potential_score(),
+                'should_count': self.should_count(),
+                'should_count_strict': self.should_count_strict(),
+                'values': [value.to_dict() for value in self.values],
+                'dqs': [dq.to_dict() for dq in self.dqs],
+                'potential': [match.to_dict() for match in self.potential],
+                'attendees': [[attendee.id_, attendee.tag] for attendee in self.attendees]}
+
+    def to_json(self):
+        if self.serialized is not None:
+            return self.serialized
+
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def compact(self):
+        """Renders the report and breakdown ahead of time, and drops the player lists they're built from.
+
+        Text takes much less memory than the objects it's rendered from, which matters
+        when thousands of results are kept until a run ends. Everything but the lists of
+        players keeps working afterwards.
+        """
+
+        self.max_potential_score()
+        self.counts = (self.should_count(), self.should_count_strict())
+        self.report = self.render_result()
+        self.serialized = self.to_json()
 
-        sys.stdout = original_stdout
+        self.values = None
+        self.dqs = None
+        self.potential = None
+        self.attendees = None
+
+        return self
 
     def max_potential_score(self):
         if self.max_score != None:
@@ -295,9 +462,15 @@ class TournamentTieringResult:
         return potential_score
 
     def should_count_strict(self):
+        if self.counts is not None:
+            return self.counts[1]
+
         return self.entrants >= self.region.entrant_floor or (self.score >= self.region.score_floor and len(self.values) >= NUM_PLAYERS_FLOOR)
 
     def should_count(self):
+        if self.counts is not None:
+            return self.counts[0]
+
         return self.entrants >= self.region.entrant_floor or (self.max_potential_score() >= self.region.score_floor and len(self.values) + len(self.potential) + len(self.dqs) >= NUM_PLAYERS_FLOOR)
 
 
@@ -452,15 +625,29 @@ class Entrant:
 class Tournament:
     """Stores tournament info/metadata."""
 
-    def __init__(self, event_slug, is_invitational=False, location=True):
-        """Populates tournament metadata with tournament slug/invitational status."""
+    def __init__(self, event_slug, is_invitational=False, location=True, full_detail=True, metadata=None):
+        """Populates tournament metadata with tournament slug/invitational status.
+
+        If full_detail is False, sets are only checked for DQs if the DQs could change
+        whether the event counts. metadata holds event details that are already known,
+        like the ones found by ultrank_search ('tournament', 'event', 'start_at', 'lat'
+        and 'lng') or the address looked up by ultrank_shard ('address'), so they aren't
+        fetched again.
+        """
 
         self.event_slug = isolate_slug(event_slug)
         self.is_invitational = is_invitational
         self.tier = None
+        self.names = None
         self.use_location = location
+        self.full_detail = full_detail
+        self.pruned = None
+        self.metadata = metadata if metadata is not None else {}
 
-        self.gather_entrant_counts()
+        if self.metadata.get('tournament') is not None and self.metadata.get('event') is not None:
+            self.names = {'tournament': self.metadata['tournament'], 'event': self.metadata['event']}
+
+        # The region and date are needed to tell whether DQs have to be checked
         if self.use_location:
             self.gather_location_info()
         else:
@@ -469,30 +656,30 @@ class Tournament:
             print(self.address)
         self.retrieve_start_time()
 
+        self.gather_entrant_counts()
+
     def gather_entrant_counts(self):
         # Check if the event has progressed enough to detect DQs.
         self.total_dqs = -1  # Placeholder value
 
-        event_progressed = check_phase_completed(self.event_slug)
-
-        if event_progressed:
-            self.phases = collect_phases(self.event_slug)
+        phases = collect_phases(self.event_slug)
+        event_progressed = any(phase.get('state', '') == 'COMPLETED' for phase in phases)
 
-            self.dq_list, self.participants = get_dqs(
-                self.event_slug, phase_ids=[phase['id'] for phase in self.phases])
+        entrants = get_entrant_map(self.event_slug)
 
-            self.total_dqs = 0
+        if event_progressed and not self.full_detail:
+            self.pruned = self.check_outcome_without_dqs(entrants)
 
-            participant_ids = [part.id_ for part in self.participants]
+        if event_progressed and self.pruned is None:
+            self.phases = phases
 
-            for player_id, _ in self.dq_list.items():
-                if player_id not in participant_ids:
-                    self.total_dqs += 1
+            self.dq_list, self.participants = get_dqs(
+                self.event_slug, phase_ids=[phase['id'] for phase in self.phases], entrants=entrants)
 
-            self.total_entrants = len(self.participants) + self.total_dqs
+            self.count_set_entrants()
 
         else:
-            self.participants = get_entrants(self.event_slug)
+            self.participants = set(entrants.values())
             self.dq_list = {}
             self.total_dqs = -1
             self.total_entrants = len(self.participants)
@@ -501,19 +688,61 @@ class Tournament:
         # Comment out if subtracting generic entrant dqs
         self.total_dqs = -1
 
-    def gather_location_info(self):
-        geo = Nominatim(user_agent='ultrank', timeout=10)
+    def check_outcome_without_dqs(self, entrants):
+        """Decides whether the event counts using only its entrant list.
 
-        query, variables = location_query(self.event_slug)
-        resp = send_request(query, variables)
+        Returns the reason if it's already decided, or None if the sets have to be checked.
+        """
 
-        try:
-            self.lat = resp['data']['event']['tournament']['lat']
-            self.lng = resp['data']['event']['tournament']['lng']
-        except Exception as e:
-            print(e)
-            print(resp)
-            raise e
+        region = find_region(self.address, self.start_time)
+
+        if PRUNE_ENTRANT_MARGIN is not None and len(entrants) * (1 - PRUNE_ENTRANT_MARGIN) >= region.entrant_floor:
+            return 'clears the entrant floor of {} by a wide margin'.format(region.entrant_floor)
+
+        # Scored as if every entrant played without DQs. DQs and entrants that never played can
+        # only lower the score and entrant count, so this is an upper bound.
+        self.participants = set(entrants.values())
+        self.dq_list = {}
+        self.total_entrants = len(self.participants)
+        self.phases = []
+
+        upper_bound = self.calculate_tier()
+        self.tier = None
+
+        if not upper_bound.should_count():
+            return 'can\'t meet the requirements even with no DQs'
+
+        return None
+
+    def count_set_entrants(self):
+        """Counts entrants from the participants and DQs found in sets."""
+
+        self.total_dqs = 0
+
+        participant_ids = set(part.id_ for part in self.participants)
+
+        for player_id, _ in self.dq_list.items():
+            if player_id not in participant_ids:
+                self.total_dqs += 1
+
+        self.total_entrants = len(self.participants) + self.total_dqs
+
+    def gather_location_info(self):
+        if self.metadata.get('lat') is not None and self.metadata.get('lng') is not None:
+            self.lat, self.lng = self.metadata['lat'], self.metadata['lng']
+        elif self.event_slug in event_locations:
+            self.lat, self.lng = event_locations[self.event_slug]
+        else:
+            query, variables = location_query(self.event_slug)
+            resp = send_request(query, variables)
+
+            try:
+                self.lat = resp['data']['event']['tournament']['lat']
+                self.lng = resp['data']['event']['tournament']['lng']
+            except Exception as e:
+                print(e)
+                print(resp)
+                raise e
 
         if ADDRESS_DEBUG:
             print(self.lat)
@@ -523,19 +752,20 @@ class Tournament:
             self.address = {'country_code': 'aq'}
             return
 
-        # Try 10 times
-        for i in range(5):
-            try:
-                self.address = geo.reverse('{}, {}'.format(
-                    self.lat, self.lng)).raw['address']
-                break
-            except Exception:
-                print(f'Nominatim error {i}')
-                pass
+        if self.metadata.get('address') is not None:
+            self.address = self.metadata['address']
+            return
 
-        # print(self.address)
+        address = reverse_geocode(self.lat, self.lng)
+
+        if address is not None:
+            self.address = address
 
     def retrieve_start_time(self):
+        if self.metadata.get('start_at') is not None:
+            self.start_time = datetime.date.fromtimestamp(self.metadata['start_at'])
+            return
+
         query, variables = time_query(self.event_slug)
         resp = send_request(query, variables)
 
@@ -556,25 +786,19 @@ class Tournament:
         # add things up
         total_score = 0
 
-        # Entrant score
-        best_match = 0
-        best_region = None
+        players, _, regions = current_rankings()
+        tag_index = get_tag_index(players)
 
-        for region in region_mults:
-            match = region.match(self.address, time=self.start_time)
-            if ADDRESS_DEBUG and match != 0:
-                print('{} {}'.format(match, str(region)))
-            if match > best_match:
-                best_region = region
-                best_match = match
+        # Entrant score
+        best_region = find_region(self.address, self.start_time, regions)
 
         if self.start_time > NEW_MULT_SYSTEM_DATE:
             total_score += self.total_entrants
 
             if best_region.multiplier >= 2:
-                total_score += min(256, self.total_entrants)
+                total_score += min(MULTIPLIER_CAPS[2], self.total_entrants)
             if best_region.multiplier >= 3:
-                total_score += min(128, self.total_entrants)
+                total_score += min(MULTIPLIER_CAPS[3], self.total_entrants)
         else:
             total_score += self.total_entrants * best_region.multiplier
 
@@ -587,8 +811,8 @@ class Tournament:
                 # Only count fully participating players towards points
 
                 continue
-            if participant.id_ in scored_players:
-                player_value = scored_players[participant.id_].retrieve_value(
+            if participant.id_ in players:
+                player_value = players[participant.id_].retrieve_value(
                     self, invitational=self.is_invitational)
 
                 if player_value != None:
@@ -598,22 +822,22 @@ class Tournament:
 
                     valued_participants.append(CountedValue(
                         player_value, score, participant.tag))
-            elif participant.tag.lower() in scored_tags:
-                for player_value_group in scored_players.values():
-                    if player_value_group.match_tag(participant.tag):
-                        player_value = player_value_group.retrieve_value(self, invitational=self.is_invitational)
+            else:
+                for player_id, similarity in tag_index.candidates(participant.tag, fuzzy=FUZZY_TAG_MATCHING):
+                    player_value = players[player_id].retrieve_value(self, invitational=self.is_invitational)
 
-                        if player_value != None:
-                            score = player_value.points
-                            potential_matches.append(PotentialMatchWithDqs(
-                                participant.tag, participant.id_, score, player_value.note, player_value.tag))
+                    if player_value != None:
+                        score = player_value.points
+                        potential_matches.append(PotentialMatchWithDqs(
+                            participant.tag, participant.id_, score, match_note(player_value.note, similarity), player_value.tag,
+                            candidate_id=player_id))
 
         # Loop through players with DQs
         participants_with_dqs = []
 
         for participant, num_dqs in self.dq_list.values():
-            if participant.id_ in scored_players:
-                player_value = scored_players[participant.id_].retrieve_value(
+            if participant.id_ in players:
+                player_value = players[participant.id_].retrieve_value(
                     self, invitational=self.is_invitational)
 
                 if player_value != None:
@@ -621,15 +845,15 @@ class Tournament:
 
                     participants_with_dqs.append(DisqualificationValue(
                         CountedValue(player_value, score, participant.tag), num_dqs))
-            elif participant.tag.lower() in scored_tags:
-                for player_value_group in scored_players.values():
-                    if player_value_group.match_tag(participant.tag):
-                        player_value = player_value_group.retrieve_value(self, invitational=self.is_invitational)
+            else:
+                for player_id, similarity in tag_index.candidates(participant.tag, fuzzy=FUZZY_TAG_MATCHING):
+                    player_value = players[player_id].retrieve_value(self, invitational=self.is_invitational)
 
-                        if player_value != None:
-                            score = player_value.points
-                            potential_matches.append(PotentialMatchWithDqs(
-                                participant.tag, participant.id_, score, player_value.note, player_value.tag, num_dqs))
+                    if player_value != None:
+                        score = player_value.points
+                        potential_matches.append(PotentialMatchWithDqs(
+                            participant.tag, participant.id_, score, match_note(player_value.note, similarity), player_value.tag, num_dqs,
+                            candidate_id=player_id))
 
         # Sort for readability
         valued_participants.sort(key=lambda p: (-1 * p.points, p.player_value.category, p.player_value.note))
@@ -639,10 +863,219 @@ class Tournament:
 
         self.tier = TournamentTieringResult(self.event_slug, total_score, self.total_entrants, best_region, valued_participants,
                                             participants_with_dqs, potential_matches, self.start_time, is_invitational=self.is_invitational,
-                                            phases=[phase['name'] for phase in self.phases], dq_count=self.total_dqs)
+                                            phases=[phase['name'] for phase in self.phases], dq_count=self.total_dqs, names=self.names,
+                                            attendees=sorted(self.participants, key=lambda part: str(part.id_)), pruned=self.pruned)
+        self.names = {'tournament': self.tier.tournament, 'event': self.tier.event}
 
         return self.tier
 
+    def release_raw_data(self):
+        """Drops the data fetched from start.gg once the event is scored, keeping only its result.
+
+        The tournament can't be snapshotted or scored differently afterwards.
+        """
+
+        self.calculate_tier()
+
+        self.participants = None
+        self.dq_list = None
+        self.phases = None
+        self.metadata = None
+
+    def to_snapshot(self):
+        """Returns the fetched event data in a JSON-serializable form, so the event
+        can be scored again later without querying start.gg.
+        """
+
+        return {'slug': self.event_slug,
+                'is_invitational': self.is_invitational,
+                'start_time': self.start_time.isoformat(),
+                'address': self.address,
+                'total_entrants': self.total_entrants,
+                'total_dqs': self.total_dqs,
+                'phases': self.phases,
+                'participants': [[part.id_, part.tag] for part in self.participants],
+                'dq_list': [[part.id_, part.tag, num_dqs] for part, num_dqs in self.dq_list.values()],
+                'pruned': self.pruned}
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuilds a tournament from data returned by to_snapshot."""
+
+        tournament = cls.__new__(cls)
+
+        tournament.event_slug = snapshot['slug']
+        tournament.is_invitational = snapshot['is_invitational']
+        tournament.tier = None
+        tournament.names = None
+        tournament.use_location = True
+        tournament.full_detail = snapshot.get('pruned') is None
+        tournament.pruned = snapshot.get('pruned')
+        tournament.start_time = datetime.date.fromisoformat(snapshot['start_time'])
+        tournament.address = snapshot['address']
+        tournament.total_entrants = snapshot['total_entrants']
+        tournament.total_dqs = snapshot['total_dqs']
+        tournament.phases = snapshot['phases']
+        tournament.participants = set(Entrant(id_, tag) for id_, tag in snapshot['participants'])
+        tournament.dq_list = {id_: [Entrant(id_, tag), num_dqs] for id_, tag, num_dqs in snapshot['dq_list']}
+
+        return tournament
+
+
+def match_note(note, similarity):
+    """Adds the similarity of the tags to the note of a potential match that isn't exact."""
+
+    if similarity >= 1:
+        return note
+
+    return '{}; similar tag, {:.0%}'.format(note, similarity)
+
+
+def find_region(address, time, regions=None):
+    """Finds the region that best matches an address at the given time."""
+
+    if regions is None:
+        regions = current_rankings()[2]
+
+    best_match = 0
+    best_region = None
+
+    for region in regions:
+        match = region.match(address, time=time)
+        if ADDRESS_DEBUG and match != 0:
+            print('{} {}'.format(match, str(region)))
+        if match > best_match:
+            best_region = region
+            best_match = match
+
+    return best_region
+
+
+def reverse_geocode(lat, lng):
+    """Looks up the address at a pair of coordinates, reusing previous lookups."""
+
+    started = time.time()
+
+    try:
+        with address_cache_lock:
+            pending = pending_addresses.get((lat, lng))
+
+        # Wait for the background lookup instead of requesting the same address again
+        if pending is not None:
+            pending.wait()
+
+        with address_cache_lock:
+            if (lat, lng) in address_cache:
+                return address_cache[(lat, lng)]
+
+        return lookup_address(lat, lng)
+    finally:
+        add_network_wait(time.time() - started)
+
+
+def lookup_address(lat, lng):
+    """Looks up the address at a pair of coordinates through Nominatim, and caches it."""
+
+    global geolocator, last_nominatim_request
+
+    with address_cache_lock:
+        if geolocator is None:
+            # Only loaded once an address actually has to be looked up
+            from geopy.geocoders import Nominatim
+
+            geolocator = Nominatim(user_agent='ultrank', timeout=10)
+
+    # Try 5 times
+    for i in range(5):
+        try:
+            with nominatim_lock:
+                throttle = max(0, last_nominatim_request + NOMINATIM_INTERVAL - time.time())
+                ultrank_metrics.nominatim_throttle.inc(amount=throttle)
+                time.sleep(throttle)
+
+                sent = time.time()
+
+                try:
+                    address = geolocator.reverse('{}, {}'.format(
+                        lat, lng)).raw['address']
+                finally:
+                    last_nominatim_request = time.time()
+                    ultrank_metrics.nominatim_latency.observe(last_nominatim_request - sent)
+        except Exception:
+            print(f'Nominatim error {i}')
+            ultrank_metrics.nominatim_requests.inc('error')
+            continue
+
+        ultrank_metrics.nominatim_requests.inc('ok')
+
+        with address_cache_lock:
+            address_cache[(lat, lng)] = address
+
+        return address
+
+    return None
+
+
+def prefetch_locations(event_slugs, known_locations=None):
+    """Fetches the coordinates of many events at once, and starts looking up their addresses.
+
+    Addresses are looked up in a background thread, once per distinct pair of
+    coordinates, so events at the same venue only cost one Nominatim request.
+    Tournaments created afterwards use the fetched coordinates, and wait for their
+    address if it hasn't been looked up yet. known_locations maps slugs to coordinates
+    that are already known, which aren't fetched again. Returns the background thread.
+    """
+
+    if known_locations is not None:
+        event_locations.update(known_locations)
+
+    event_slugs = list(dict.fromkeys(event_slugs))
+    missing_slugs = [slug for slug in event_slugs if slug not in event_locations]
+
+    for i in range(0, len(missing_slugs), LOCATION_BATCH_SIZE):
+        batch = missing_slugs[i:i + LOCATION_BATCH_SIZE]
+
+        query, variables = locations_query(batch)
+        resp = send_request(query, variables)
+
+        try:
+            for j, slug in enumerate(batch):
+                event = resp['data']['e{}'.format(j)]
+
+                # Events that don't exist are left for gather_location_info to report
+                if event is not None:
+                    event_locations[slug] = (event['tournament']['lat'], event['tournament']['lng'])
+        except Exception as e:
+            print(e)
+            print(resp)
+
+    coordinates = []
+
+    with address_cache_lock:
+        for lat, lng in dict.fromkeys(event_locations[slug] for slug in event_slugs if slug in event_locations):
+            # Online events have no location, and Antarctic ones aren't looked up
+            if lat is None or lng is None or lat < -80:
+                continue
+
+            if (lat, lng) not in address_cache and (lat, lng) not in pending_addresses:
+                pending_addresses[(lat, lng)] = threading.Event()
+                coordinates.append((lat, lng))
+
+    print('looking up {} addresses for {} events'.format(len(coordinates), len(event_slugs)))
+
+    def lookup_addresses():
+        for lat, lng in coordinates:
+            try:
+                lookup_address(lat, lng)
+            finally:
+                with address_cache_lock:
+                    pending_addresses.pop((lat, lng)).set()
+
+    thread = threading.Thread(target=lookup_addresses, daemon=True)
+    thread.start()
+
+    return thread
+
 
 def entrants_query(event_slug, page_num=1, per_page=200):
     query = '''query getEntrants($eventSlug: String!, $pageNum: Int!, $perPage: Int!) {
@@ -657,6 +1090,7 @@ def entrants_query(event_slug, page_num=1, per_page=200):
                     totalPages
                 }
                 nodes {
+                    id
                     participants {
                         player {
                             gamerTag
@@ -675,28 +1109,27 @@ def entrants_query(event_slug, page_num=1, per_page=200):
     return query, variables
 
 
-def sets_query(event_slug, page_num=1, per_page=50, phases=None):
-    """Generates a query to retrieve sets from an event."""
+def sets_query(event_slug, page_num=1, per_page=80, phases=None, updated_after=None):
+    """Generates a query to retrieve sets from an event.
+
+    Only entrant IDs are retrieved for each slot; they can be matched to players
+    with get_entrant_map. If updated_after is given, only sets updated after that
+    timestamp are retrieved.
+    """
 
-    query = '''query getSets($eventSlug: String!, $pageNum: Int!, $perPage: Int!, $phases: [ID]!) {
+    query = '''query getSets($eventSlug: String!, $pageNum: Int!, $perPage: Int!, $phases: [ID]!%s) {
   event(slug: $eventSlug) {
-    sets(page: $pageNum, perPage: $perPage, filters:{ state: [3], phaseIds: $phases}) {
+    sets(page: $pageNum, perPage: $perPage, filters:{ state: [3], phaseIds: $phases%s}) {
       pageInfo {
         page
         totalPages
       }
       nodes {
-        wPlacement
+        id
         winnerId
         slots {
           entrant {
             id
-            participants {
-              player {
-                gamerTag
-                id
-              }
-            }
           }
           standing {
             stats {
@@ -714,8 +1147,15 @@ def sets_query(event_slug, page_num=1, per_page=50, phases=None):
         "eventSlug": "{}",
         "pageNum": {},
         "perPage": {},
-        "phases": {}
-    }}'''.format(event_slug, page_num, per_page, f'{phases if phases is not None else "[]"}')
+        "phases": {}{}
+    }}'''.format(event_slug, page_num, per_page, f'{phases if phases is not None else "[]"}',
+                 f',\n        "updatedAfter": {updated_after}' if updated_after is not None else '')
+
+    if updated_after is not None:
+        query = query % (', $updatedAfter: Timestamp', ', updatedAfter: $updatedAfter')
+    else:
+        query = query % ('', '')
+
     return query, variables
 
 
@@ -759,6 +1199,27 @@ def location_query(event_slug):
     return query, variables
 
 
+def locations_query(event_slugs):
+    """Generates a query to retrieve the locations of several events at once.
+
+    The event with slug event_slugs[i] is returned as e{i}.
+    """
+
+    events = ''.join('''  e{0}: event(slug: $slug{0}) {{
+    tournament {{
+      lat
+      lng
+    }}
+  }}
+'''.format(i) for i in range(len(event_slugs)))
+
+    query = 'query getLocs({}) {{\n{}}}'.format(
+        ', '.join('$slug{}: String'.format(i) for i in range(len(event_slugs))), events)
+    variables = json.dumps({'slug{}'.format(i): slug for i, slug in enumerate(event_slugs)})
+
+    return query, variables
+
+
 def time_query(event_slug):
     """Generates a query to retrieve the start time of an event.
     """
@@ -793,28 +1254,19 @@ def name_query(event_slug):
     return query, variables
 
 
-def get_sets_in_phases(event_slug, phase_ids):
-    """Collects all the sets in a group of phases."""
+def get_sets_in_phases(event_slug, phase_ids, updated_after=None):
+    """Collects all the sets in a group of phases.
 
-    page = 1
+    If updated_after is given, only sets updated after that timestamp are collected.
+    """
 
     sets = []
 
-    while True:
-        query, variables = sets_query(
-            event_slug, page_num=page, phases=phase_ids)
-        resp = send_request(query, variables)
-
-        try:
-            sets.extend(resp['data']['event']['sets']['nodes'])
-        except Exception as e:
-            print(e)
-            print(resp)
-            raise e
-
-        if page >= resp['data']['event']['sets']['pageInfo']['totalPages']:
-            break
-        page += 1
+    for _, connection in paginate(
+            lambda page, per_page: sets_query(event_slug, page_num=page, per_page=per_page, phases=phase_ids,
+                                              updated_after=updated_after),
+            lambda resp: resp['data']['event']['sets'], default_size=80):
+        sets.extend(connection['nodes'])
 
     return sets
 
@@ -851,85 +1303,106 @@ def collect_phases(event_slug):
 
 
 def get_entrants(event_slug):
-    page = 1
-    participants = set()
+    return set(get_entrant_map(event_slug).values())
 
-    while True:
-        query, variables = entrants_query(event_slug, page_num=page)
-        resp = send_request(query, variables)
 
-        for entrant in resp['data']['event']['entrants']['nodes']:
+def get_entrant_map(event_slug):
+    """Maps the entrant IDs of an event to the players they belong to."""
+
+    entrants = {}
+
+    for resp, connection in paginate(lambda page, per_page: entrants_query(event_slug, page_num=page, per_page=per_page),
+                                     lambda resp: resp['data']['event']['entrants'], default_size=200):
+        for entrant in connection['nodes']:
             try:
                 player_data = Entrant(
                     entrant['participants'][0]['player']['id'], entrant['participants'][0]['player']['gamerTag'])
 
-                participants.add(player_data)
+                entrants[entrant['id']] = player_data
             except Exception as e:
                 print(e)
                 print(resp)
                 print(entrant)
                 # raise e
 
-        if page >= resp['data']['event']['entrants']['pageInfo']['totalPages']:
-            break
-        page += 1
+    return entrants
 
-    return participants
 
+def classify_set(set_data, entrants):
+    """Decides whether a completed set was a DQ.
 
-def get_dqs(event_slug, phase_ids=None):
-    """Retrieves DQs of an event."""
+    entrants maps entrant IDs to players, as returned by get_entrant_map.
+    Returns ('dq', loser) for DQs, ('played', (entrant_0, entrant_1)) for sets that were
+    played, and None for sets that can't be used.
+    """
 
-    dq_list = {}
-    participants = set()
+    if set_data['winnerId'] == None:
+        return None
 
-    for set_data in get_sets_in_phases(event_slug, phase_ids):
-        if set_data['winnerId'] == None:
-            continue
+    if len(set_data['slots']) < 2:
+        return None
+    if set_data['slots'][0]['entrant'] is None or set_data['slots'][1]['entrant'] is None:
+        return None
 
-        if len(set_data['slots']) < 2:
-            continue
-        if set_data['slots'][0]['entrant'] is None or set_data['slots'][1]['entrant'] is None:
-            continue
+    try:
+        loser = 1 if set_data['winnerId'] == set_data['slots'][0]['entrant']['id'] else 0
 
-        try:
-            loser = 1 if set_data['winnerId'] == set_data['slots'][0]['entrant']['id'] else 0
+        player_data_0 = entrants[set_data['slots'][0]['entrant']['id']]
+        player_data_1 = entrants[set_data['slots'][1]['entrant']['id']]
+        player_data_loser = player_data_0 if loser == 0 else player_data_1
 
-            player_data_0 = Entrant(set_data['slots'][0]['entrant']['participants'][0]['player']
-                                    ['id'], set_data['slots'][0]['entrant']['participants'][0]['player']['gamerTag'])
-            player_data_1 = Entrant(set_data['slots'][1]['entrant']['participants'][0]['player']
-                                    ['id'], set_data['slots'][1]['entrant']['participants'][0]['player']['gamerTag'])
-            player_data_loser = player_data_0 if loser == 0 else player_data_1
+        if set_data['slots'][0]['standing'] == None and set_data['slots'][1]['standing'] == None:
+            return ('dq', player_data_loser)
 
-            if set_data['slots'][0]['standing'] == None and set_data['slots'][1]['standing'] == None:
-                player_id = set_data['slots'][loser]['entrant']['participants'][0]['player']['id']
+        game_count = set_data['slots'][loser]['standing']['stats']['score']['value']
 
-                if player_id in dq_list.keys():
-                    dq_list[player_id][1] += 1
-                else:
-                    dq_list[player_id] = [player_data_loser, 1]
-                continue
+        if game_count == -1:
+            return ('dq', player_data_loser)
 
-            game_count = set_data['slots'][loser]['standing']['stats']['score']['value']
+        # not a dq, record both players as participants
+        return ('played', (player_data_0, player_data_1))
+    except Exception as e:
+        print(set_data)
+        print(e)
 
-            if game_count == -1:
-                player_id = set_data['slots'][loser]['entrant']['participants'][0]['player']['id']
+    return None
 
-                if player_id in dq_list.keys():
-                    dq_list[player_id][1] += 1
-                else:
-                    dq_list[player_id] = [player_data_loser, 1]
+
+def tally_sets(classified_sets):
+    """Builds the DQ list and participants from the output of classify_set."""
+
+    dq_list = {}
+    participants = set()
+
+    for classified in classified_sets:
+        if classified is None:
+            continue
+
+        kind, entrants = classified
+
+        if kind == 'dq':
+            if entrants.id_ in dq_list.keys():
+                dq_list[entrants.id_][1] += 1
             else:
-                # not a dq, record both players as participants
-                participants.add(player_data_0)
-                participants.add(player_data_1)
-        except Exception as e:
-            print(set_data)
-            print(e)
+                dq_list[entrants.id_] = [entrants, 1]
+        else:
+            participants.update(entrants)
 
     return dq_list, participants
 
 
+def get_dqs(event_slug, phase_ids=None, entrants=None):
+    """Retrieves DQs of an event.
+
+    entrants is the event's entrant map (see get_entrant_map), and is fetched if not given.
+    """
+
+    if entrants is None:
+        entrants = get_entrant_map(event_slug)
+
+    return tally_sets(classify_set(set_data, entrants) for set_data in get_sets_in_phases(event_slug, phase_ids))
+
+
 def get_name(event_slug):
     query, variables = name_query(event_slug)
     resp = send_request(query, variables)
@@ -1041,20 +1514,119 @@ def read_regions():
     return regions
 
 
-scored_players, scored_tags = read_players()
-region_mults = read_regions()
+def group_from_record(id_, hex_, tag, other_tags, values, invitational_values):
+    """Builds a player value group from a compiled player table record."""
+
+    group = PlayerValueGroup(id_, hex_, tag, other_tags)
+
+    group.values = [PlayerValue(id_, hex_, tag, points, category, note, start_time, end_time, depreciated_from)
+                    for points, category, note, start_time, end_time, depreciated_from in values]
+    group.invitational_values = [PlayerValue(id_, hex_, tag, points, category, note, start_time, end_time)
+                                 for points, category, note, start_time, end_time, _ in invitational_values]
+
+    return group
+
+
+def read_rankings():
+    """Reads player values, known tags and region multipliers."""
+
+    path = os.environ.get(PLAYER_TABLE_ENV, '')
+
+    if path != '':
+        from ultrank_player_table import MappedPlayerTable
+
+        players = MappedPlayerTable(path, group_from_record)
+        tags = players.tags
+    else:
+        players, tags = read_players()
+
+    return players, tags, read_regions()
+
+
+def use_player_table(path):
+    """Switches to reading player values from a compiled player table."""
+
+    os.environ[PLAYER_TABLE_ENV] = path
+    reload_rankings()
+
+
+def get_tag_index(players):
+    """Returns the tag index for a set of player values, building it on first use."""
+
+    global tag_index
+
+    with tag_index_lock:
+        if tag_index is None or tag_index[0] is not players:
+            tag_index = (players, TagIndex(players))
+
+        return tag_index[1]
+
+
+def current_rankings():
+    """Returns the player values, known tags and region multipliers currently in use.
+
+    The ranking CSVs are read the first time this is called.
+    """
+
+    global scored_players, scored_tags, region_mults
+
+    with rankings_lock:
+        if region_mults is None:
+            scored_players, scored_tags, region_mults = read_rankings()
+
+        return scored_players, scored_tags, region_mults
+
+
+def reload_rankings():
+    """Rereads the ranking CSVs, and swaps them in once they're fully loaded."""
+
+    global scored_players, scored_tags, region_mults
+
+    players, tags, regions = read_rankings()
+
+    with rankings_lock:
+        scored_players, scored_tags, region_mults = players, tags, regions
+
+
+# Ranking data can be swapped out by reload_rankings while events are being scored,
+# so everything that needs more than one of these takes them through current_rankings.
+# They aren't read until they're needed, so importing this module stays fast.
+rankings_lock = threading.Lock()
+scored_players, scored_tags, region_mults = None, None, None
+
+# Player values the index was built for, and the index itself
+tag_index = None
+tag_index_lock = threading.Lock()
 
 if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Score a single event.')
+    parser.add_argument('--profile', action='store_true',
+                        help='write a profile of the scoring to the current directory (see ultrank_profile.py)')
+    args = parser.parse_args()
+
     event_slug = input('input event url: ')
 
     is_invitational = input('is this an invitational? (y/n) ')
     is_invitational = is_invitational.lower() == 'y' or is_invitational.lower() == 'yes'
 
-    tournament = Tournament(event_slug, is_invitational)
+    def score():
+        return Tournament(event_slug, is_invitational).calculate_tier()
+
+    if args.profile:
+        from ultrank_profile import EventProfiler
+
+        profiler = EventProfiler('.')
+        result = profiler.run(isolate_slug(event_slug).replace('tournament/', '').replace('/event/', '_'), score)
+    else:
+        result = score()
 
-    result = tournament.calculate_tier()
     result.write_result()
 
     print()
     print('Maximum potential total: {}'.format(
         int(result.max_potential_score())))
+
+    if args.profile:
+        profiler.write_summary()